@@ -1,5 +1,6 @@
-import discord
 import time
+STARTED_AT = time.perf_counter()  # Startup phases are timed from here
+import discord
 import json
 import os
 import asyncio
@@ -7,40 +8,891 @@ from discord.ext import commands
 from datetime import timedelta
 import random
 import aiosqlite
+import contextlib
+import heapq
+import itertools
+from collections import OrderedDict, deque
+from array import array
+import math
+import bisect
+import contextvars
+import numpy as np
+import sqlite3
+import csv
+import gzip
+import tempfile
+import argparse
+
+DB_PATH = 'pets.db'
+DB_POOL_SIZE = 4  # Number of read-only connections kept open next to the single writer
+# Unix socket of a running write service (python Sophia.py --db-service); when set, every
+# write goes through it instead of this process opening its own writer connection
+DB_SERVICE_SOCKET = os.environ.get("SOPHIA_DB_SERVICE")
+DB_SERVICE_WINDOW = 0.005  # Seconds the service waits for more transactions before committing
+DB_SERVICE_BATCH = 256  # Transactions after which the service commits without waiting
+DB_SERVICE_CHUNK = 5000  # executemany rows sent per request
+DB_SERVICE_LINE_LIMIT = 64 * 2**20  # Largest request or reply line, in bytes
+
+# Pragmas applied once to every pooled connection when it is opened
+DB_PRAGMAS = (
+    "PRAGMA auto_vacuum=INCREMENTAL",  # Lets checkpoints hand free pages back (new databases only)
+    "PRAGMA journal_mode=WAL",       # Readers don't block the writer and vice versa
+    "PRAGMA synchronous=NORMAL",     # Durable across app crashes, fsync only on checkpoint
+    "PRAGMA cache_size=-16000",      # ~16 MB page cache per connection
+    "PRAGMA mmap_size=268435456",    # Map up to 256 MB of the file instead of read() calls
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA busy_timeout=5000",
+)
+
+# Sharding: a process runs the shards listed in SOPHIA_SHARD_IDS (e.g. "0,1") out of
+# SOPHIA_SHARD_COUNT; with neither set, one process runs every shard
+SHARD_COUNT = int(os.environ.get("SOPHIA_SHARD_COUNT", 0)) or None
+SHARD_IDS = [int(i) for i in os.environ["SOPHIA_SHARD_IDS"].split(",")] if os.environ.get("SOPHIA_SHARD_IDS") else None
+if SHARD_IDS is not None and SHARD_COUNT is None:
+    raise RuntimeError("SOPHIA_SHARD_IDS needs SOPHIA_SHARD_COUNT")
+# Pets are split into this many partitions by guild. It must be a multiple of SHARD_COUNT
+# so each partition belongs to exactly the Discord shard that serves its guilds.
+PET_PARTITIONS = 64
+if SHARD_COUNT is not None and PET_PARTITIONS % SHARD_COUNT:
+    raise RuntimeError(f"SOPHIA_SHARD_COUNT must divide {PET_PARTITIONS}, the number of pet partitions")
+
+def shard_key_for(guild_id):
+    # Discord's shard formula, taken over PET_PARTITIONS instead of the shard count
+    return (guild_id >> 22) % PET_PARTITIONS
+
+def owned_shard_keys():
+    # Partitions whose background work this process does
+    if SHARD_IDS is None:
+        return list(range(PET_PARTITIONS))
+    return [key for key in range(PET_PARTITIONS) if key % SHARD_COUNT in SHARD_IDS]
+
+def is_primary_process():
+    # World-wide jobs (daily coins, weather) run only in the process holding shard 0
+    return SHARD_IDS is None or 0 in SHARD_IDS
+
+PERF_ENABLED = os.environ.get("SOPHIA_PERF", "1") != "0"  # Instrumentation at startup; ~perf on/off switches it
+METRICS_HOST = "127.0.0.1"  # The metrics endpoint is only reachable from this machine
+METRICS_PORT = int(os.environ.get("SOPHIA_METRICS_PORT", 9108))  # 0 turns the endpoint off
+PERF_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)  # Seconds
+PERF_KINDS = ("command", "event", "job")
+
+class Histogram:
+    """Observations counted per latency bucket, the way Prometheus expects them."""
+
+    __slots__ = ("counts", "total", "count")
+
+    def __init__(self):
+        self.counts = [0] * (len(PERF_BUCKETS) + 1)  # The last slot is +Inf
+        self.total = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(PERF_BUCKETS, value)] += 1
+        self.total += value
+        self.count += 1
+
+    def quantile(self, q):
+        # Interpolated inside the bucket the quantile falls in
+        rank = q * self.count
+        seen = 0
+        for i, n in enumerate(self.counts):
+            if n and seen + n >= rank:
+                low = PERF_BUCKETS[i - 1] if i else 0.0
+                high = PERF_BUCKETS[i] if i < len(PERF_BUCKETS) else low
+                return low + (high - low) * (rank - seen) / n
+            seen += n
+        return 0.0
+
+class Span:
+    """Where one command, event or job run spent its time, filled in while it runs."""
+
+    __slots__ = ("metrics", "kind", "name", "start", "db", "api", "queries", "commits", "api_calls", "failed", "_token")
+
+    def __init__(self, metrics, kind, name):
+        self.metrics = metrics
+        self.kind = kind
+        self.name = name
+        self.db = 0.0
+        self.api = 0.0
+        self.queries = 0
+        self.commits = 0
+        self.api_calls = 0
+        self.failed = False
+
+    def __enter__(self):
+        # Everything awaited inside, in this task, is charged to this span
+        self._token = _current_span.set(self)
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        elapsed = time.perf_counter() - self.start
+        _current_span.reset(self._token)
+        if exc_type is not None:
+            self.failed = True
+        self.metrics.record(self, elapsed)
+
+class Timing:
+    """Totals over every run of one command, event or job."""
+
+    __slots__ = ("latency", "errors", "queries", "commits", "api_calls", "db", "api", "python")
+
+    def __init__(self):
+        self.latency = Histogram()
+        self.errors = 0
+        self.queries = 0
+        self.commits = 0
+        self.api_calls = 0
+        self.db = 0.0
+        self.api = 0.0
+        self.python = 0.0
+
+_current_span = contextvars.ContextVar("current_span", default=None)
+_NO_SPAN = contextlib.nullcontext()
+
+def current_span():
+    return _current_span.get()
+
+class Metrics:
+    """Latency histograms and time splits per command, event and job, served to Prometheus."""
+
+    def __init__(self, enabled=PERF_ENABLED):
+        self.enabled = enabled
+        self.timings = {kind: {} for kind in PERF_KINDS}  # kind -> name -> Timing
+        self.gauges = {}  # metric name -> (help, function returning the current value)
+        self.startup = {}  # phase -> seconds after STARTED_AT it was first reached
+        self.since = time.time()
+        self._server = None
+
+    def span(self, name, kind="command"):
+        # Use as `with metrics.span(...) as span:`; span is None while instrumentation is off
+        return Span(self, kind, name) if self.enabled else _NO_SPAN
+
+    def record(self, span, elapsed):
+        timings = self.timings[span.kind]
+        timing = timings.get(span.name)
+        if timing is None:
+            timing = timings[span.name] = Timing()
+        timing.latency.observe(elapsed)
+        timing.errors += span.failed
+        timing.queries += span.queries
+        timing.commits += span.commits
+        timing.api_calls += span.api_calls
+        timing.db += span.db
+        timing.api += span.api
+        timing.python += max(0.0, elapsed - span.db - span.api)
+
+    def wrap_api(self, request):
+        # Discord API time is whatever the wrapped HTTP client spends per request,
+        # rate-limit waits included
+        async def timed_request(*args, **kwargs):
+            span = _current_span.get()
+            if span is None:
+                return await request(*args, **kwargs)
+            start = time.perf_counter()
+            try:
+                return await request(*args, **kwargs)
+            finally:
+                span.api += time.perf_counter() - start
+                span.api_calls += 1
+        return timed_request
+
+    def set_enabled(self, enabled):
+        self.enabled = enabled
+
+    def reset(self):
+        self.timings = {kind: {} for kind in PERF_KINDS}
+        self.since = time.time()
+
+    def gauge(self, name, help_text, value):
+        self.gauges[name] = (help_text, value)
+
+    def mark_startup(self, phase):
+        # Only the first time counts: on_ready, for one, fires again on every reconnect
+        if phase not in self.startup:
+            self.startup[phase] = time.perf_counter() - STARTED_AT
+            return True
+        return False
+
+    def render(self):
+        # Prometheus text exposition format
+        lines = ["# HELP sophia_perf_enabled Whether instrumentation is on.",
+                 "# TYPE sophia_perf_enabled gauge",
+                 f"sophia_perf_enabled {int(self.enabled)}"]
+        bounds = [repr(bound) for bound in PERF_BUCKETS] + ["+Inf"]
+        for kind, timings in self.timings.items():
+            prefix = f"sophia_{kind}"
+            lines += [f"# HELP {prefix}_seconds Latency of each {kind} run.", f"# TYPE {prefix}_seconds histogram"]
+            for name, timing in timings.items():
+                cumulative = 0
+                for bound, n in zip(bounds, timing.latency.counts):
+                    cumulative += n
+                    lines.append(f'{prefix}_seconds_bucket{{{kind}="{name}",le="{bound}"}} {cumulative}')
+                lines.append(f'{prefix}_seconds_sum{{{kind}="{name}"}} {timing.latency.total}')
+                lines.append(f'{prefix}_seconds_count{{{kind}="{name}"}} {timing.latency.count}')
+            for metric, attribute, help_text in (
+                ("errors_total", "errors", "Runs that ended in an error."),
+                ("db_queries_total", "queries", "SQL statements executed."),
+                ("db_commits_total", "commits", "Transactions committed."),
+                ("api_calls_total", "api_calls", "Discord API requests made."),
+            ):
+                lines += [f"# HELP {prefix}_{metric} {help_text}", f"# TYPE {prefix}_{metric} counter"]
+                lines += [f'{prefix}_{metric}{{{kind}="{name}"}} {getattr(timing, attribute)}'
+                          for name, timing in timings.items()]
+            lines += [f"# HELP {prefix}_time_seconds_total Time spent in the database, the Discord API and Python.",
+                      f"# TYPE {prefix}_time_seconds_total counter"]
+            for name, timing in timings.items():
+                for part in ("db", "api", "python"):
+                    lines.append(f'{prefix}_time_seconds_total{{{kind}="{name}",part="{part}"}} {getattr(timing, part)}')
+        lines += ["# HELP sophia_startup_seconds Seconds from process start until each startup phase.",
+                  "# TYPE sophia_startup_seconds gauge"]
+        lines += [f'sophia_startup_seconds{{phase="{phase}"}} {seconds}' for phase, seconds in self.startup.items()]
+        for name, (help_text, value) in self.gauges.items():
+            lines += [f"# HELP {name} {help_text}", f"# TYPE {name} gauge", f"{name} {value()}"]
+        return "\n".join(lines) + "\n"
+
+    async def start_server(self, host=METRICS_HOST, port=METRICS_PORT):
+        if port and self._server is None:
+            self._server = await asyncio.start_server(self._serve_client, host, port)
+
+    async def stop_server(self):
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+
+    async def _serve_client(self, reader, writer):
+        # Just enough HTTP for a scraper: GET /metrics, one response, close
+        try:
+            request = await asyncio.wait_for(reader.readuntil(b"\r\n\r\n"), 5)
+            parts = request.split(b" ", 2)
+            if len(parts) == 3 and parts[1].split(b"?")[0] in (b"/", b"/metrics"):
+                status, body = "200 OK", self.render().encode()
+            else:
+                status, body = "404 Not Found", b"Not found\n"
+            writer.write(f"HTTP/1.1 {status}\r\nContent-Type: text/plain; version=0.0.4; charset=utf-8\r\n"
+                         f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode() + body)
+            await writer.drain()
+        except (asyncio.TimeoutError, asyncio.IncompleteReadError, asyncio.LimitOverrunError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+metrics = Metrics()
+
+def count_statements(conn):
+    # Keep a count of statements issued on `conn` in conn.statements, for the metrics;
+    # counted here rather than by a trace callback, which would run on the SQLite thread
+    conn.statements = 0
+    execute, executemany = conn.execute, conn.executemany
+    def counted_execute(*args, **kwargs):
+        conn.statements += 1
+        return execute(*args, **kwargs)
+    def counted_executemany(*args, **kwargs):
+        conn.statements += 1
+        return executemany(*args, **kwargs)
+    conn.execute, conn.executemany = counted_execute, counted_executemany
+
+class TransactionAborted(Exception):
+    """Raise inside db.writer() to roll the transaction back."""
+
+class DatabasePool:
+    """Long-lived aiosqlite connections: one writer plus a pool of readers."""
+
+    def __init__(self, path=DB_PATH, size=DB_POOL_SIZE, service=DB_SERVICE_SOCKET):
+        self.path = path
+        self.size = size
+        self.service = service  # Socket of the write service, if writes go through one
+        self._writer = None
+        self._write_lock = asyncio.Lock()
+        self._readers = None  # Queue of idle reader connections
+        self._connections = []
+
+    @property
+    def is_open(self):
+        return self._writer is not None
+
+    async def _connect(self, readonly=False):
+        # isolation_level=None so transactions are only the ones we open explicitly
+        conn = await aiosqlite.connect(self.path, isolation_level=None)
+        for pragma in DB_PRAGMAS:
+            await conn.execute(pragma)
+        if readonly:
+            await conn.execute("PRAGMA query_only=ON")
+        self._connections.append(conn)
+        count_statements(conn)
+        return conn
 
-async def get_db_connection():
-    conn = await aiosqlite.connect('pets.db')
-    conn.row_factory = aiosqlite.Row  # Use Row to fetch rows as dictionaries
-    return conn
+    @staticmethod
+    def _charge(span, conn, start, statements):
+        # Add the database time and statements of one borrowed connection to `span`
+        span.db += time.perf_counter() - start
+        span.queries += conn.statements - statements
+
+    async def open(self):
+        if self.is_open:
+            return
+        # The writer goes first so WAL mode is in place before any reader attaches
+        if self.service:
+            self._writer = await RemoteWriter.connect(self.service)
+        else:
+            self._writer = await self._connect()
+        self._readers = asyncio.Queue()
+        for _ in range(max(1, self.size)):
+            self._readers.put_nowait(await self._connect(readonly=True))
 
-db = None  # Global variable to hold the database connection
+    async def close(self):
+        if not self.is_open:
+            return
+        async with self._write_lock:
+            if isinstance(self._writer, RemoteWriter):
+                await self._writer.close()
+            for conn in self._connections:
+                await conn.close()
+            self._connections = []
+            self._writer = None
+            self._readers = None
+
+    @contextlib.asynccontextmanager
+    async def reader(self):
+        if not self.is_open:
+            raise RuntimeError("Database pool is not open")
+        span = _current_span.get()
+        start = time.perf_counter()
+        conn = await self._readers.get()
+        statements = conn.statements
+        try:
+            yield conn
+        finally:
+            self._readers.put_nowait(conn)
+            if span is not None:
+                self._charge(span, conn, start, statements)
+
+    @contextlib.asynccontextmanager
+    async def writer(self):
+        # Every write runs in its own IMMEDIATE transaction on the one writer connection,
+        # committed when the block exits and rolled back if it raises
+        if not self.is_open:
+            raise RuntimeError("Database pool is not open")
+        span = _current_span.get()
+        start = time.perf_counter()
+        durable = None
+        async with self._write_lock:
+            conn = self._writer
+            if isinstance(conn, RemoteWriter):
+                await conn.begin()
+                statements = conn.statements
+                try:
+                    yield conn
+                except BaseException:
+                    await conn.rollback()
+                    raise
+                # The next transaction may start while this one waits for its group commit
+                durable = await conn.commit()
+            else:
+                await conn.execute("BEGIN IMMEDIATE")
+                statements = conn.statements
+                try:
+                    yield conn
+                except BaseException:
+                    await conn.rollback()
+                    raise
+                else:
+                    await conn.commit()
+        if durable is not None:
+            await durable
+        if span is not None:
+            self._charge(span, conn, start, statements)
+            span.commits += 1
+
+    @contextlib.asynccontextmanager
+    async def maintenance(self):
+        # The writer connection outside any transaction, for checkpoints and VACUUM
+        if not self.is_open:
+            raise RuntimeError("Database pool is not open")
+        span = _current_span.get()
+        start = time.perf_counter()
+        async with self._write_lock:
+            conn = self._writer
+            statements = conn.statements
+            if isinstance(conn, RemoteWriter):
+                await conn.begin(direct=True)
+                try:
+                    yield conn
+                finally:
+                    await conn.end()
+            else:
+                yield conn
+        if span is not None:
+            self._charge(span, conn, start, statements)
+
+class RemoteCursor:
+    """The result of a statement run by the write service, read like an aiosqlite cursor."""
+
+    def __init__(self, rows, rowcount, lastrowid):
+        self._rows = rows
+        self._position = 0
+        self.rowcount = rowcount
+        self.lastrowid = lastrowid
+        self.row_factory = None
+
+    def _make(self, row):
+        row = tuple(row)
+        return self.row_factory(self, row) if self.row_factory else row
+
+    async def fetchone(self):
+        if self._position >= len(self._rows):
+            return None
+        self._position += 1
+        return self._make(self._rows[self._position - 1])
+
+    async def fetchall(self):
+        rows = [self._make(row) for row in self._rows[self._position:]]
+        self._position = len(self._rows)
+        return rows
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        row = await self.fetchone()
+        if row is None:
+            raise StopAsyncIteration
+        return row
+
+class _RemoteStatement:
+    # Lets `await conn.execute(...)` and `async with conn.execute(...)` both work
+    def __init__(self, coro):
+        self._coro = coro
+
+    def __await__(self):
+        return self._coro.__await__()
+
+    async def __aenter__(self):
+        return await self._coro
+
+    async def __aexit__(self, *exc_info):
+        return False
+
+def _ignore_result(future):
+    # Mark a reply nobody will await as seen, so asyncio doesn't log its error
+    if not future.cancelled():
+        future.exception()
+
+class RemoteWriter:
+    """Client end of a WriteService connection, standing in for the writer connection."""
+
+    def __init__(self, reader, writer):
+        self._reader = reader
+        self._writer = writer
+        self._ids = itertools.count()
+        self._replies = {}  # request id -> future of its reply
+        self._begin = None  # Reply to the begin of the transaction in progress, sent without waiting
+        self._receiver = asyncio.create_task(self._receive())
+        self.statements = 0
+
+    @classmethod
+    async def connect(cls, path):
+        reader, writer = await asyncio.open_unix_connection(path, limit=DB_SERVICE_LINE_LIMIT)
+        return cls(reader, writer)
+
+    def _send(self, op, **fields):
+        request_id = next(self._ids)
+        reply = asyncio.get_running_loop().create_future()
+        self._replies[request_id] = reply
+        self._writer.write(json.dumps({"id": request_id, "op": op, **fields}).encode() + b"\n")
+        return reply
+
+    async def _request(self, op, **fields):
+        reply = self._send(op, **fields)
+        await self._writer.drain()
+        try:
+            await self._begun()
+        except BaseException:
+            reply.add_done_callback(_ignore_result)  # Refused for want of a transaction
+            raise
+        return await reply
+
+    async def _begun(self):
+        # Requests are handled in order, so a failed begin surfaces on every request after it
+        if self._begin is not None:
+            await self._begin
+
+    async def _refused(self):
+        # Close out the transaction's begin: True if the service refused it, in which case
+        # there is nothing to roll back or end, and the caller's own error should stand
+        begin, self._begin = self._begin, None
+        if begin is None:
+            return False
+        try:
+            await begin
+        except sqlite3.Error:
+            return True
+        return False
+
+    async def _receive(self):
+        try:
+            while line := await self._reader.readline():
+                reply = json.loads(line)
+                future = self._replies.pop(reply["id"], None)
+                if future is None or future.done():
+                    continue
+                if "error" in reply:
+                    # Raise the same sqlite3 error the service hit
+                    error = getattr(sqlite3, reply.get("type", ""), None)
+                    if not (isinstance(error, type) and issubclass(error, sqlite3.Error)):
+                        error = sqlite3.DatabaseError
+                    future.set_exception(error(reply["error"]))
+                else:
+                    future.set_result(reply)
+        finally:
+            for future in self._replies.values():
+                if not future.done():
+                    future.set_exception(ConnectionError("Lost the connection to the write service"))
+            self._replies.clear()
+
+    async def begin(self, direct=False):
+        # Not waited for: the first statement goes out right behind it
+        self._begin = self._send("begin", direct=direct)
+
+    async def commit(self):
+        # Returns a future that resolves once the transaction's group commit is durable
+        reply = self._send("commit")
+        await self._writer.drain()
+        begin, self._begin = self._begin, None
+        if begin is not None:
+            try:
+                await begin
+            except BaseException:
+                reply.add_done_callback(_ignore_result)
+                raise
+        return reply
+
+    async def rollback(self):
+        if not await self._refused():
+            await self._request("rollback")
+
+    async def end(self):
+        if not await self._refused():
+            await self._request("end")
+
+    async def _execute(self, sql, params, many=False):
+        reply = await self._request("execute", sql=sql, params=params, many=many)
+        return RemoteCursor(reply["rows"], reply["rowcount"], reply["lastrowid"])
+
+    async def _executemany(self, sql, params):
+        rowcount = 0
+        params = [list(row) for row in params]
+        for i in range(0, len(params), DB_SERVICE_CHUNK):
+            cursor = await self._execute(sql, params[i:i + DB_SERVICE_CHUNK], many=True)
+            rowcount += cursor.rowcount
+        return RemoteCursor([], rowcount, None)
+
+    def execute(self, sql, params=()):
+        self.statements += 1
+        return _RemoteStatement(self._execute(sql, list(params)))
+
+    def executemany(self, sql, params):
+        self.statements += 1
+        return _RemoteStatement(self._executemany(sql, params))
+
+    async def close(self):
+        self._writer.close()
+        with contextlib.suppress(Exception):
+            await self._writer.wait_closed()
+        await self._receiver
+
+class WriteService:
+    """The one writer of pets.db for every bot process, reached over a Unix socket.
+
+    Each client transaction runs in a savepoint of a shared transaction, and the
+    transactions arriving within DB_SERVICE_WINDOW are committed together.
+    """
+
+    def __init__(self, path=DB_PATH, socket_path=DB_SERVICE_SOCKET, window=DB_SERVICE_WINDOW, max_batch=DB_SERVICE_BATCH):
+        self.path = path
+        self.socket_path = socket_path
+        self.window = window
+        self.max_batch = max_batch
+        self._conn = None
+        self._lock = asyncio.Lock()  # Held by the client whose transaction is running
+        self._in_group = False  # Whether the shared transaction is open
+        self._waiting = []  # (stream, request id) of transactions waiting for the group commit
+        self._timer = None
+        self.transactions = 0
+        self.commits = 0
+
+    async def serve(self, ready=None):
+        pool = DatabasePool(self.path, size=1, service=None)
+        await pool.open()
+        if os.path.exists(self.socket_path):
+            os.unlink(self.socket_path)  # Left behind by a service that didn't shut down cleanly
+        try:
+            async with pool.maintenance() as conn:
+                self._conn = conn
+                server = await asyncio.start_unix_server(self._serve_client, path=self.socket_path,
+                                                         limit=DB_SERVICE_LINE_LIMIT)
+                if ready is not None:
+                    ready.set()
+                try:
+                    async with server:
+                        await server.serve_forever()
+                finally:
+                    async with self._lock:
+                        await self._commit_group()
+        finally:
+            await pool.close()
+            with contextlib.suppress(FileNotFoundError):
+                os.unlink(self.socket_path)
+
+    async def _serve_client(self, reader, stream):
+        session = None  # "transaction" or "direct" while this client holds the writer
+        try:
+            while line := await reader.readline():
+                request = json.loads(line)
+                op = request["op"]
+                reply = {"id": request["id"]}
+                try:
+                    if op != "begin" and session is None:
+                        raise sqlite3.OperationalError("No transaction in progress")
+                    if op == "begin":
+                        await self._lock.acquire()
+                        session = "direct" if request.get("direct") else "transaction"
+                        if session == "direct":
+                            await self._commit_group()  # Checkpoints and VACUUM need no open transaction
+                        else:
+                            if not self._in_group:
+                                await self._conn.execute("BEGIN IMMEDIATE")
+                                self._in_group = True
+                            await self._conn.execute("SAVEPOINT client")
+                    elif op == "execute":
+                        if request["many"]:
+                            cursor = await self._conn.executemany(request["sql"], request["params"])
+                        else:
+                            cursor = await self._conn.execute(request["sql"], request["params"])
+                        reply.update(rows=await cursor.fetchall(), rowcount=cursor.rowcount, lastrowid=cursor.lastrowid)
+                    elif op == "commit":
+                        await self._conn.execute("RELEASE client")
+                        self._waiting.append((stream, request["id"]))
+                        self.transactions += 1
+                        if len(self._waiting) >= self.max_batch:
+                            await self._commit_group()
+                        elif self._timer is None:
+                            self._timer = asyncio.create_task(self._commit_later())
+                        session = None
+                        self._lock.release()
+                        continue  # Answered by the group commit
+                    elif op == "rollback":
+                        await self._conn.execute("ROLLBACK TO client")
+                        await self._conn.execute("RELEASE client")
+                        session = None
+                        self._lock.release()
+                    elif op == "end":
+                        session = None
+                        self._lock.release()
+                except Exception as e:
+                    reply = {"id": request["id"], "error": str(e), "type": type(e).__name__}
+                    if op in ("begin", "commit", "rollback") and session is not None:
+                        # The transaction can't go on; give the writer back
+                        await self._abandon(session)
+                        session = None
+                stream.write(json.dumps(reply).encode() + b"\n")
+        finally:
+            # A client that goes away mid-transaction loses just that transaction
+            if session is not None:
+                await self._abandon(session)
+            stream.close()
+
+    async def _abandon(self, session):
+        if session == "transaction":
+            with contextlib.suppress(Exception):
+                await self._conn.execute("ROLLBACK TO client")
+                await self._conn.execute("RELEASE client")
+        self._lock.release()
+
+    async def _commit_later(self):
+        await asyncio.sleep(self.window)
+        async with self._lock:
+            self._timer = None
+            await self._commit_group()
+
+    async def _commit_group(self):
+        # Commit the shared transaction and answer every transaction in it; lock held
+        if not self._in_group:
+            return
+        waiting, self._waiting = self._waiting, []
+        self._in_group = False
+        try:
+            await self._conn.execute("COMMIT")
+        except Exception as e:
+            with contextlib.suppress(Exception):
+                await self._conn.execute("ROLLBACK")
+            replies = [{"id": request_id, "error": str(e), "type": type(e).__name__} for _, request_id in waiting]
+        else:
+            self.commits += 1
+            replies = [{"id": request_id} for _, request_id in waiting]
+        for (stream, _), reply in zip(waiting, replies):
+            if not stream.is_closing():
+                stream.write(json.dumps(reply).encode() + b"\n")
+
+db = DatabasePool()  # Shared by every data-access path, opened in MyBot.setup_hook
+
+class MyBot(commands.AutoShardedBot):
+    preload_task = None
 
-class MyBot(commands.Bot):
     async def setup_hook(self):
-        # Schedule background tasks during bot setup
-        self.loop.create_task(update_pets_status())
-        self.loop.create_task(save_pets_periodically()) 
-        self.loop.create_task(grant_daily_coins())
-        self.loop.create_task(update_weather_periodically())
+        self.http.request = metrics.wrap_api(self.http.request)
+        try:
+            await metrics.start_server()
+        except OSError as e:
+            print(f"Metrics endpoint not started: {e}")
+        # Open the connection pool and make sure the schema exists before anything runs
+        await db.open()
+        await initialize_database()
+        metrics.mark_startup("database")
+        await load_weather()
+        # Start the background jobs; setup_hook runs once, not on every reconnect
+        await scheduler.start()
+        if PRELOAD_PETS and pet_cache.write_back:
+            # Not awaited: commands are answered while it runs, from the database if need be
+            self.preload_task = asyncio.create_task(preload_active_pets())
+        metrics.mark_startup("setup")
+
+    async def close(self):
+        if self.preload_task is not None:
+            self.preload_task.cancel()
+        await reaction_batcher.drain()  # Apply reactions still waiting for their window
+        await scheduler.stop()
+        await super().close()
+        await pet_cache.flush()  # Don't lose changes still held in memory
+        await write_queue.drain()
+        await db.close()  # Close the pooled connections on shutdown
+        await metrics.stop_server()
+
+    async def invoke(self, ctx):
+        if ctx.command is None:  # Unknown commands only get the error reply
+            return await super().invoke(ctx)
+        with metrics.span(ctx.command.qualified_name) as span:
+            await super().invoke(ctx)
+            if span is not None:
+                span.failed = ctx.command_failed  # Errors are handled inside invoke, not raised
+        if metrics.mark_startup("first_response"):
+            print(f"First command answered {metrics.startup['first_response']:.2f}s after start "
+                  f"({', '.join(f'{phase} {seconds:.2f}s' for phase, seconds in metrics.startup.items())})")
+
+# Schema changes, oldest first. PRAGMA user_version holds how many a database has had, so
+# each runs once. Databases from before versioning start at 0 and may already have some
+# of these changes, so every step must be safe to run against them.
+
+async def migrate_pets_table(conn):
+    await conn.execute(''' 
+        CREATE TABLE IF NOT EXISTS pets (
+            name TEXT NOT NULL,
+            owner_id INTEGER PRIMARY KEY,
+            hunger INTEGER NOT NULL DEFAULT 50,
+            happiness INTEGER NOT NULL DEFAULT 50,
+            energy INTEGER NOT NULL DEFAULT 50,
+            birth_time REAL NOT NULL,
+            coins INTEGER NOT NULL DEFAULT 0,
+            last_claimed REAL,
+            freeze_end REAL
+        )
+    ''')
+
+async def migrate_lazy_ticks(conn):
+    # Pets from before lazy ticks start counting from the current tick
+    if await add_column_if_missing(conn, 'pets', 'last_tick', 'REAL'):
+        await conn.execute("UPDATE pets SET last_tick = ?", (tick_index(time.time()) * TICK_INTERVAL,))
+
+async def migrate_sort_indexes(conn):
+    # Oldest pets first for the leaderboard
+    await conn.execute("CREATE INDEX IF NOT EXISTS idx_pets_birth_time ON pets (birth_time)")
+    # Richest pets first for ~mostcoins
+    await conn.execute("CREATE INDEX IF NOT EXISTS idx_pets_coins ON pets (coins)")
+
+async def migrate_jobs_table(conn):
+    # When each periodic job last ran, so restarts keep their schedule
+    await conn.execute('''
+        CREATE TABLE IF NOT EXISTS jobs (
+            name TEXT PRIMARY KEY,
+            last_run REAL NOT NULL,
+            last_duration REAL
+        )
+    ''')
+
+async def migrate_coin_grants_table(conn):
+    # One row per day of daily coins already granted, so a day is never paid twice
+    await conn.execute('''
+        CREATE TABLE IF NOT EXISTS coin_grants (
+            day INTEGER PRIMARY KEY,
+            amount INTEGER NOT NULL,
+            pets INTEGER NOT NULL,
+            granted_at REAL NOT NULL
+        )
+    ''')
+
+async def migrate_weather_table(conn):
+    # Current weather per guild; guild 0 is the weather shared by every guild
+    await conn.execute('''
+        CREATE TABLE IF NOT EXISTS weather (
+            guild_id INTEGER PRIMARY KEY,
+            type TEXT NOT NULL,
+            changed_at REAL NOT NULL
+        )
+    ''')
+
+async def migrate_guild_partitions(conn):
+    # Pets from before sharding don't know their guild and all land in partition 0
+    await add_column_if_missing(conn, 'pets', 'guild_id', 'INTEGER NOT NULL DEFAULT 0')
+    await add_column_if_missing(conn, 'pets', 'shard_key', 'INTEGER NOT NULL DEFAULT 0')
+    # Background passes only read their own partitions
+    await conn.execute("CREATE INDEX IF NOT EXISTS idx_pets_shard_key ON pets (shard_key)")
+    await conn.execute("CREATE INDEX IF NOT EXISTS idx_pets_guild_id ON pets (guild_id)")
+
+async def migrate_last_active(conn):
+    # When the pet was last used, for warming the cache at startup; never read per pet,
+    # so it has no index
+    await add_column_if_missing(conn, 'pets', 'last_active', 'REAL')
+
+MIGRATIONS = [
+    migrate_pets_table,
+    migrate_lazy_ticks,
+    migrate_sort_indexes,
+    migrate_jobs_table,
+    migrate_coin_grants_table,
+    migrate_weather_table,
+    migrate_guild_partitions,
+    migrate_last_active,
+]
+
+async def schema_version(conn):
+    async with conn.execute("PRAGMA user_version") as cursor:
+        return (await cursor.fetchone())[0]
 
-# Initialize the database
 async def initialize_database():
-    async with aiosqlite.connect('pets.db') as db:
-        # Create the pets table if it doesn't exist
-        await db.execute(''' 
-            CREATE TABLE IF NOT EXISTS pets (
-                name TEXT NOT NULL,
-                owner_id INTEGER PRIMARY KEY,
-                hunger INTEGER NOT NULL DEFAULT 50,
-                happiness INTEGER NOT NULL DEFAULT 50,
-                energy INTEGER NOT NULL DEFAULT 50,
-                birth_time REAL NOT NULL,
-                coins INTEGER NOT NULL DEFAULT 0,
-                last_claimed REAL,
-                freeze_end REAL
-            )
-        ''')
-        await db.commit()
+    # Bring the schema up to date. An up-to-date database costs one read, not a write
+    # transaction. Returns the number of migrations applied.
+    async with db.reader() as conn:
+        if await schema_version(conn) >= len(MIGRATIONS):
+            return 0
+    async with db.writer() as conn:
+        # Checked again under the write lock, in case another process got here first
+        version = await schema_version(conn)
+        for migration in MIGRATIONS[version:]:
+            await migration(conn)
+        if version < len(MIGRATIONS):
+            await conn.execute(f"PRAGMA user_version = {len(MIGRATIONS)}")
+    if version < len(MIGRATIONS):
+        print(f"Database schema migrated from version {version} to {len(MIGRATIONS)}")
+    return max(0, len(MIGRATIONS) - version)
+
+async def add_column_if_missing(conn, table, column, declaration):
+    async with conn.execute(f"PRAGMA table_info({table})") as cursor:
+        columns = [row[1] for row in await cursor.fetchall()]
+    if column in columns:
+        return False
+    await conn.execute(f"ALTER TABLE {table} ADD COLUMN {column} {declaration}")
+    return True
 
 
 
@@ -104,14 +956,85 @@ RANDOM_EVENTS = [
 
 intents = discord.Intents.default()
 intents.message_content = True
-bot = commands.Bot(command_prefix="~", intents=intents, help_command=None)
+shard_options = {"shard_count": SHARD_COUNT, "shard_ids": SHARD_IDS} if SHARD_COUNT else {}
+bot = MyBot(command_prefix="~", intents=intents, help_command=None, **shard_options)
 
 # Cooldown settings
 REACTION_COOLDOWN = 10  # Cooldown time in seconds
-cooldowns = {}
+COOLDOWN_GRANULARITY = 1.0  # Width in seconds of each expiry bucket
+COMMAND_COOLDOWNS = {  # Seconds a user must wait between uses of these commands
+    "steal": 60,
+    "gamble": 10,
+    "adventure": 30,
+}
+
+class CooldownStore:
+    """Per-user cooldowns that forget each user as soon as their cooldown has passed."""
+    __slots__ = ("duration", "granularity", "_expires", "_wheel")
+
+    def __init__(self, duration, granularity=COOLDOWN_GRANULARITY):
+        self.duration = duration
+        self.granularity = granularity
+        self._expires = {}    # user id -> time their cooldown ends
+        self._wheel = deque()  # (bucket, array of user ids expiring by its end), oldest first
+
+    def hit(self, user_id, now=None):
+        # Seconds left if the user is cooling down; otherwise start a new cooldown and return 0
+        now = time.time() if now is None else now
+        self._expire(now)
+        expires = self._expires.get(user_id)
+        if expires is not None and expires > now:
+            return expires - now
+        expires = now + self.duration
+        self._expires[user_id] = expires
+        bucket = math.ceil(expires / self.granularity)
+        if not self._wheel or self._wheel[-1][0] < bucket:
+            self._wheel.append((bucket, array("q")))
+        self._wheel[-1][1].append(user_id)
+        return 0.0
+
+    def _expire(self, now):
+        # Drop every bucket that has fully passed; ids re-armed since then stay
+        wheel, expires = self._wheel, self._expires
+        while wheel and wheel[0][0] * self.granularity <= now:
+            for user_id in wheel.popleft()[1]:
+                if expires.get(user_id, now) <= now:
+                    expires.pop(user_id, None)
+
+    def clear(self):
+        self._expires.clear()
+        self._wheel.clear()
+
+    def __len__(self):
+        return len(self._expires)
+
+cooldowns = CooldownStore(REACTION_COOLDOWN)
+command_cooldowns = {name: CooldownStore(seconds) for name, seconds in COMMAND_COOLDOWNS.items()}
+
+@bot.before_invoke
+async def enforce_command_cooldowns(ctx):
+    # Runs once the arguments have parsed, so a mistyped command doesn't use up the cooldown
+    store = command_cooldowns.get(ctx.command.qualified_name)
+    if store is not None:
+        retry_after = store.hit(ctx.author.id)
+        if retry_after:
+            raise commands.CommandOnCooldown(commands.Cooldown(1, store.duration), retry_after, commands.BucketType.user)
+
+# Columns of the pets table, in table order
+PET_COLUMNS = ("name", "owner_id", "hunger", "happiness", "energy", "birth_time", "coins", "last_claimed", "freeze_end", "last_tick", "guild_id", "shard_key")
+
+# Bit per column for change tracking
+PET_COLUMN_BITS = {column: 1 << i for i, column in enumerate(PET_COLUMNS)}
+# Every pet query selects exactly these columns, whatever order the table has them in
+PET_SELECT = f"SELECT {', '.join(PET_COLUMNS)} FROM pets"
 
 class VirtualPet:
-    def __init__(self, name, owner_id, hunger=50, happiness=50, energy=50, birth_time=None, coins=0, last_claimed=None, freeze_end=None):
+    # Fixed slots instead of a per-pet __dict__; changes are a bitmask over PET_COLUMNS
+    __slots__ = PET_COLUMNS + ("_changed", "_in_db")
+
+    def __init__(self, name, owner_id, hunger=50, happiness=50, energy=50, birth_time=None, coins=0, last_claimed=None, freeze_end=None, last_tick=None, guild_id=0):
+        object.__setattr__(self, "_changed", 0)  # Columns modified since the last save
+        object.__setattr__(self, "_in_db", False)  # Whether a row for this pet exists yet
         self.name = name
         self.owner_id = owner_id
         self.hunger = hunger
@@ -121,24 +1044,58 @@ class VirtualPet:
         self.coins = coins
         self.last_claimed = last_claimed
         self.freeze_end = freeze_end
+        # Timestamp of the last hourly tick applied to the stats; new pets start at the current one
+        self.last_tick = last_tick if last_tick is not None else tick_index(time.time()) * TICK_INTERVAL
+        # Guild the pet was adopted in, which decides the partition its background work runs in
+        self.guild_id = guild_id
+        self.shard_key = shard_key_for(guild_id)
+        object.__setattr__(self, "_changed", 0)
+
+    def __setattr__(self, name, value):
+        bit = PET_COLUMN_BITS.get(name)
+        if bit:
+            object.__setattr__(self, "_changed", self._changed | bit)
+        object.__setattr__(self, name, value)
+
+    def set_saved(self, **fields):
+        # Set values that are already in the database without marking them as changed
+        changed = self._changed
+        for field, value in fields.items():
+            object.__setattr__(self, field, value)
+            changed &= ~PET_COLUMN_BITS[field]
+        object.__setattr__(self, "_changed", changed)
+
+    def take_changes(self):
+        # Hand the pending changes to a writer: None for a pet that needs its full row
+        # inserted, otherwise the set of modified columns. Tracking restarts from here.
+        changed = {column for column, bit in PET_COLUMN_BITS.items() if self._changed & bit}
+        object.__setattr__(self, "_changed", 0)
+        if not self._in_db:
+            object.__setattr__(self, "_in_db", True)
+            return None
+        return changed
+
+    def restore_changes(self, changed):
+        # Undo take_changes() after a failed write
+        if changed is None:
+            object.__setattr__(self, "_in_db", False)
+        else:
+            bits = self._changed
+            for column in changed:
+                bits |= PET_COLUMN_BITS[column]
+            object.__setattr__(self, "_changed", bits)
 
     @classmethod
     def from_db_row(cls, row):
-        if len(row) != 9:  # Ensure the row has the expected number of columns
-            raise ValueError(f"Row does not have the expected number of columns: {len(row)}")
-    
-        return cls(
-            owner_id=int(row[1]),  # Correctly access owner_id at index 1
-            name=row[0],            # Name is at index 0
-            hunger=row[2],          # Hunger is at index 2
-            happiness=row[3],       # Happiness is at index 3
-            energy=row[4],          # Energy is at index 4
-            birth_time=row[5],      # Birth time is at index 5
-            coins=row[6],           # Coins are at index 6
-            last_claimed=row[7],    # Last claimed is at index 7
-            freeze_end=row[8]       # Freeze end is at index 8
-        )
-    
+        # Build a pet straight from a PET_SELECT row, writing the slots directly so
+        # neither __init__ nor change tracking runs
+        pet = object.__new__(cls)
+        for set_slot, value in zip(_PET_SLOT_SETTERS, row):
+            set_slot(pet, value)
+        _set_changed(pet, 0)
+        _set_in_db(pet, True)
+        return pet
+
     def status(self):
         return f"Hunger: {self.hunger}/100, Happiness: {self.happiness}/100, Energy: {self.energy}/100"
     
@@ -148,15 +1105,6 @@ class VirtualPet:
         if self.happiness <= 0:
             return False, f"{self.name} is too sad and has run away... 😢"
         return True, None
-    def feed(self, amount):
-        self.hunger = max(0, self.hunger - amount)
-    
-    def play(self, amount):
-        self.energy = max(0, self.energy - amount)
-        self.happiness = min(100, self.happiness + 10)  # Example increase
-
-    def sleep(self, amount):
-        self.energy = min(100, self.energy + amount)
 
     def update_hunger(self):
         # Example: Increase hunger over time
@@ -207,23 +1155,36 @@ class VirtualPet:
         return f"{self.name} is peacefully sleeping! 💤 Energy: {self.energy}, Hunger: {self.hunger}"
     
 
-    def update_status(self):
-        if self.freeze_end and time.time() < self.freeze_end:
-            return
-    
-        # Regular updates to hunger, happiness, and energy
-        self.hunger = min(100, self.hunger + random.randint(1, 3))
-        self.happiness = max(0, self.happiness - random.randint(1, 3))
-        self.energy = max(0, self.energy - random.randint(1, 3))
-    
-        # Trigger a random event with a 20% chance
-        if random.random() < 0.2:  
-            event = random.choice(RANDOM_EVENTS)
-            self.happiness = max(0, min(100, self.happiness + event["happiness_change"]))
-            self.hunger = max(0, min(100, self.hunger + event["hunger_change"]))
-            self.energy = max(0, min(100, self.energy + event["energy_change"]))
-    
-
+    def update_status(self, now=None):
+        # Materialize every hourly tick missed since last_tick. Ticks that land inside the
+        # freeze window are skipped outright, and replay stops once the pet has died.
+        now_tick = tick_index(now or time.time())
+        first = max(tick_index(self.last_tick) + 1, first_unfrozen_tick(self.freeze_end))
+        self.last_tick = max(self.last_tick, now_tick * TICK_INTERVAL)
+        if first > now_tick:
+            return 0
+
+        ticks = np.arange(first, now_tick + 1)
+        draws = zip(*(d.tolist() for d in tick_draws(self.owner_id, ticks)))
+        hunger, happiness, energy = self.hunger, self.happiness, self.energy
+        applied = 0
+        for hunger_up, happiness_down, energy_down, event_roll, event_index in draws:
+            if hunger >= 100 or happiness <= 0:
+                break
+            hunger = min(100, hunger + hunger_up)
+            happiness = max(0, happiness - happiness_down)
+            energy = max(0, energy - energy_down)
+
+            # Random event on 20% of ticks
+            if event_roll:
+                event = RANDOM_EVENTS[event_index]
+                happiness = max(0, min(100, happiness + event["happiness_change"]))
+                hunger = max(0, min(100, hunger + event["hunger_change"]))
+                energy = max(0, min(100, energy + event["energy_change"]))
+            applied += 1
+        if applied:
+            self.hunger, self.happiness, self.energy = hunger, happiness, energy
+        return applied
 
     def generate_embed(self):
         embed = discord.Embed(title=self.name, color=0x00ff00)
@@ -237,119 +1198,536 @@ class VirtualPet:
         return embed
     
     async def save(self):
-        async with aiosqlite.connect("pets.db") as db:
-            await db.execute('''
-                INSERT OR REPLACE INTO pets 
-                (owner_id, name, hunger, happiness, energy, birth_time, coins, last_claimed, freeze_end)
-                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
-            ''', (self.owner_id, self.name, self.hunger, self.happiness, self.energy, 
-                  self.birth_time, self.coins, self.last_claimed, self.freeze_end))
-            await db.commit()
+        await save_pets_to_db([self])
+
 
-    
     @staticmethod
     async def load(owner_id):
-        async with aiosqlite.connect("pets.db") as db:
-            async with db.execute('SELECT * FROM pets WHERE owner_id = ?', (owner_id,)) as cursor:
-                row = await cursor.fetchone()
-                if row:
-                    return VirtualPet.from_db_row(row)
-                return None
-    
+        return await fetch_pet_from_db(owner_id)
+
     @staticmethod
     async def load_all():
-        pets = []
-        async with aiosqlite.connect("pets.db") as db:
-            async with db.execute('SELECT * FROM pets') as cursor:
-                async for row in cursor:
-                    pets.append(VirtualPet.from_db_row(row))
+        async with db.reader() as conn:
+            pets = await fetch_pets(conn)
+        for pet in pets:
+            pet.update_status()
         return pets
     
     @staticmethod
     async def delete(owner_id):
-        async with aiosqlite.connect("pets.db") as db:
-            await db.execute('DELETE FROM pets WHERE owner_id = ?', (owner_id,))
-            await db.commit()
-            
+        await delete_pet_from_db(owner_id)
 
 
-async def get_pet_data_from_database(owner_id):
-    async with aiosqlite.connect('pets.db') as db:
-        async with db.execute(""" 
-            SELECT name, owner_id, hunger, happiness, energy, birth_time, coins, last_claimed, freeze_end 
-            FROM pets 
-            WHERE owner_id = ? 
-        """, (owner_id,)) as cursor:
-            row = await cursor.fetchone()
-            if row:
-                return {
-                    'name': row[0],                             # Name as TEXT
-                    'owner_id': int(row[1]),                   # Ensure owner_id is an integer
-                    'hunger': int(row[2]),                     # Ensure hunger is an integer
-                    'happiness': int(row[3]),                  # Ensure happiness is an integer
-                    'energy': int(row[4]),                     # Ensure energy is an integer
-                    'birth_time': float(row[5]),               # Ensure birth_time is a float (if using timestamps)
-                    'coins': int(row[6]),                      # Ensure coins is an integer
-                    'last_claimed': float(row[7]) if row[7] is not None else None,  # Cast to float, or None
-                    'freeze_end': float(row[8]) if row[8] is not None else None   # Cast to float, or None
-                }
-            return None
 
-# Enabling row_factory to return dictionary-like objects
-async def fetch_pet_data(user_id):
-    async with aiosqlite.connect('pets.db') as db:
-        db.row_factory = aiosqlite.Row  # This makes rows accessible by column name
-        async with db.execute("SELECT * FROM pets WHERE owner_id = ?", (user_id,)) as cursor:
-            row = await cursor.fetchone()
-    return row
-            
+# Slot descriptors of VirtualPet, for from_db_row
+_PET_SLOT_SETTERS = [VirtualPet.__dict__[column].__set__ for column in PET_COLUMNS]
+_set_changed = VirtualPet._changed.__set__
+_set_in_db = VirtualPet._in_db.__set__
+
+def pet_row_factory(cursor, row):
+    # sqlite3 row factory turning PET_SELECT rows into pets as they are fetched
+    return VirtualPet.from_db_row(row)
+
+async def fetch_pets(conn, where="", params=()):
+    async with conn.execute(f"{PET_SELECT} {where}", params) as cursor:
+        cursor.row_factory = pet_row_factory  # Per-cursor, the pooled connection is shared
+        return await cursor.fetchall()
+
 async def fetch_pet_from_db(owner_id):
-    async with aiosqlite.connect('pets.db') as db:
-        async with db.execute("SELECT * FROM pets WHERE owner_id = ?", (owner_id,)) as cursor:
-            row = await cursor.fetchone()
-            if row:
-                return VirtualPet.from_db_row(row)  # Ensure this matches the new row structure
-            return None
+    async with db.reader() as conn:
+        pets = await fetch_pets(conn, "WHERE owner_id = ?", (owner_id,))
+    if pets:
+        pet = pets[0]
+        pet.update_status()  # Catch up on the ticks missed since it was last saved
+        return pet
+    return None
 
 
 def format_time(seconds):
     return str(timedelta(seconds=seconds)).split('.')[0]
 
 
-async def update_pets_status():
-    while True:
-        await asyncio.sleep(3600)  # Update every hour
-        pets = await VirtualPet.load_all()
-        for pet in pets:
-            pet.update_status()
-            alive = pet.is_alive()
-            if not alive:
-                await VirtualPet.delete(pet.owner_id)
+TICK_INTERVAL = 3600  # Seconds between status ticks
+TICK_MODE = "lazy"  # "lazy": ticks are applied when a pet is read; "eager": the hourly pass rewrites every pet
+SQL_MAX_VARIABLES = 900  # Stay under SQLite's bound-parameter limit for IN (...) lists
+
+# RANDOM_EVENTS as a (n_events, 3) matrix of hunger/happiness/energy deltas
+EVENT_CHANGES = np.array(
+    [(e["hunger_change"], e["happiness_change"], e["energy_change"]) for e in RANDOM_EVENTS],
+    dtype=np.int64,
+)
+
+def tick_index(timestamp):
+    # Ticks happen at every multiple of TICK_INTERVAL since the epoch
+    return int(timestamp // TICK_INTERVAL)
+
+def first_unfrozen_tick(freeze_end):
+    # A tick at time t is skipped while t < freeze_end
+    return math.ceil(freeze_end / TICK_INTERVAL) if freeze_end else 0
+
+def _mix64(x):
+    # splitmix64 finalizer over uint64 arrays
+    x = x + np.uint64(0x9E3779B97F4A7C15)
+    x = (x ^ (x >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+    x = (x ^ (x >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+    return x ^ (x >> np.uint64(31))
+
+def tick_draws(owner_ids, ticks):
+    # Random draws for tick(s) of pet(s), seeded by (owner_id, tick) so a tick comes out
+    # the same whether the hourly pass applies it or a later read materializes it.
+    # Returns hunger/happiness/energy steps (1-3), the 20% event roll and the event index.
+    with np.errstate(over='ignore'):
+        owners = np.atleast_1d(np.asarray(owner_ids, dtype=np.int64)).astype(np.uint64)
+        ticks = np.atleast_1d(np.asarray(ticks, dtype=np.int64)).astype(np.uint64)
+        z = _mix64(_mix64(owners) ^ ticks)
+    return (
+        (z % np.uint64(3)).astype(np.int64) + 1,
+        ((z >> np.uint64(8)) % np.uint64(3)).astype(np.int64) + 1,
+        ((z >> np.uint64(16)) % np.uint64(3)).astype(np.int64) + 1,
+        ((z >> np.uint64(24)) & np.uint64(0xFFFF)) < 13107,  # 13107 / 65536 ~ 0.2
+        ((z >> np.uint64(40)) % np.uint64(len(RANDOM_EVENTS))).astype(np.int64),
+    )
+
+def simulate_tick(owner_ids, tick, hunger, happiness, energy, active):
+    # Vectorized VirtualPet.update_status for one tick: mutates the stat arrays in place
+    # for the rows selected by the boolean `active` mask
+    if not active.any():
+        return
+    hunger_up, happiness_down, energy_down, roll, event = tick_draws(owner_ids[active], tick)
+    h = np.minimum(100, hunger[active] + hunger_up)
+    hp = np.maximum(0, happiness[active] - happiness_down)
+    e = np.maximum(0, energy[active] - energy_down)
+
+    changes = EVENT_CHANGES[event]
+    h = np.where(roll, np.clip(h + changes[:, 0], 0, 100), h)
+    hp = np.where(roll, np.clip(hp + changes[:, 1], 0, 100), hp)
+    e = np.where(roll, np.clip(e + changes[:, 2], 0, 100), e)
+
+    hunger[active] = h
+    happiness[active] = hp
+    energy[active] = e
+
+async def delete_pets_in(conn, owner_ids):
+    # One DELETE ... WHERE owner_id IN (...) per chunk of ids
+    for i in range(0, len(owner_ids), SQL_MAX_VARIABLES):
+        chunk = owner_ids[i:i + SQL_MAX_VARIABLES]
+        await conn.execute(
+            f"DELETE FROM pets WHERE owner_id IN ({','.join('?' * len(chunk))})", chunk
+        )
+
+# Columns a PetTable holds as arrays; NULL timestamps are stored as 0.0
+PET_TABLE_DTYPES = {
+    "owner_id": np.int64,
+    "hunger": np.int16,
+    "happiness": np.int16,
+    "energy": np.int16,
+    "birth_time": np.float64,
+    "coins": np.int64,
+    "last_claimed": np.float64,
+    "freeze_end": np.float64,
+    "last_tick": np.float64,
+    "guild_id": np.int64,
+    "shard_key": np.int16,
+}
+PET_TABLE_NULLABLE = ("last_claimed", "freeze_end")
+
+class PetTable:
+    """Pets as parallel NumPy columns sorted by owner_id, for passes over the whole world."""
+
+    def __init__(self, columns, names=None):
+        self.columns = columns  # column name -> array, one row per pet
+        self.names = names      # Pet names, only when loaded with names=True
+        self.dirty = np.zeros(len(columns["owner_id"]), dtype=bool)
+        self._dirty_columns = set()
+
+    def __len__(self):
+        return len(self.dirty)
+
+    def __getitem__(self, column):
+        return self.columns[column]
+
+    @property
+    def nbytes(self):
+        return sum(a.nbytes for a in self.columns.values()) + self.dirty.nbytes
+
+    @classmethod
+    async def load(cls, conn, columns=None, names=False, shard_keys=None):
+        # Read every pet (of the given partitions) in owner_id order
+        columns = ("owner_id",) + tuple(c for c in (columns or PET_TABLE_DTYPES) if c != "owner_id")
+        select = [f"IFNULL({c}, 0)" if c in PET_TABLE_NULLABLE else c for c in columns]
+        if names:
+            select.append("name")
+        where, params = "", ()
+        if shard_keys is not None:
+            where, params = f"WHERE shard_key IN ({','.join('?' * len(shard_keys))})", tuple(shard_keys)
+        async with conn.execute(f"SELECT {', '.join(select)} FROM pets {where} ORDER BY owner_id", params) as cursor:
+            rows = await cursor.fetchall()
+        data = list(zip(*rows)) or [()] * len(select)
+        arrays = {c: np.array(data[i], dtype=PET_TABLE_DTYPES[c]) for i, c in enumerate(columns)}
+        return cls(arrays, list(data[-1]) if names else None)
+
+    def rows(self, owner_ids):
+        # Row numbers of the given owners; KeyError if any of them isn't in the table
+        owner_ids = np.asarray(owner_ids, dtype=np.int64)
+        rows = np.searchsorted(self.columns["owner_id"], owner_ids)
+        found = rows < len(self)
+        found[found] = self.columns["owner_id"][rows[found]] == owner_ids[found]
+        if not found.all():
+            raise KeyError(owner_ids[~found].tolist())
+        return rows
+
+    def view(self, owner_id):
+        return PetView(self, int(self.rows([owner_id])[0]))
+
+    def alive(self):
+        return (self.columns["hunger"] < 100) & (self.columns["happiness"] > 0)
+
+    def mark_dirty(self, rows, *columns):
+        # `rows` is anything NumPy can index with: a row number, an array of them, or a mask
+        self.dirty[rows] = True
+        self._dirty_columns.update(columns)
+
+    def remove(self, mask):
+        # Drop the masked rows (row numbers of later rows shift); returns their owner ids
+        removed = self.columns["owner_id"][mask].tolist()
+        keep = ~mask
+        self.columns = {c: a[keep] for c, a in self.columns.items()}
+        if self.names is not None:
+            self.names = [n for n, k in zip(self.names, keep.tolist()) if k]
+        self.dirty = self.dirty[keep]
+        return removed
+
+    async def write_back(self, conn):
+        # One executemany UPDATE of the modified columns for every dirty row
+        rows = np.flatnonzero(self.dirty)
+        columns = sorted(self._dirty_columns)
+        if len(rows) and columns:
+            values = []
+            for c in columns:
+                if c == "name":
+                    values.append([self.names[row] for row in rows.tolist()])
+                    continue
+                column = self.columns[c][rows].tolist()
+                if c in PET_TABLE_NULLABLE:
+                    column = [v or None for v in column]
+                values.append(column)
+            await conn.executemany(
+                f"UPDATE pets SET {', '.join(f'{c} = ?' for c in columns)} WHERE owner_id = ?",
+                zip(*values, self.columns["owner_id"][rows].tolist()),
+            )
+        self.dirty[:] = False
+        self._dirty_columns.clear()
+        return len(rows)
+
+class PetView:
+    """A pet whose columns live in one PetTable row; assignments mark the row dirty."""
+    __slots__ = ("_table", "_row")  # Just the row reference, the values stay in the arrays
+
+    def __init__(self, table, row):
+        self._table = table
+        self._row = row
+
+def _pet_view_column(column):
+    def get(self):
+        value = self._table.columns[column][self._row].item()
+        return None if column in PET_TABLE_NULLABLE and not value else value
+
+    def set(self, value):
+        self._table.columns[column][self._row] = (value or 0) if column in PET_TABLE_NULLABLE else value
+        self._table.mark_dirty(self._row, column)
+    return property(get, set)
+
+def _pet_view_names(table):
+    if table.names is None:
+        raise AttributeError("name was not loaded; use PetTable.load(..., names=True)")
+    return table.names
+
+def _set_pet_view_name(self, value):
+    _pet_view_names(self._table)[self._row] = value
+    self._table.mark_dirty(self._row, "name")
+
+for _column in PET_TABLE_DTYPES:
+    setattr(PetView, _column, _pet_view_column(_column))
+PetView.name = property(lambda self: _pet_view_names(self._table)[self._row], _set_pet_view_name)
+# The game logic is VirtualPet's, reading and writing through the properties above
+for _method in ("status", "is_alive", "get_mood", "get_age", "feed", "play", "sleep", "generate_embed"):
+    setattr(PetView, _method, VirtualPet.__dict__[_method])
+
+async def run_status_tick(now=None, shard_keys=None):
+    # Eager tick for every pet (or those in `shard_keys`): a single read, array math, and
+    # one write transaction. Reading inside the write transaction keeps concurrent saves
+    # from being overwritten.
+    now_tick = tick_index(now or time.time())
+    async with db.writer() as conn:
+        table = await PetTable.load(conn, ("hunger", "happiness", "energy", "freeze_end", "last_tick"),
+                                    shard_keys=shard_keys)
+        if not len(table):
+            return 0, 0
+        owner_ids, hunger, happiness, energy = table["owner_id"], table["hunger"], table["happiness"], table["energy"]
+
+        # First tick each pet still needs, past both its last applied tick and its freeze
+        first = np.maximum(
+            (table["last_tick"] // TICK_INTERVAL).astype(np.int64) + 1,
+            np.ceil(table["freeze_end"] / TICK_INTERVAL).astype(np.int64),
+        )
+        alive = table.alive()
+        touched = np.zeros(len(table), dtype=bool)
+        if alive.any():
+            # Normally a single tick; more if the bot was down or pets were left lazy
+            for tick in range(int(first[alive].min()), now_tick + 1):
+                active = alive & (first <= tick)
+                simulate_tick(owner_ids, tick, hunger, happiness, energy, active)
+                touched |= active
+                alive = table.alive()
+
+        changed = touched & alive
+        table.mark_dirty(changed, "hunger", "happiness", "energy")
+        await table.write_back(conn)
+        partition = ""
+        if shard_keys is not None:
+            partition = f" AND shard_key IN ({','.join('?' * len(shard_keys))})"
+        await conn.execute(f"UPDATE pets SET last_tick = ? WHERE last_tick < ?{partition}",
+                           (now_tick * TICK_INTERVAL, now_tick * TICK_INTERVAL, *(shard_keys or ())))
+        dead = table.remove(~alive)
+        await delete_pets_in(conn, dead)
+    for owner_id in dead:
+        coin_board.remove(owner_id)
+    return int(changed.sum()), len(dead)
+
+JOB_RETRY_DELAY = 60  # Seconds before a failed job is tried again
+
+class Job:
+    __slots__ = ("name", "interval", "func", "persist", "primary_only", "last_run", "last_duration", "runs", "failures")
+
+    def __init__(self, name, interval, func, persist, primary_only):
+        self.name = name
+        self.interval = interval
+        self.func = func
+        self.persist = persist  # Keep last_run in the jobs table across restarts
+        self.primary_only = primary_only  # World-wide jobs run in one process only
+        self.last_run = None
+        self.last_duration = None
+        self.runs = 0
+        self.failures = 0
+
+    @property
+    def next_run(self):
+        return self.last_run + self.interval if self.last_run is not None else None
+
+class JobScheduler:
+    """Runs every periodic job on exactly one task, scheduled from persisted run times."""
+
+    def __init__(self):
+        self._jobs = {}
+        self._tasks = {}
+
+    def job(self, name, interval, persist=True, primary_only=False):
+        # Decorator registering `func(missed, due)`: `missed` runs are due at once, the
+        # newest of them scheduled for `due`
+        def register(func):
+            if name in self._jobs:
+                raise ValueError(f"Job {name!r} is already registered")
+            self._jobs[name] = Job(name, interval, func, persist, primary_only)
+            return func
+        return register
+
+    async def start(self, now=None):
+        now = time.time() if now is None else now
+        async with db.reader() as conn:
+            async with conn.execute("SELECT name, last_run, last_duration FROM jobs") as cursor:
+                saved = {name: (last_run, duration) for name, last_run, duration in await cursor.fetchall()}
+        for job in self._jobs.values():
+            if job.primary_only and not is_primary_process():
+                continue
+            task = self._tasks.get(job.name)
+            if task is not None and not task.done():
+                continue  # Already running
+            if job.persist and job.name in saved:
+                job.last_run, job.last_duration = saved[job.name]
+            elif job.last_run is None:
+                job.last_run = now  # First run one interval from now
+            self._tasks[job.name] = asyncio.create_task(self._run(job))
+
+    async def stop(self):
+        tasks = list(self._tasks.values())
+        self._tasks.clear()
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def _run(self, job):
+        while True:
+            # Sleep until the next slot on the job's own grid, so run time never adds drift
+            delay = job.next_run - time.time()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            # Everything missed while the bot was down is handled in one pass
+            missed = int((time.time() - job.last_run) // job.interval)
+            start = time.perf_counter()
+            try:
+                with metrics.span(job.name, "job"):
+                    await job.func(missed, job.last_run + missed * job.interval)
+            except Exception as e:
+                job.failures += 1
+                print(f"Job {job.name} failed: {e}")
+                await asyncio.sleep(min(JOB_RETRY_DELAY, job.interval))
                 continue
-            await pet.save()
+            job.last_duration = time.perf_counter() - start
+            job.last_run += missed * job.interval
+            job.runs += 1
+            if job.persist:
+                await self._save(job)
+
+    async def _save(self, job):
+        try:
+            async with db.writer() as conn:
+                await conn.execute('''
+                    INSERT INTO jobs (name, last_run, last_duration) VALUES (?, ?, ?)
+                    ON CONFLICT(name) DO UPDATE SET last_run = excluded.last_run, last_duration = excluded.last_duration
+                ''', (job.name, job.last_run, job.last_duration))
+        except Exception as e:
+            print(f"Failed to save schedule for job {job.name}: {e}")
+
+    def stats(self):
+        return {
+            job.name: {
+                "interval": job.interval,
+                "next_run": job.next_run,
+                "last_duration": job.last_duration,
+                "runs": job.runs,
+                "failures": job.failures,
+                "running": job.name in self._tasks and not self._tasks[job.name].done(),
+            }
+            for job in self._jobs.values()
+        }
+
+scheduler = JobScheduler()
+
+TICK_SLOT = TICK_INTERVAL / PET_PARTITIONS  # The eager tick does one partition per slot, spread over the hour
+
+@scheduler.job("status_tick", TICK_SLOT, persist=False)
+async def update_pets_status(missed, due):
+    # In lazy mode ticks are materialized by update_status() when a pet is read,
+    # so untouched pets cost no writes at all
+    if TICK_MODE == "eager":
+        # Each slot belongs to one partition; this process only ticks the ones it owns.
+        # One pass covers every missed tick, since each pet records its last_tick.
+        slot = int(due // TICK_SLOT)
+        due_keys = {(slot - k) % PET_PARTITIONS for k in range(min(missed, PET_PARTITIONS))}
+        shard_keys = sorted(due_keys.intersection(owned_shard_keys()))
+        if not shard_keys:
+            return
+        await pet_cache.flush()
+        await run_status_tick(shard_keys=shard_keys)
+        pet_cache.invalidate(shard_keys)
+
+DAILY_COINS = 10  # Coins every pet receives per day
+
+@scheduler.job("daily_coins", 86400, primary_only=True)
+async def grant_daily_coins(missed, due):
+    # Days missed while the bot was down are granted together
+    newest = int(due // 86400)
+    await grant_coins(range(newest - missed + 1, newest + 1))
+
+async def grant_coins(days, amount=DAILY_COINS):
+    """Give every pet `amount` coins for each of `days` not yet in the ledger; returns coins per pet."""
+    days = list(days)
+    async with db.writer() as conn:
+        placeholders = ", ".join("?" * len(days))
+        async with conn.execute(f"SELECT day FROM coin_grants WHERE day IN ({placeholders})", days) as cursor:
+            granted = {row[0] for row in await cursor.fetchall()}
+        days = [day for day in days if day not in granted]
+        if not days:
+            return 0
+        coins = amount * len(days)
+        # Coins are only ever changed in SQL, so no pending cache state is overwritten here
+        cursor = await conn.execute("UPDATE pets SET coins = coins + ?", (coins,))
+        pets = cursor.rowcount
+        now = time.time()
+        await conn.executemany("INSERT INTO coin_grants (day, amount, pets, granted_at) VALUES (?, ?, ?, ?)",
+                               [(day, amount, pets, now) for day in days])
+        # Pets being read right now may have seen the rows from before this update
+        loading = pet_cache.loading_ids()
+        reloaded = []
+        for i in range(0, len(loading), SQL_MAX_VARIABLES):
+            chunk = loading[i:i + SQL_MAX_VARIABLES]
+            async with conn.execute(
+                f"SELECT owner_id, coins FROM pets WHERE owner_id IN ({','.join('?' * len(chunk))})", chunk
+            ) as cursor:
+                reloaded += await cursor.fetchall()
+    # No await since the commit, so no other coin change can have slipped in
+    pet_cache.shift_coins(coins)
+    for owner_id, balance in reloaded:
+        pet_cache.sync(owner_id, coins=balance)
+    coin_board.shift(coins)
+    return coins
 
-async def save_pets_periodically():
-    while True:
-        await asyncio.sleep(86400)  # Save every 24 hours
-        pets = await VirtualPet.load_all()
-        for pet in pets:
-            await pet.save()
-    
-async def grant_daily_coins():
-    while True:
-        await asyncio.sleep(86400)  # Wait for 24 hours
-        pets = await VirtualPet.load_all()
-        for pet in pets:
-            pet.coins += 10
-            await pet.save()
-    
 current_weather = None
 last_weather_change_time = time.time()
+GLOBAL_WEATHER_GUILD = 0  # Weather row every guild falls back to
+WEATHER_BY_TYPE = {weather["type"]: weather for weather in WEATHER_TYPES}
+guild_weather = {}  # guild_id -> weather, mirrors the weather table
 
 def change_weather():
     global current_weather
     current_weather = random.choice(WEATHER_TYPES)
     return current_weather
+
+def weather_for(guild_id):
+    return guild_weather.get(guild_id) or guild_weather.get(GLOBAL_WEATHER_GUILD)
+
+async def load_weather():
+    global current_weather, last_weather_change_time
+    async with db.reader() as conn:
+        async with conn.execute("SELECT guild_id, type, changed_at FROM weather") as cursor:
+            rows = await cursor.fetchall()
+    for guild_id, weather_type, changed_at in rows:
+        if weather_type not in WEATHER_BY_TYPE:
+            continue  # A weather type that has since been removed
+        guild_weather[guild_id] = WEATHER_BY_TYPE[weather_type]
+        if guild_id == GLOBAL_WEATHER_GUILD:
+            current_weather = guild_weather[guild_id]
+            last_weather_change_time = changed_at
+
+async def apply_weather(conn, weather, now, guild_id=GLOBAL_WEATHER_GUILD):
+    # apply_weather_effects for every pet of the guild not frozen at `now`, as one UPDATE.
+    # The shared weather covers the pets of every guild without weather of its own.
+    if guild_id == GLOBAL_WEATHER_GUILD:
+        guild_filter = f"guild_id NOT IN (SELECT guild_id FROM weather WHERE guild_id != {GLOBAL_WEATHER_GUILD})"
+        params = ()
+    else:
+        guild_filter, params = "guild_id = ?", (guild_id,)
+    cursor = await conn.execute(f'''
+        UPDATE pets SET
+            happiness = MAX(0, MIN(100, happiness + ?)),
+            hunger = MAX(0, MIN(100, hunger + ?)),
+            energy = MAX(0, MIN(100, energy + ?))
+        WHERE IFNULL(freeze_end, 0) <= ? AND {guild_filter}
+    ''', (weather["happiness_change"], weather["hunger_change"], weather["energy_change"], now, *params))
+    return cursor.rowcount
+
+async def set_weather(weather, guild_id=GLOBAL_WEATHER_GUILD, now=None):
+    """Store a guild's new weather and apply its effects to the pets in one transaction."""
+    global current_weather, last_weather_change_time
+    now = now or time.time()
+    await pet_cache.flush()  # Pending changes must land before the rows are rewritten
+    await run_status_tick(now)  # Weather lands on top of every tick due so far
+    async with db.writer() as conn:
+        async with conn.execute("SELECT changed_at FROM weather WHERE guild_id = ?", (guild_id,)) as cursor:
+            row = await cursor.fetchone()
+        if row and row[0] >= now:
+            return None  # Already changed for this slot, e.g. before a restart
+        await conn.execute('''
+            INSERT INTO weather (guild_id, type, changed_at) VALUES (?, ?, ?)
+            ON CONFLICT(guild_id) DO UPDATE SET type = excluded.type, changed_at = excluded.changed_at
+        ''', (guild_id, weather["type"], now))
+        affected = await apply_weather(conn, weather, now, guild_id)
+    pet_cache.invalidate()
+    guild_weather[guild_id] = weather
+    if guild_id == GLOBAL_WEATHER_GUILD:
+        current_weather = weather
+        last_weather_change_time = now
+    return affected
     
 def apply_weather_effects(pet):
     if not current_weather:
@@ -363,101 +1741,1092 @@ def apply_weather_effects(pet):
     pet.energy = max(0, min(100, pet.energy + current_weather["energy_change"]))
     return current_weather["description"]
 
-async def update_weather_periodically():
-    while True:
-        await asyncio.sleep(86400)  # Change weather every 24 hours
-        change_weather()
+@scheduler.job("weather", 86400, primary_only=True)
+async def update_weather_periodically(missed, due):
+    # Change weather every 24 hours; after downtime only the latest change is applied
+    await set_weather(random.choice(WEATHER_TYPES), now=due)
         
-async def delete_message_after_delay(message, delay=10):
-    await asyncio.sleep(delay)
-    try:
-        await message.delete()
-    except discord.errors.NotFound:
-        pass
-
-async def save_pet_to_db(pet):
-    async with aiosqlite.connect('pets.db') as db:
-        await db.execute('''
-            INSERT OR REPLACE INTO pets 
-            (owner_id, name, hunger, happiness, energy, birth_time, coins, last_claimed, freeze_end)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
-        ''', (
-            pet.owner_id,
-            pet.name,
-            pet.hunger,
-            pet.happiness,
-            pet.energy,
-            pet.birth_time,
-            pet.coins,
-            pet.last_claimed,
-            pet.freeze_end
-        ))
-        await db.commit()
-        
-async def delete_pet_from_db(owner_id):
-    # Connect to the SQLite database asynchronously
-    async with aiosqlite.connect('pets.db') as db:
+MESSAGE_DELETE_DELAY = 10  # Seconds before reaction responses are cleaned up
+MESSAGE_DELETE_BATCH_WINDOW = 1.0  # Messages due this close together are deleted in one call
+
+def can_bulk_delete(channel):
+    guild = getattr(channel, "guild", None)  # None in DMs
+    return (guild is not None and hasattr(channel, "delete_messages")
+            and channel.permissions_for(guild.me).manage_messages)
+
+class MessageDeleter:
+    """Deletes messages after a delay, with one timer task for all of them."""
+
+    def __init__(self, batch_window=MESSAGE_DELETE_BATCH_WINDOW):
+        self.batch_window = batch_window
+        self._heap = []  # (due, sequence, message)
+        self._sequence = itertools.count()
+        self._wakeup = asyncio.Event()
+        self._task = None
+        self.deleted = 0
+        self.api_calls = 0
+
+    def __len__(self):
+        return len(self._heap)
+
+    def schedule(self, message, delay=None):
+        delay = MESSAGE_DELETE_DELAY if delay is None else delay
+        heapq.heappush(self._heap, (time.monotonic() + delay, next(self._sequence), message))
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+        self._wakeup.set()  # The new message may be due before the one we're waiting on
+
+    async def _run(self):
+        while self._heap:
+            timeout = self._heap[0][0] - time.monotonic()
+            if timeout > 0:
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            # Take everything due now or within the batch window, grouped by channel
+            cutoff = time.monotonic() + self.batch_window
+            by_channel = {}
+            while self._heap and self._heap[0][0] <= cutoff:
+                message = heapq.heappop(self._heap)[2]
+                by_channel.setdefault(message.channel.id, []).append(message)
+            await asyncio.gather(*(self._delete(messages) for messages in by_channel.values()))
+
+    async def _delete(self, messages):
+        channel = messages[0].channel
+        # Bulk deletion takes up to 100 messages but needs Manage Messages; check first,
+        # since every 403 counts toward Discord's invalid request limit
+        if len(messages) > 1 and can_bulk_delete(channel):
+            try:
+                for i in range(0, len(messages), 100):
+                    self.api_calls += 1
+                    await channel.delete_messages(messages[i:i + 100])
+                self.deleted += len(messages)
+                return
+            except discord.Forbidden:
+                pass
+            except discord.HTTPException as e:
+                print(f"Bulk delete failed, deleting one by one: {e}")
+        for message in messages:
+            self.api_calls += 1
+            try:
+                await message.delete()
+                self.deleted += 1
+            except discord.errors.NotFound:
+                pass
+            except discord.HTTPException as e:
+                print(f"Failed to delete message {message.id}: {e}")
+
+message_deleter = MessageDeleter()
+
+REACTION_BATCH_WINDOW = 1.0  # Seconds reactions on one message are collected before acting on them
+EMBED_EDIT_INTERVAL = 1.0  # Minimum seconds between edits of the same message
+DISCORD_MESSAGE_LIMIT = 2000
+
+def chunk_lines(lines, limit=DISCORD_MESSAGE_LIMIT):
+    # Join lines into as few messages as fit under Discord's length limit
+    chunk = ""
+    for line in lines:
+        if chunk and len(chunk) + 1 + len(line) > limit:
+            yield chunk
+            chunk = ""
+        chunk = f"{chunk}\n{line}" if chunk else line
+    if chunk:
+        yield chunk
+
+class ReactionBatcher:
+    """Coalesces reactions per message: one embed edit and one write-back per window."""
+
+    def __init__(self, window=REACTION_BATCH_WINDOW):
+        self.window = window
+        self._pending = {}    # message id -> [(reaction, user), ...] in arrival order
+        self._tasks = set()
+        self._closing = asyncio.Event()
+        self._edits = {}      # message id -> (message, newest embed) while an edit is in flight
+        self._next_edit = {}  # message id -> earliest monotonic time for its next edit
+        self.actions = 0
+        self.coalesced = 0
+        self.windows = 0
+        self.embed_updates = 0
+        self.edits = 0
+        self.rate_limited = 0
+
+    def add(self, reaction, user):
+        self.actions += 1
+        queue = self._pending.get(reaction.message.id)
+        if queue is not None:
+            queue.append((reaction, user))
+            self.coalesced += 1
+            return
+        self._pending[reaction.message.id] = [(reaction, user)]
+        task = asyncio.create_task(self._run(reaction.message))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def drain(self):
+        # Apply every waiting window now, e.g. on shutdown
+        self._closing.set()
+        if self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+
+    async def _run(self, message):
+        try:
+            await asyncio.wait_for(self._closing.wait(), self.window)
+        except asyncio.TimeoutError:
+            pass
+        actions = self._pending.pop(message.id)
+        self.windows += 1
+        try:
+            with metrics.span("reaction_batch", "event"):
+                await self._apply(message, actions)
+        except Exception as e:
+            print(f"Failed to apply reactions on message {message.id}: {e}")
+
+    async def _apply(self, message, actions):
+        channel = message.channel
+        notices = []   # Kept in the channel: missing pets, deaths, mood changes
+        results = []   # Cleaned up after MESSAGE_DELETE_DELAY
+        handled = []   # Reactions to remove so they can be pressed again
+        last_pet = None
+        for reaction, user in actions:
+            # Load the user's pet (from memory if it was used recently)
+            pet = await pet_cache.get(user.id)
+            if not pet:
+                notices.append(f"{user.mention}, you don't have a pet yet! Use `~adopt [pet_name]` to adopt one.")
+                continue
+            # Check if the pet is alive
+            old_mood = pet.get_mood()  # Get the old mood before the action
+            alive, text = pet.is_alive()
+            if not alive:
+                notices.append(text)
+                # Delete the pet from the database since it's dead
+                await pet_cache.delete(user.id)
+                continue
+            # Handle the reaction-based interaction
+            if reaction.emoji == "🍗":  # Feed
+                result = pet.feed()
+            elif reaction.emoji == "🎾":  # Play
+                result = pet.play()
+            elif reaction.emoji == "💤":  # Sleep
+                result = pet.sleep()
+            else:
+                continue  # If the reaction is not valid, do nothing
+            # Record the change; however many actions hit this pet, it is written back once
+            pet_cache.mark_dirty(pet)
+            new_mood = pet.get_mood()
+            if new_mood != old_mood:
+                notices.append(f"{user.mention}, your pet's mood changed to {new_mood}!")
+            results.append(result)
+            handled.append((reaction, user))
+            last_pet = pet
+            self.embed_updates += 1
+
+        async def send_messages():
+            for text in chunk_lines(notices):
+                await channel.send(text)
+            for text in chunk_lines(results):
+                message_deleter.schedule(await channel.send(text))
+
+        # Messages, one edit with the final state, and reaction removals all run together
+        steps = [send_messages(), *(reaction.remove(user) for reaction, user in handled)]
+        if last_pet is not None:
+            steps.append(self._edit(message, last_pet.generate_embed()))
+        await asyncio.gather(*steps)
+
+    async def _edit(self, message, embed):
+        # Only the newest embed matters: if an edit for this message is already waiting
+        # or in flight, hand it the new embed instead of sending another one
+        in_flight = message.id in self._edits
+        self._edits[message.id] = (message, embed)
+        if in_flight:
+            return
+        try:
+            while True:
+                delay = self._next_edit.get(message.id, 0) - time.monotonic()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                message, embed = self._edits[message.id]
+                try:
+                    await message.edit(embed=embed)
+                except discord.RateLimited as e:
+                    retry_after = e.retry_after
+                except discord.HTTPException as e:
+                    if e.status != 429:
+                        raise
+                    retry_after = float(e.response.headers.get("Retry-After", EMBED_EDIT_INTERVAL))
+                else:
+                    self.edits += 1
+                    self._next_edit[message.id] = time.monotonic() + EMBED_EDIT_INTERVAL
+                    if self._edits[message.id][1] is embed:
+                        break
+                    continue  # A newer embed arrived while this one was being sent
+                # Rate limited: wait as long as Discord asked, then send the newest embed
+                self.rate_limited += 1
+                self._next_edit[message.id] = time.monotonic() + retry_after
+        finally:
+            del self._edits[message.id]
+            now = time.monotonic()
+            if len(self._next_edit) > 1000:
+                self._next_edit = {k: t for k, t in self._next_edit.items() if t > now}
+
+    def stats(self):
+        return {
+            "actions": self.actions,
+            "coalesced": self.coalesced,
+            "windows": self.windows,
+            "edits": self.edits,
+            "edits_saved": self.embed_updates - self.edits,
+            "rate_limited": self.rate_limited,
+        }
+
+reaction_batcher = ReactionBatcher()
+
+# Seconds writes are collected before they are committed together. With 0 a batch goes
+# out as soon as the previous commit is done, and whatever arrived meanwhile shares it.
+WRITE_QUEUE_WINDOW = 0.0
+WRITE_QUEUE_SIZE = 128  # Writes after which the queue commits without waiting out the window
+
+class WriteQueue:
+    """Group commit for pet writes: everything submitted within one window shares a transaction."""
+
+    def __init__(self, window=WRITE_QUEUE_WINDOW, max_size=WRITE_QUEUE_SIZE):
+        self.window = window
+        self.max_size = max_size
+        self._pending = []  # (operation, future, span, submitted at) in submission order
+        self._full = asyncio.Event()
+        self._task = None
+        self.submitted = 0
+        self.batches = 0
+        self.retried = 0
+
+    def submit(self, operation):
+        # Queue `operation(conn)`; the returned future resolves to its result once committed
+        future = asyncio.get_running_loop().create_future()
+        self._pending.append((operation, future, _current_span.get(), time.perf_counter()))
+        self.submitted += 1
+        if len(self._pending) >= self.max_size:
+            self._full.set()
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+        return future
+
+    async def drain(self):
+        # Commit whatever is queued now, e.g. on shutdown
+        self._full.set()
+        while self._task is not None and not self._task.done():
+            await asyncio.shield(self._task)
+
+    async def _run(self):
+        # Batches are charged to the spans that submitted them, not the one that started this task
+        _current_span.set(None)
+        while self._pending:
+            if len(self._pending) < self.max_size:
+                if self.window:
+                    with contextlib.suppress(asyncio.TimeoutError):
+                        await asyncio.wait_for(self._full.wait(), self.window)
+                else:
+                    await asyncio.sleep(0)  # Let writes submitted in the same turn join
+            self._full.clear()
+            batch, self._pending = self._pending[:self.max_size], self._pending[self.max_size:]
+            if len(self._pending) >= self.max_size:
+                self._full.set()
+            await self._commit(batch)
+
+    async def _commit(self, batch):
+        results = []
+        try:
+            async with db.writer() as conn:
+                for operation, _, span, _ in batch:
+                    statements = conn.statements
+                    results.append(await operation(conn))
+                    if span is not None:
+                        span.queries += conn.statements - statements
+        except Exception as e:
+            if len(batch) == 1:
+                if not batch[0][1].done():
+                    batch[0][1].set_exception(e)
+                return
+            # One bad write must not fail the rest: redo each in its own transaction
+            self.retried += len(batch)
+            for item in batch:
+                await self._commit([item])
+            return
+        except BaseException as e:
+            for _, future, _, _ in batch:
+                if not future.done():
+                    future.set_exception(e)
+            raise
+        self.batches += 1
+        now = time.perf_counter()
+        waited = {}  # span -> earliest submission in this batch
+        for (_, future, span, submitted), result in zip(batch, results):
+            if span is not None:
+                waited[span] = min(submitted, waited.get(span, submitted))
+            if not future.done():
+                future.set_result(result)
+        for span, submitted in waited.items():
+            span.db += now - submitted
+            span.commits += 1
+
+    def stats(self):
+        return {
+            "submitted": self.submitted,
+            "batches": self.batches,
+            "per_batch": self.submitted / self.batches if self.batches else 0.0,
+            "retried": self.retried,
+            "queued": len(self._pending),
+        }
+
+write_queue = WriteQueue()
+
+def completed(result=None):
+    future = asyncio.get_running_loop().create_future()
+    future.set_result(result)
+    return future
+
+# The pet write helpers below queue their write and return its future; await it to know
+# the write is committed
+
+def save_pet_to_db(pet):
+    return save_pets_to_db([pet])
+
+def save_pets_to_db(pets):
+    # Write any number of pets in a single transaction, touching only what changed:
+    # new pets are upserted whole, existing ones get an UPDATE of just their modified
+    # columns, with one executemany per distinct set of columns
+    taken = [(pet, pet.take_changes()) for pet in pets]
+    inserts = []
+    updates = {}
+    for pet, changed in taken:
+        if changed is None:
+            inserts.append(tuple(getattr(pet, column) for column in PET_COLUMNS))
+        elif changed:
+            columns = tuple(sorted(changed))
+            updates.setdefault(columns, []).append(
+                tuple(getattr(pet, column) for column in columns) + (pet.owner_id,)
+            )
+    if not inserts and not updates:
+        return completed()
+
+    async def write(conn):
+        if inserts:
+            await conn.executemany(f'''
+                INSERT INTO pets ({", ".join(PET_COLUMNS)})
+                VALUES ({", ".join("?" * len(PET_COLUMNS))})
+                ON CONFLICT(owner_id) DO UPDATE SET
+                {", ".join(f"{c} = excluded.{c}" for c in PET_COLUMNS if c != "owner_id")}
+            ''', inserts)
+        for columns, params in updates.items():
+            await conn.executemany(
+                f"UPDATE pets SET {', '.join(f'{c} = ?' for c in columns)} WHERE owner_id = ?",
+                params,
+            )
+
+    def restore_on_failure(future):
+        if future.cancelled() or future.exception() is not None:
+            for pet, changed in taken:
+                pet.restore_changes(changed)
+
+    future = write_queue.submit(write)
+    future.add_done_callback(restore_on_failure)
+    return future
+
+def delete_pet_from_db(owner_id):
+    async def delete(conn):
         # SQL query to delete the pet record for the given owner_id
-        query = "DELETE FROM pets WHERE owner_id = ?"
-        
-        # Execute the deletion query with the provided owner_id
-        await db.execute(query, (owner_id,))
-        
-        # Commit the changes to the database
-        await db.commit()
-    
-async def update_pet_in_db(pet):
-    async with aiosqlite.connect('pets.db') as db:
-        await db.execute("""
-            UPDATE pets
-            SET name = ?, hunger = ?, happiness = ?, energy = ?, birth_time = ?, coins = ?, last_claimed = ?, freeze_end = ?
-            WHERE owner_id = ?
-        """, (
-            pet.name,                           # Access pet's name attribute
-            int(pet.hunger),                   # Ensure hunger is an integer
-            int(pet.happiness),                # Ensure happiness is an integer
-            int(pet.energy),                   # Ensure energy is an integer
-            float(pet.birth_time),             # Ensure birth_time is a float
-            int(pet.coins),                    # Ensure coins is an integer
-            float(pet.last_claimed) if pet.last_claimed is not None else None,  # Ensure last_claimed is a float or None
-            float(pet.freeze_end) if pet.freeze_end is not None else None,      # Ensure freeze_end is a float or None
-            int(pet.owner_id)                  # Ensure owner_id is an integer
-        ))
-        await db.commit()
-    
-async def fetch_all_pets_from_db():
-    # Connect to the SQLite database asynchronously
-    async with aiosqlite.connect('pets.db') as db:
-        # SQL query to fetch all pets from the database
-        query = "SELECT owner_id, name, hunger, happiness, energy, birth_time, coins, last_claimed, freeze_end FROM pets"
-        
-        # Execute the query and fetch all records
-        async with db.execute(query) as cursor:
-            rows = await cursor.fetchall()  # Fetch all rows asynchronously
-            
-            # Convert rows into a list of pet dictionaries or objects
-            pets = []
-            for row in rows:
-                pet_data = {
-                    'owner_id': row[0],
-                    'name': row[1],
-                    'hunger': row[2],
-                    'happiness': row[3],
-                    'energy': row[4],
-                    'birth_time': row[5],
-                    'coins': row[6],
-                    'last_claimed': row[7],
-                    'freeze_end': row[8]
-                }
-                pets.append(pet_data)
-            
-            return pets
-    
-async def update_freeze_timer_in_db(owner_id, freeze_end):
-    async with aiosqlite.connect('pets.db') as db:
-        await db.execute("UPDATE pets SET freeze_end = ? WHERE owner_id = ?", (freeze_end, owner_id))
-        await db.commit()
-    
+        await conn.execute("DELETE FROM pets WHERE owner_id = ?", (owner_id,))
+    return write_queue.submit(delete)
+
+def update_pet_in_db(pet):
+    # Only the columns modified since the pet was loaded are written
+    return save_pets_to_db([pet])
+
+def touch_pets_in_db(owner_ids, now=None):
+    # Record when these pets were last used
+    if not owner_ids:
+        return completed()
+    now = time.time() if now is None else now
+    params = [(now, owner_id) for owner_id in owner_ids]
+    async def touch(conn):
+        await conn.executemany("UPDATE pets SET last_active = ? WHERE owner_id = ?", params)
+    return write_queue.submit(touch)
+
+def update_freeze_timer_in_db(owner_id, freeze_end):
+    async def update(conn):
+        await conn.execute("UPDATE pets SET freeze_end = ? WHERE owner_id = ?", (freeze_end, owner_id))
+    return write_queue.submit(update)
+
+PET_CACHE_SIZE = 10000  # Most pets kept in memory at once
+PET_CACHE_FLUSH_INTERVAL = 30  # Seconds between write-backs of modified pets
+# A pet belongs to its owner, not a guild, so when other bot processes share the database
+# (sharded across processes, or behind the write service) any of them may change it.
+# Pets and the coin board are then read from the database and written through.
+SHARED_DATABASE = SHARD_IDS is not None or DB_SERVICE_SOCKET is not None
+
+class PetCache:
+    """Write-back LRU cache of VirtualPet objects keyed by owner_id."""
+
+    def __init__(self, max_size=PET_CACHE_SIZE, write_back=not SHARED_DATABASE):
+        self.max_size = max_size
+        self.write_back = write_back  # False: nothing is kept, every change is written at once
+        self._pets = OrderedDict()  # owner_id -> pet, least recently used first
+        self._dirty = set()         # owner_ids changed since the last flush
+        self._evicted = {}          # Dirty pets pushed out of the LRU, written on the next flush
+        self._loading = {}          # owner_id -> fields synced while that pet was being read
+        self._touched = set()       # owner_ids used since the last flush, for pets.last_active
+        self._writing = {}          # owner_id -> write-through save still in the queue
+        self._flush_lock = asyncio.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.flushes = 0
+        self.rows_flushed = 0
+
+    def __len__(self):
+        return len(self._pets)
+
+    async def get(self, owner_id):
+        pet = self._pets.get(owner_id)
+        if pet is None and owner_id in self._evicted:
+            pet = self._evicted.pop(owner_id)
+            self.add(pet)
+            self._dirty.add(owner_id)
+        if pet is not None:
+            self.hits += 1
+            self._touched.add(owner_id)
+            self._pets.move_to_end(owner_id)
+            pet.update_status()  # Ticks keep landing while the pet sits in memory
+            return pet
+
+        self.misses += 1
+        if owner_id in self._writing:
+            # Read our own last write, not the row from before it
+            await asyncio.wait([self._writing[owner_id]])
+        patches = self._loading.setdefault(owner_id, {})
+        try:
+            pet = await fetch_pet_from_db(owner_id)
+        finally:
+            self._loading.pop(owner_id, None)
+        if pet is None:
+            return None
+        if not self.write_back:
+            self._touched.add(owner_id)
+            return pet
+        # Another coroutine may have loaded the same pet while we were waiting
+        if owner_id in self._pets:
+            return self._pets[owner_id]
+        # Our row may predate a transaction that committed during the read
+        pet.set_saved(**patches)
+        self.add(pet)
+        self._touched.add(owner_id)
+        return pet
+
+    async def preload(self, owner_ids):
+        # Read the given pets into free slots, least important last, without counting them
+        # as used. Commits during the read are caught the same way get() catches them.
+        if not self.write_back:
+            return 0
+        owner_ids = [o for o in owner_ids if self.peek(o) is None and o not in self._loading]
+        owner_ids = owner_ids[:max(0, self.max_size - len(self._pets))]
+        patches = {owner_id: self._loading.setdefault(owner_id, {}) for owner_id in owner_ids}
+        pets = []
+        try:
+            async with db.reader() as conn:
+                for i in range(0, len(owner_ids), SQL_MAX_VARIABLES):
+                    chunk = owner_ids[i:i + SQL_MAX_VARIABLES]
+                    pets += await fetch_pets(conn, f"WHERE owner_id IN ({', '.join('?' * len(chunk))})", chunk)
+        finally:
+            for owner_id, patch in patches.items():
+                if self._loading.get(owner_id) is patch:
+                    del self._loading[owner_id]
+        by_owner = {pet.owner_id: pet for pet in pets}
+        loaded = 0
+        for owner_id in reversed(owner_ids):  # The first ends up most recently used
+            pet = by_owner.get(owner_id)
+            if pet is None or owner_id in self._pets:  # Deleted, or loaded by get() meanwhile
+                continue
+            pet.update_status()
+            pet.set_saved(**patches[owner_id])
+            self.add(pet)
+            loaded += 1
+        return loaded
+
+    def add(self, pet):
+        # Insert a pet that is already in sync with the database
+        if not self.write_back:
+            return
+        self._pets[pet.owner_id] = pet
+        self._pets.move_to_end(pet.owner_id)
+        while len(self._pets) > self.max_size:
+            owner_id, old = self._pets.popitem(last=False)
+            self.evictions += 1
+            if owner_id in self._dirty:
+                self._dirty.discard(owner_id)
+                self._evicted[owner_id] = old
+
+    def mark_dirty(self, pet):
+        # Record a change; the row is written by the next flush()
+        if not self.write_back:
+            self._write_through(pet)
+            return
+        if self._pets.get(pet.owner_id) is not pet:
+            self.add(pet)
+        self._dirty.add(pet.owner_id)
+
+    def _write_through(self, pet):
+        # Queue the change now; get() waits for it before reading the pet again
+        owner_id = pet.owner_id
+        future = save_pets_to_db([pet])
+
+        def done(future):
+            if self._writing.get(owner_id) is future:
+                del self._writing[owner_id]
+            if not future.cancelled() and future.exception() is not None:
+                print(f"Failed to save pet {owner_id}: {future.exception()}")
+
+        self._writing[owner_id] = future
+        future.add_done_callback(done)
+
+    def shift_coins(self, delta):
+        # Every pet in the database just gained `delta` coins
+        for pet in itertools.chain(self._pets.values(), self._evicted.values()):
+            pet.set_saved(coins=pet.coins + delta)
+
+    def loading_ids(self):
+        # Owners whose rows are being read right now; sync() patches them once they arrive
+        return list(self._loading)
+
+    def peek(self, owner_id):
+        # The cached pet, if any, without loading it or touching the LRU order
+        return self._pets.get(owner_id) or self._evicted.get(owner_id)
+
+    def sync(self, owner_id, **fields):
+        # Mirror values another transaction already committed, without marking the pet dirty
+        pet = self.peek(owner_id)
+        if pet is not None:
+            pet.set_saved(**fields)
+        if owner_id in self._loading:
+            self._loading[owner_id].update(fields)
+
+    async def delete(self, owner_id):
+        # Deletions are written through immediately
+        self._pets.pop(owner_id, None)
+        self._dirty.discard(owner_id)
+        self._evicted.pop(owner_id, None)
+        coin_board.remove(owner_id)
+        await delete_pet_from_db(owner_id)
+
+    def invalidate(self, shard_keys=None):
+        # Drop every clean entry (of the given partitions), e.g. after a bulk update
+        # rewrote the table underneath us
+        shard_keys = set(shard_keys) if shard_keys is not None else None
+        for owner_id, pet in list(self._pets.items()):
+            if owner_id not in self._dirty and (shard_keys is None or pet.shard_key in shard_keys):
+                del self._pets[owner_id]
+
+    def clear(self):
+        self._pets.clear()
+        self._dirty.clear()
+        self._evicted.clear()
+
+    async def flush(self):
+        # Coalesce every pending change into a single transaction
+        if self._writing:
+            await asyncio.wait(list(self._writing.values()))
+        async with self._flush_lock:
+            pets = list(self._evicted.values()) + [self._pets[o] for o in self._dirty]
+            touched, self._touched = self._touched, set()
+            if not pets and not touched:
+                return 0
+            dirty, evicted = set(self._dirty), dict(self._evicted)
+            self._dirty.clear()
+            self._evicted.clear()
+            try:
+                # Queued together, so both land in the same commit
+                await asyncio.gather(save_pets_to_db(pets), touch_pets_in_db(touched))
+            except BaseException:
+                # Keep the changes around for the next attempt
+                self._dirty |= {o for o in dirty if o in self._pets}
+                self._evicted.update({o: p for o, p in evicted.items() if o not in self._pets})
+                self._touched |= touched
+                raise
+            self.flushes += 1
+            self.rows_flushed += len(pets)
+            return len(pets)
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._pets),
+            "max_size": self.max_size,
+            "write_back": self.write_back,
+            "dirty": len(self._dirty) + len(self._evicted),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "evictions": self.evictions,
+            "flushes": self.flushes,
+            "rows_flushed": self.rows_flushed,
+        }
+
+pet_cache = PetCache()
+
+metrics.gauge("sophia_pet_cache_size", "Pets held in memory.", lambda: len(pet_cache))
+metrics.gauge("sophia_write_queue_pending", "Pet writes waiting for a commit.", lambda: write_queue.stats()["queued"])
+
+PRELOAD_PETS = int(os.environ.get("SOPHIA_PRELOAD_PETS", 1000))  # Recently active pets read in at startup; 0 turns it off
+
+async def preload_active_pets(limit=PRELOAD_PETS):
+    # Warm the cache with this process's most recently used pets, so the first commands
+    # after a restart don't all go to the database
+    start = time.perf_counter()
+    try:
+        shard_keys = owned_shard_keys()
+        where = "WHERE last_active IS NOT NULL"
+        if len(shard_keys) < PET_PARTITIONS:
+            where += f" AND shard_key IN ({', '.join(map(str, shard_keys))})"
+        async with db.reader() as conn:
+            async with conn.execute(f"SELECT owner_id FROM pets {where} ORDER BY last_active DESC LIMIT ?",
+                                    (limit,)) as cursor:
+                owner_ids = [row[0] for row in await cursor.fetchall()]
+        loaded = await pet_cache.preload(owner_ids)
+    except Exception as e:
+        print(f"Preloading pets failed: {e}")
+        return 0
+    metrics.mark_startup("preload")
+    print(f"Preloaded {loaded} recently active pets in {time.perf_counter() - start:.2f}s")
+    return loaded
+
+@scheduler.job("save_pets", PET_CACHE_FLUSH_INTERVAL, persist=False)
+async def save_pets_periodically(missed, due):
+    # Write back every pet changed in memory since the last flush
+    await pet_cache.flush()
+
+CHECKPOINT_INTERVAL = 3600  # Seconds between WAL checkpoints
+VACUUM_PAGES = 1000  # Free pages returned to the filesystem per compacting checkpoint
+
+async def checkpoint(compact=False):
+    """Flush pending pet changes, fold the WAL into the database and truncate it.
+
+    With `compact`, also return free pages to the filesystem and refresh planner statistics.
+    """
+    start = time.perf_counter()
+    rows = await pet_cache.flush()  # One transaction for everything dirty in memory
+    flushed = time.perf_counter()
+    wal_path = db.path + "-wal"
+    wal_bytes = os.path.getsize(wal_path) if os.path.exists(wal_path) else 0
+    async with db.maintenance() as conn:
+        async with conn.execute("PRAGMA page_size") as cursor:
+            page_size = (await cursor.fetchone())[0]
+        # Copy the WAL back first: (busy, pages in the WAL, pages copied); busy means a
+        # reader held us off. TRUNCATE then only has to reset the file, and reports zeros.
+        async with conn.execute("PRAGMA wal_checkpoint(PASSIVE)") as cursor:
+            busy, wal_pages, copied = await cursor.fetchone()
+        async with conn.execute("PRAGMA wal_checkpoint(TRUNCATE)") as cursor:
+            busy = (await cursor.fetchone())[0] or busy
+        freed = 0
+        if compact:
+            async with conn.execute("PRAGMA auto_vacuum") as cursor:
+                incremental = (await cursor.fetchone())[0] == 2
+            async with conn.execute("PRAGMA freelist_count") as cursor:
+                free_pages = (await cursor.fetchone())[0]
+            if incremental and free_pages:
+                # Each step of the statement frees one page, so it has to be run to completion
+                async with conn.execute(f"PRAGMA incremental_vacuum({VACUUM_PAGES})") as cursor:
+                    await cursor.fetchall()
+                async with conn.execute("PRAGMA freelist_count") as cursor:
+                    freed = free_pages - (await cursor.fetchone())[0]
+            await conn.execute("ANALYZE")
+            # Vacuuming and ANALYZE write through the WAL again
+            await conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        else:
+            await conn.execute("PRAGMA optimize")
+    return {
+        "rows": rows,
+        "wal_bytes": wal_bytes,
+        "checkpointed_bytes": max(copied, 0) * page_size,
+        "busy": bool(busy),
+        "freed_bytes": freed * page_size,
+        "db_bytes": os.path.getsize(db.path),
+        "flush_seconds": flushed - start,
+        "seconds": time.perf_counter() - start,
+    }
+
+@scheduler.job("checkpoint", CHECKPOINT_INTERVAL, persist=False)
+async def checkpoint_periodically(missed, due):
+    stats = await checkpoint()
+    if stats["busy"]:
+        print("WAL checkpoint was blocked by a reader; the WAL will be folded in next time")
+
+BACKUP_DIR = os.environ.get("SOPHIA_BACKUP_DIR", "backups")
+BACKUP_INTERVAL = 6 * 3600  # Seconds between scheduled backups
+BACKUP_KEEP = 8  # Newest backups kept; older ones are deleted after each backup
+BACKUP_PAGES = 1024  # Pages copied per backup step, each step under its own short read lock
+BACKUP_MAX_RESTARTS = 2  # Writes restart a stepped copy; after this many, copy in one step
+
+class BackupRestarted(Exception):
+    pass
+
+def copy_database(source_path, target_path, pages=BACKUP_PAGES, max_restarts=BACKUP_MAX_RESTARTS):
+    # Blocking; run in a thread. Online copy with the SQLite backup API, then quick_check
+    # on the copy. A write from another connection makes the copy start over, so under
+    # steady writes it falls back to one step: a single read snapshot, which WAL writers
+    # don't wait for.
+    source = sqlite3.connect(source_path)
+    target = sqlite3.connect(target_path)
+    stats = {"steps": 0, "restarts": 0, "stepped": True}
+    remaining_before = math.inf
+
+    def progress(status, remaining, total):
+        nonlocal remaining_before
+        stats["steps"] += 1
+        if remaining > remaining_before:
+            stats["restarts"] += 1
+            if stats["restarts"] > max_restarts:
+                raise BackupRestarted
+        remaining_before = remaining
+
+    try:
+        source.execute("PRAGMA query_only=ON")
+        try:
+            source.backup(target, pages=pages, progress=progress)
+        except BackupRestarted:
+            stats["stepped"] = False
+            source.backup(target, pages=-1)
+        target.execute("PRAGMA journal_mode=DELETE")  # A single self-contained file
+        stats["check"] = [row[0] for row in target.execute("PRAGMA quick_check")]
+    finally:
+        source.close()
+        target.close()
+    return stats
+
+def rotate_backups(directory, keep=BACKUP_KEEP):
+    # Delete all but the newest `keep` backups, and copies abandoned halfway
+    names = sorted(name for name in os.listdir(directory) if name.startswith("pets-"))
+    backups = [name for name in names if name.endswith(".db")]
+    stale = [name for name in names if name.endswith(".partial")] + backups[:max(0, len(backups) - keep)]
+    for name in stale:
+        with contextlib.suppress(OSError):
+            os.remove(os.path.join(directory, name))
+    return len(stale)
+
+backup_lock = asyncio.Lock()
+
+async def backup_database(directory=BACKUP_DIR, keep=BACKUP_KEEP):
+    # Back up the live database to `directory` without pausing the bot
+    async with backup_lock:
+        start = time.perf_counter()
+        await pet_cache.flush()  # Changes still in memory belong in the backup
+        os.makedirs(directory, exist_ok=True)
+        now = time.time()
+        stamp = f"{time.strftime('%Y%m%d-%H%M%S', time.localtime(now))}-{int(now * 1000) % 1000:03d}"
+        path = os.path.join(directory, f"pets-{stamp}.db")
+        partial = path + ".partial"
+        try:
+            stats = await asyncio.to_thread(copy_database, db.path, partial)
+            if stats["check"] != ["ok"]:
+                raise sqlite3.DatabaseError(f"Backup copy failed quick_check: {'; '.join(stats['check'][:3])}")
+            os.replace(partial, path)
+        except BaseException:
+            with contextlib.suppress(OSError):
+                os.remove(partial)
+            raise
+        stats.update({
+            "path": path,
+            "bytes": os.path.getsize(path),
+            "removed": rotate_backups(directory, keep),
+            "seconds": time.perf_counter() - start,
+        })
+        return stats
+
+@scheduler.job("backup", BACKUP_INTERVAL, primary_only=True)
+async def backup_periodically(missed, due):
+    stats = await backup_database()
+    print(f"Backed up the database to {stats['path']} in {stats['seconds']:.1f}s ({stats['bytes'] / 2**20:.1f} MB)")
+
+EXPORT_PAGE_SIZE = 1000  # Rows per page read by exports
+EXPORT_BUFFER = 4  # Pages an export reads ahead of the file writer
+IMPORT_CHUNK = 1000  # Rows per transaction written by imports
+EXPORT_FORMATS = ("ndjson", "csv")
+EXPORT_COLUMNS = PET_COLUMNS + ("last_active",)
+EXPORT_TYPES = {"name": str, "birth_time": float, "last_claimed": float, "freeze_end": float,
+                "last_tick": float, "last_active": float}  # Every other column is an integer
+IMPORT_REQUIRED = ("name", "owner_id", "birth_time")
+IMPORT_DEFAULTS = {"hunger": 50, "happiness": 50, "energy": 50, "coins": 0, "guild_id": 0}
+
+async def stream_pets(page_size=EXPORT_PAGE_SIZE, buffer=EXPORT_BUFFER):
+    # Yield the pets table as pages of EXPORT_COLUMNS rows, in owner_id order. Each page is
+    # its own short read, so a long export never holds a reader or pins the WAL; a reader
+    # task keeps at most `buffer` pages ready ahead of the consumer
+    pages = asyncio.Queue(maxsize=buffer)
+    owner = EXPORT_COLUMNS.index("owner_id")
+
+    async def read():
+        after = -2**63
+        try:
+            while True:
+                async with db.reader() as conn:
+                    async with conn.execute(
+                        f"SELECT {', '.join(EXPORT_COLUMNS)} FROM pets WHERE owner_id > ? ORDER BY owner_id LIMIT ?",
+                        (after, page_size),
+                    ) as cursor:
+                        page = await cursor.fetchall()
+                if not page:
+                    break
+                await pages.put(page)
+                after = page[-1][owner]
+        except Exception as e:
+            await pages.put(e)
+            return
+        await pages.put(None)
+
+    reader = asyncio.create_task(read())
+    try:
+        while (page := await pages.get()) is not None:
+            if isinstance(page, Exception):
+                raise page
+            yield page
+    finally:
+        reader.cancel()
+
+def dump_format(path, format=None):
+    # Explicit, or from the file name: .csv / .csv.gz, anything else is NDJSON
+    format = format or ("csv" if path.removesuffix(".gz").endswith(".csv") else "ndjson")
+    if format not in EXPORT_FORMATS:
+        raise ValueError(f"Unknown format {format!r}, expected one of {', '.join(EXPORT_FORMATS)}")
+    return format
+
+def open_dump(path, mode):
+    # Compressed when the name ends in .gz
+    if path.endswith(".gz"):
+        return gzip.open(path, mode + "t", encoding="utf-8", newline="")
+    return open(path, mode, encoding="utf-8", newline="")
+
+async def export_pets(path, format=None):
+    # Stream every pet to `path`; returns the number of rows written. File writes and
+    # compression run in a thread while the next pages are read.
+    format = dump_format(path, format)
+    await pet_cache.flush()  # Changes still in memory belong in the export
+    file = await asyncio.to_thread(open_dump, path, "w")
+    try:
+        if format == "csv":
+            writer = csv.writer(file)
+            writer.writerow(EXPORT_COLUMNS)
+            write = writer.writerows
+        else:
+            def write(page):
+                file.writelines(json.dumps(dict(zip(EXPORT_COLUMNS, row))) + "\n" for row in page)
+        rows = 0
+        async for page in stream_pets():
+            await asyncio.to_thread(write, page)
+            rows += len(page)
+    finally:
+        await asyncio.to_thread(file.close)
+    return rows
+
+def read_dump(file, format):
+    # EXPORT_COLUMNS tuples from an export, one record at a time
+    records = csv.DictReader(file) if format == "csv" else (json.loads(line) for line in file if line.strip())
+    for number, record in enumerate(records, start=1):
+        values = {}
+        for column in EXPORT_COLUMNS:
+            value = record.get(column)
+            if value is None or value == "":  # CSV has no null, only empty fields
+                value = IMPORT_DEFAULTS.get(column)
+                if value is None and column in IMPORT_REQUIRED:
+                    raise ValueError(f"Record {number} has no {column}")
+            else:
+                value = EXPORT_TYPES.get(column, int)(value)
+            values[column] = value
+        if record.get("shard_key") in (None, ""):
+            values["shard_key"] = shard_key_for(values["guild_id"])
+        if values["last_tick"] is None:
+            values["last_tick"] = tick_index(time.time()) * TICK_INTERVAL
+        yield tuple(values.values())
+
+async def import_pets(path, format=None, chunk_size=IMPORT_CHUNK):
+    # Upsert every pet in an export; returns the number of rows read. Each chunk commits
+    # on its own, so other writes keep flowing during a long import.
+    format = dump_format(path, format)
+    await pet_cache.flush()  # So nothing older is written over the imported rows later
+    file = await asyncio.to_thread(open_dump, path, "r")
+    rows = 0
+    try:
+        records = read_dump(file, format)
+        while chunk := await asyncio.to_thread(list, itertools.islice(records, chunk_size)):
+            async with db.writer() as conn:
+                await conn.executemany(f'''
+                    INSERT INTO pets ({", ".join(EXPORT_COLUMNS)})
+                    VALUES ({", ".join("?" * len(EXPORT_COLUMNS))})
+                    ON CONFLICT(owner_id) DO UPDATE SET
+                    {", ".join(f"{c} = excluded.{c}" for c in EXPORT_COLUMNS if c != "owner_id")}
+                ''', chunk)
+            rows += len(chunk)
+    finally:
+        await asyncio.to_thread(file.close)
+        # Whatever was cached may have been replaced
+        pet_cache.invalidate()
+        coin_board.reset()
+    return rows
+
+async def run_offline(operation, *args):
+    # For the command line: open the database, run one operation, close it again
+    await db.open()
+    try:
+        await initialize_database()
+        return await operation(*args)
+    finally:
+        await db.close()
+
+COIN_BOARD_CACHE = True  # Answer ~mostcoins from memory instead of querying the database
+COIN_BOARD_TOP = 10  # Pets listed by ~mostcoins
+COIN_BOARD_DEPTH = 50  # Pets tracked in memory, so a few drop-outs don't force a reload
+
+class CoinLeaderboard:
+    """The richest pets, kept current as coins change and reloaded when it runs short."""
+
+    def __init__(self, depth=COIN_BOARD_DEPTH, cached=not SHARED_DATABASE):
+        self.depth = depth
+        self.cached = cached  # False: other processes change coins too, so read it every time
+        self._entries = None  # owner_id -> (coins, name); None until first use
+        self._floor = None    # Every pet with at least this many coins is in _entries
+        self._rebuilding = None  # Updates that arrive while the table is being read
+        self._lock = asyncio.Lock()
+        self.rebuilds = 0
+
+    def reset(self):
+        self._entries = None
+
+    async def _rebuild(self):
+        self._rebuilding = []
+        try:
+            async with db.reader() as conn:
+                async with conn.execute(
+                    "SELECT owner_id, name, coins FROM pets ORDER BY coins DESC LIMIT ?", (self.depth,)
+                ) as cursor:
+                    rows = await cursor.fetchall()
+            self._entries = {owner_id: (coins, name) for owner_id, name, coins in rows}
+            # A short result means every pet is being tracked
+            self._floor = rows[-1][2] if len(rows) == self.depth else -math.inf
+            self.rebuilds += 1
+            # Replay what changed during the read; the values are absolute, so
+            # changes the read already saw are harmless to apply again
+            pending, self._rebuilding = self._rebuilding, None
+            for method, args in pending:
+                method(*args)
+        finally:
+            self._rebuilding = None
+
+    def _deferred(self, method, *args):
+        if self._rebuilding is not None:
+            self._rebuilding.append((method, args))
+            return True
+        return self._entries is None
+
+    def update(self, owner_id, coins, name):
+        if self._deferred(self.update, owner_id, coins, name):
+            return
+        if coins >= self._floor:
+            self._entries[owner_id] = (coins, name)
+        else:
+            self._entries.pop(owner_id, None)
+
+    def rename(self, owner_id, name):
+        if self._deferred(self.rename, owner_id, name):
+            return
+        if owner_id in self._entries:
+            self._entries[owner_id] = (self._entries[owner_id][0], name)
+
+    def remove(self, owner_id):
+        if self._deferred(self.remove, owner_id):
+            return
+        self._entries.pop(owner_id, None)
+
+    def shift(self, delta):
+        # Every pet gained the same amount: the ranking and the tracked set stay the same
+        if self._rebuilding is not None:
+            self._rebuilding.append((self.reset, ()))  # Relative changes can't be replayed safely
+            return
+        if self._entries is None:
+            return
+        self._entries = {owner_id: (coins + delta, name) for owner_id, (coins, name) in self._entries.items()}
+        self._floor += delta
+
+    async def top(self, k=COIN_BOARD_TOP):
+        async with self._lock:
+            if not self.cached or self._entries is None or (len(self._entries) < k and self._floor != -math.inf):
+                await self._rebuild()
+            # A coin grant committed during the read is replayed as a reset: read again
+            while self._entries is None:
+                await self._rebuild()
+            best = heapq.nlargest(k, self._entries.items(), key=lambda item: item[1][0])
+        return [(owner_id, name, coins) for owner_id, (coins, name) in best]
+
+coin_board = CoinLeaderboard()
+
+# Coin changes go straight to the database as conditional single-statement updates,
+# so concurrent commands can't overwrite each other's balances. The cached pet is
+# then synced to the committed value.
+
+async def _adjust_coins(conn, owner_id, delta, minimum, columns):
+    # Returns (coins, name) after the update, or None if it was refused
+    assignments = "".join(f", {column} = ?" for column in columns)
+    async with conn.execute(
+        f"UPDATE pets SET coins = coins + ?{assignments} WHERE owner_id = ? AND coins >= ? RETURNING coins, name",
+        (delta, *columns.values(), owner_id, minimum),
+    ) as cursor:
+        return await cursor.fetchone()
+
+# Stats as of last_tick: the rows store them that way, and reads replay the ticks since
+TICK_STATE_COLUMNS = ("hunger", "happiness", "energy", "last_tick")
+
+def _coins_committed(owner_id, coins, name, **columns):
+    pet_cache.sync(owner_id, coins=coins, **columns)
+    # A rename may still be waiting in the cache, so prefer its name
+    cached = pet_cache.peek(owner_id)
+    coin_board.update(owner_id, coins, cached.name if cached else name)
+
+async def adjust_coins(owner_id, delta, minimum=0, pet=None, **columns):
+    # Add delta (negative to spend) if the pet holds at least `minimum` coins, setting any
+    # extra columns in the same statement. Returns the new balance, or None if refused.
+    # Pass the loaded `pet` when a column changes how ticks apply (freeze_end) or sets a
+    # stat: the ticks it materialized in memory are stored along with it, or the next
+    # read would replay them on top of the new values.
+    async with db.writer() as conn:
+        state = {column: getattr(pet, column) for column in TICK_STATE_COLUMNS} if pet is not None else {}
+        row = await _adjust_coins(conn, owner_id, delta, minimum, {**state, **columns})
+    if row is None:
+        return None
+    # Values the pet changed to while the statement ran stay dirty for the next flush
+    saved = {column: value for column, value in state.items() if getattr(pet, column) == value}
+    _coins_committed(owner_id, *row, **{**saved, **columns})
+    return row[0]
+
+async def spend_coins(owner_id, amount, pet=None, **columns):
+    return await adjust_coins(owner_id, -amount, minimum=amount, pet=pet, **columns)
+
+async def transfer_coins(sender_id, recipient_id, amount):
+    # Move coins between two pets in one transaction.
+    # Returns (sender_coins, recipient_coins), or None if nothing was moved.
+    try:
+        async with db.writer() as conn:
+            sender = await _adjust_coins(conn, sender_id, -amount, amount, {})
+            if sender is None:
+                raise TransactionAborted
+            recipient = await _adjust_coins(conn, recipient_id, amount, 0, {})
+            if recipient is None:
+                raise TransactionAborted
+    except TransactionAborted:
+        return None
+    if sender_id == recipient_id:
+        sender = recipient
+    _coins_committed(sender_id, *sender)
+    _coins_committed(recipient_id, *recipient)
+    return sender[0], recipient[0]
+
 async def is_admin(ctx):
     return ctx.author.guild_permissions.administrator
 
@@ -479,32 +2848,26 @@ def generate_embed(pet):
 
 @bot.event
 async def on_ready():
-    # Initialize the database when the bot starts
-    await initialize_database()
+    # The database and background tasks are set up once in MyBot.setup_hook
+    metrics.mark_startup("ready")
     print(f'Bot is ready! Logged in as {bot.user.name}')
-    # Start background tasks
-    bot.loop.create_task(update_pets_status())
-    bot.loop.create_task(save_pets_periodically())
-    bot.loop.create_task(grant_daily_coins())
-    bot.loop.create_task(update_weather_periodically())
-@bot.event
-async def on_disconnect():
-    await db.close()  # Close the connection when the bot disconnects
-    
+
 @bot.command()
 async def adopt(ctx, *, name: str = None):
     if name is None:
         await ctx.send("Please provide a name for your pet! Usage: `~adopt [pet_name]`.")
         return
     # Check if the user already has a pet
-    pet = await fetch_pet_from_db(ctx.author.id)
+    pet = await pet_cache.get(ctx.author.id)
     
     if pet:
         await ctx.send(f"You already have a pet named {pet.name}!")
     else:
         # Create a new pet and save it to the database
-        new_pet = VirtualPet(name, ctx.author.id)
+        new_pet = VirtualPet(name, ctx.author.id, guild_id=ctx.guild.id if ctx.guild else 0)
         await save_pet_to_db(new_pet)
+        pet_cache.add(new_pet)
+        coin_board.update(new_pet.owner_id, new_pet.coins, new_pet.name)
         await ctx.send(f"{name} has been adopted! Take good care of it.")
         # Send an embed with the pet's status
         embed = new_pet.generate_embed()
@@ -518,73 +2881,24 @@ async def adopt(ctx, *, name: str = None):
 async def on_reaction_add(reaction, user):
     if user.bot:
         return
-    # Check if the user is within the cooldown period
-    current_time = time.time()
-    user_cooldown = cooldowns.get(user.id, 0)
-    if current_time - user_cooldown < REACTION_COOLDOWN:
-        # Remove the user's reaction even if they're on cooldown
-        await reaction.remove(user)
-        return
-    # Update the cooldown time for the user
-    cooldowns[user.id] = current_time
-    # Load the user's pet from the database
-    pet = await fetch_pet_from_db(user.id)
-    if not pet:
-        await reaction.message.channel.send(f"{user.mention}, you don't have a pet yet! Use `~adopt [pet_name]` to adopt one.")
-        return
-    # Check if the pet is alive
-    old_mood = pet.get_mood()  # Get the old mood before the action
-    alive, message = pet.is_alive()
-    if not alive:
-        await reaction.message.channel.send(message)
-        # Delete the pet from the database since it's dead
-        await delete_pet_from_db(user.id)
-        return
-    # Handle the reaction-based interaction
-    if reaction.emoji == "🍗":  # Feed
-        result = pet.feed()
-    elif reaction.emoji == "🎾":  # Play
-        result = pet.play()
-    elif reaction.emoji == "💤":  # Sleep
-        result = pet.sleep()
-    else:
-        return  # If the reaction is not valid, do nothing
-    # If the mood has changed, notify the user
-    new_mood = pet.get_mood()
-    if new_mood != old_mood:
-        await reaction.message.channel.send(f"{user.mention}, your pet's mood changed to {new_mood}!")
-    # Send the result message (e.g., "Your pet is full now!")
-    response_message = await reaction.message.channel.send(result)
-    # Update the pet's status in the database
-    await update_pet_in_db(pet)
-    # Update the embed with the new status
-    embed = pet.generate_embed()
-    await reaction.message.edit(embed=embed)
-    # Remove the user's reaction to prevent duplicate actions
-    await reaction.remove(user)
-    # Clean up the response message after a delay (optional)
-    await delete_message_after_delay(response_message)
+    with metrics.span("reaction_add", "event"):
+        # Check if the user is within the cooldown period (this also starts a new one)
+        if cooldowns.hit(user.id):
+            # Remove the user's reaction even if they're on cooldown
+            await reaction.remove(user)
+            return
+        # Apply it together with anything else that arrives on this message shortly
+        reaction_batcher.add(reaction, user)
 
 @bot.command()
 async def status(ctx):
     user_id = ctx.author.id
 
-    # Fetch the pet from the database based on the user ID
-    async with aiosqlite.connect('pets.db') as db:
-        async with db.execute("SELECT name, owner_id, hunger, happiness, energy, birth_time, coins, last_claimed, freeze_end FROM pets WHERE owner_id = ?", (user_id,)) as cursor:
-            row = await cursor.fetchone()
-
-            if row is None:
-                await ctx.send("You don't have a pet yet! Use `~adopt [pet_name]` to adopt one.")
-                return
-
-            # Create a VirtualPet object from the database row using indices
-            try:
-                pet = VirtualPet.from_db_row(row)
-            except IndexError as e:
-                print(f"Error creating pet from row: {e}")  # Log error if it occurs
-                await ctx.send("There was an error processing your pet data.")
-                return
+    # Fetch the pet (from memory if it was used recently)
+    pet = await pet_cache.get(user_id)
+    if pet is None:
+        await ctx.send("You don't have a pet yet! Use `~adopt [pet_name]` to adopt one.")
+        return
 
     # Check if the pet is alive
     alive, message = pet.is_alive()
@@ -593,9 +2907,7 @@ async def status(ctx):
         await ctx.send(message)
 
         # Optionally delete the pet from the database if it's no longer alive
-        async with aiosqlite.connect('pets.db') as db:
-            await db.execute("DELETE FROM pets WHERE owner_id = ?", (user_id,))
-            await db.commit()
+        await pet_cache.delete(user_id)
 
         return
 
@@ -614,7 +2926,7 @@ async def help(ctx):
         "Here are the available commands:\n"
         "`~adopt [pet_name]` - Adopt a new pet with the given name.\n"
         "`~status` - Check your pet's status (hunger, happiness, energy).\n"
-        "`~leaderboard` - View the leaderboard of pets sorted by age.\n"
+        "`~leaderboard [page]` - View the leaderboard of pets sorted by age.\n"
         "`~freeze [coin_amount]` - Spend coins to freeze pet stats for vacations.\n"
         "`~rename [new_name]` - Rename pet.\n"
         "`~gift @user [coin_amount]` - Gift coins to another player.\n"
@@ -631,35 +2943,87 @@ async def help(ctx):
     )
     await ctx.send(help_message)
 
+LEADERBOARD_PAGE_SIZE = 10  # Pets per leaderboard page (embeds allow at most 25 fields)
+USER_NAME_TTL = 3600  # Seconds a name fetched from the Discord API is reused
+USER_LOOKUP_CONCURRENCY = 5  # Most fetch_user calls in flight at once
+USER_NAME_CACHE_SIZE = 10000  # Expired names are pruned once the cache grows past this
+
+class UserNameCache:
+    """Resolves user ids to names: member cache first, then a TTL cache over fetch_user."""
+
+    def __init__(self, ttl=USER_NAME_TTL, concurrency=USER_LOOKUP_CONCURRENCY):
+        self.ttl = ttl
+        self._names = {}  # user_id -> (name, expires_at)
+        self._semaphore = asyncio.Semaphore(concurrency)
+
+    async def resolve(self, user_ids, guild=None):
+        now = time.time()
+        names = {}
+        missing = []
+        for user_id in user_ids:
+            user = (guild.get_member(user_id) if guild else None) or bot.get_user(user_id)
+            cached = self._names.get(user_id)
+            if user is not None:
+                names[user_id] = user.name
+            elif cached and cached[1] > now:
+                names[user_id] = cached[0]
+            else:
+                missing.append(user_id)
+
+        # Whatever is left is fetched concurrently, a few requests at a time
+        fetched = await asyncio.gather(*(self._fetch(user_id) for user_id in missing))
+        names.update(zip(missing, fetched))
+
+        if len(self._names) > USER_NAME_CACHE_SIZE:
+            self._names = {k: v for k, v in self._names.items() if v[1] > now}
+        return names
+
+    async def _fetch(self, user_id):
+        async with self._semaphore:
+            try:
+                user = await bot.fetch_user(user_id)
+            except discord.NotFound:
+                name = "Unknown user"
+            except discord.HTTPException:
+                return "Unknown user"  # Don't remember transient failures
+            else:
+                name = user.name
+        self._names[user_id] = (name, time.time() + self.ttl)
+        return name
+
+user_names = UserNameCache()
+
 @bot.command()
-async def leaderboard(ctx):
+async def leaderboard(ctx, page: int = 1):
     """Display the leaderboard of the longest-lived pets."""
-    leaderboard_data = []
-
+    page = max(1, page)
     try:
-        async with aiosqlite.connect('pets.db') as db:
-            async with db.execute("SELECT name, owner_id, birth_time FROM pets") as cursor:
-                rows = await cursor.fetchall()  # Fetch all rows
-
-                for row in rows:
-                    pet_name = row[0]
-                    owner_id = row[1]
-                    age_in_seconds = time.time() - row[2]  # Assuming birth_time is in seconds
-                    age_in_days = age_in_seconds // (24 * 3600)  # Convert seconds to days
-                    leaderboard_data.append((pet_name, owner_id, age_in_days))
+        # Oldest birth_time first, read straight off the index one page at a time
+        async with db.reader() as conn:
+            async with conn.execute(
+                "SELECT name, owner_id, birth_time FROM pets ORDER BY birth_time ASC LIMIT ? OFFSET ?",
+                (LEADERBOARD_PAGE_SIZE, (page - 1) * LEADERBOARD_PAGE_SIZE),
+            ) as cursor:
+                rows = await cursor.fetchall()
+
+        if not rows:
+            await ctx.send("No pets on that page of the leaderboard.")
+            return
 
-                # Sort the leaderboard by age in descending order
-                leaderboard_data.sort(key=lambda x: x[2], reverse=True)  # Sort by age_in_days
+        owner_names = await user_names.resolve([row[1] for row in rows], ctx.guild)
 
-                # Create an embed for the leaderboard
-                embed = discord.Embed(title="Pet Leaderboard", color=discord.Color.gold())
+        # Create an embed for the leaderboard
+        embed = discord.Embed(title=f"Pet Leaderboard (page {page})", color=discord.Color.gold())
 
-                # Add each pet to the embed
-                for name, owner, age in leaderboard_data:
-                    owner_user = await bot.fetch_user(owner)  # Fetch user from ID
-                    embed.add_field(name=name, value=f"{owner_user.name}: {age} days", inline=False)
+        # Add each pet to the embed
+        now = time.time()
+        for rank, (name, owner, birth_time) in enumerate(rows, start=(page - 1) * LEADERBOARD_PAGE_SIZE + 1):
+            age_in_days = int((now - birth_time) // (24 * 3600))  # Convert seconds to days
+            embed.add_field(name=f"{rank}. {name}", value=f"{owner_names[owner]}: {age_in_days} days", inline=False)
 
-                await ctx.send(embed=embed)
+        if len(rows) == LEADERBOARD_PAGE_SIZE:
+            embed.set_footer(text=f"Use ~leaderboard {page + 1} for the next page")
+        await ctx.send(embed=embed)
     except Exception as e:
         await ctx.send(f"An error occurred while fetching the leaderboard: {e}")
 
@@ -667,19 +3031,21 @@ async def leaderboard(ctx):
 async def rename(ctx, *, new_name: str):
     owner_id = ctx.author.id
     # Fetch the user's pet from the database
-    pet = await fetch_pet_from_db(owner_id)
+    pet = await pet_cache.get(owner_id)
     if not pet:
         await ctx.send("You don't have a pet yet! Use `~adopt [pet_name]` to adopt one.")
         return
     old_name = pet.name
     pet.name = new_name
-    await update_pet_in_db(pet)  # Save the updated pet to the database
+    pet_cache.mark_dirty(pet)  # Queue the updated pet for write-back
+    coin_board.rename(owner_id, new_name)
     await ctx.send(f"Your pet's name has been changed from {old_name} to {new_name}.")
 
 @bot.command()
 async def weather(ctx):
-    if current_weather:
-        await ctx.send(f"The current weather is {current_weather['type']}: {current_weather['description']}")
+    current = weather_for(ctx.guild.id if ctx.guild else GLOBAL_WEATHER_GUILD)
+    if current:
+        await ctx.send(f"The current weather is {current['type']}: {current['description']}")
     else:
         await ctx.send("The weather is calm today.")
 
@@ -688,40 +3054,108 @@ async def gift(ctx, member: discord.Member, amount: int):
     owner_id = ctx.author.id
     recipient_id = member.id
     # Fetch both pets from the database
-    pet = await fetch_pet_from_db(owner_id)
-    recipient_pet = await fetch_pet_from_db(recipient_id)
+    pet = await pet_cache.get(owner_id)
+    recipient_pet = await pet_cache.get(recipient_id)
     if not pet:
         await ctx.send("You don't have a pet yet! Use `~adopt [pet_name]` to adopt one.")
         return
     if not recipient_pet:
         await ctx.send(f"{member.name} doesn't have a pet yet!")
         return
-    if amount <= 0 or pet.coins < amount:
+    # Perform the transaction; it is refused if the coins aren't there when it runs
+    if amount <= 0 or await transfer_coins(owner_id, recipient_id, amount) is None:
         await ctx.send(f"You don't have enough coins to gift {amount}.")
         return
-    # Perform the transaction
-    pet.coins -= amount
-    recipient_pet.coins += amount
-    # Update both pets in the database
-    await update_pet_in_db(pet)
-    await update_pet_in_db(recipient_pet)
     await ctx.send(f"You have gifted {amount} coins to {member.name}.")
 
 @bot.command()
 @commands.has_permissions(administrator=True)
-async def force_save(ctx):
-    # Fetch all pets from the database
-    all_pets = await fetch_all_pets_from_db()
-    # Save each pet back to the database
-    for pet in all_pets:
-        await update_pet_in_db(pet)
-    await ctx.send("Pets have been saved successfully!")
+async def force_save(ctx, compact: bool = False):
+    # Write back every pet changed in memory and checkpoint the database right away
+    stats = await checkpoint(compact)
+    await ctx.send(
+        f"Pets have been saved successfully! ({stats['rows']} updated)\n"
+        f"Checkpoint: {stats['wal_bytes'] / 1024:.0f} KB of WAL, {stats['checkpointed_bytes'] / 1024:.0f} KB written "
+        f"to the database{' (blocked by a reader)' if stats['busy'] else ''}, {stats['freed_bytes'] / 1024:.0f} KB freed\n"
+        f"Took {stats['seconds'] * 1000:.0f}ms ({stats['flush_seconds'] * 1000:.0f}ms flushing), "
+        f"database is {stats['db_bytes'] / 2**20:.1f} MB"
+    )
     
 @force_save.error
 async def force_save_error(ctx, error):
     if isinstance(error, commands.MissingPermissions):
         await ctx.send("You do not have permission to use this command.")
 
+@bot.command()
+@commands.has_permissions(administrator=True)
+async def reaction_stats(ctx):
+    stats = reaction_batcher.stats()
+    await ctx.send(
+        f"Reactions: {stats['actions']} actions in {stats['windows']} windows ({stats['coalesced']} coalesced)\n"
+        f"Embed edits: {stats['edits']} sent, {stats['edits_saved']} saved, {stats['rate_limited']} rate limited"
+    )
+
+@bot.command()
+@commands.has_permissions(administrator=True)
+async def cache_stats(ctx):
+    stats = pet_cache.stats()
+    queue = write_queue.stats()
+    if stats['write_back']:
+        cache = f"Pet cache: {stats['size']}/{stats['max_size']} pets, {stats['dirty']} unsaved"
+    else:
+        cache = "Pet cache: write-through, the database is shared with other bot processes"
+    await ctx.send(
+        f"{cache}\n"
+        f"Hits: {stats['hits']}, misses: {stats['misses']} ({stats['hit_rate']:.1%} hit rate)\n"
+        f"Evictions: {stats['evictions']}, flushes: {stats['flushes']} ({stats['rows_flushed']} rows written)\n"
+        f"Write queue: {queue['submitted']} writes in {queue['batches']} commits "
+        f"({queue['per_batch']:.1f} per commit), {queue['retried']} retried, {queue['queued']} queued"
+    )
+
+@bot.command()
+@commands.has_permissions(administrator=True)
+async def perf(ctx, action: str = None):
+    if action in ("on", "off"):
+        metrics.set_enabled(action == "on")
+        await ctx.send(f"Instrumentation is now {action}.")
+        return
+    if action == "reset":
+        metrics.reset()
+        await ctx.send("Performance counters reset.")
+        return
+    lines = [f"Instrumentation {'on' if metrics.enabled else 'off'}, "
+             f"counting since {format_time(time.time() - metrics.since)} ago"]
+    if metrics.startup:
+        lines.append("Startup: " + ", ".join(f"{phase} {seconds:.2f}s" for phase, seconds in metrics.startup.items()))
+    for kind, timings in metrics.timings.items():
+        # Busiest first: the most total time spent
+        for name, timing in sorted(timings.items(), key=lambda item: -item[1].latency.total):
+            runs = timing.latency.count
+            spent = (timing.db + timing.api + timing.python) or 1.0
+            lines.append(
+                f"{kind} `{name}`: {runs} runs, {timing.errors} errors, "
+                f"p50 {timing.latency.quantile(0.5) * 1000:.0f}ms, p99 {timing.latency.quantile(0.99) * 1000:.0f}ms, "
+                f"{timing.queries / runs:.1f} queries and {timing.commits / runs:.1f} commits per run, "
+                f"time {timing.db / spent:.0%} db / {timing.api / spent:.0%} api / {timing.python / spent:.0%} python"
+            )
+    for text in chunk_lines(lines):
+        await ctx.send(text)
+
+@bot.command()
+@commands.has_permissions(administrator=True)
+async def jobs(ctx):
+    now = time.time()
+    lines = []
+    for name, job in scheduler.stats().items():
+        last = f"{job['last_duration'] * 1000:.0f}ms" if job['last_duration'] is not None else "never run"
+        if job['next_run'] is None:  # primary_only jobs outside the shard 0 process
+            lines.append(f"`{name}`: not run in this process")
+            continue
+        state = "" if job['running'] else " (stopped)"
+        lines.append(f"`{name}`: next in {max(0, job['next_run'] - now) / 60:.1f}m, last took {last}, "
+                     f"{job['runs']} runs, {job['failures']} failures{state}")
+    await ctx.send("\n".join(lines) or "No jobs registered.")
+
 @bot.event
 async def on_command_error(ctx, error):
     if isinstance(error, commands.CommandNotFound):
@@ -742,7 +3176,7 @@ async def on_command_error(ctx, error):
 async def freeze(ctx, days: int):
     owner_id = ctx.author.id
     # Fetch the pet from the database
-    pet = await fetch_pet_from_db(owner_id)
+    pet = await pet_cache.get(owner_id)
     if not pet:
         await ctx.send(f"{ctx.author.mention}, you don't have a pet yet! Use `~adopt [pet_name]` to adopt one.")
         return
@@ -750,27 +3184,84 @@ async def freeze(ctx, days: int):
     if pet.coins < days:
         await ctx.send(f"{ctx.author.mention}, you don't have enough coins! You need {days} coins, but you only have {pet.coins}.")
         return
-    # Deduct the coins
-    pet.coins -= days
-    await update_pet_in_db(pet)
-    # Set the freeze duration (in seconds) and store it in the database
+    # Deduct the coins and set the freeze duration (in seconds) in one statement
     freeze_end_time = time.time() + (days * 86400)  # Convert days to seconds
-    await update_freeze_timer_in_db(owner_id, freeze_end_time)
+    if days <= 0 or await spend_coins(owner_id, days, pet=pet, freeze_end=freeze_end_time) is None:
+        await ctx.send(f"{ctx.author.mention}, you don't have enough coins! You need {days} coins, but you only have {pet.coins}.")
+        return
     await ctx.send(f"{ctx.author.mention}, your pet's stats are frozen for {days} day(s).")
             
 @bot.command()
 @commands.has_permissions(administrator=True)
 async def delete_all_pets(ctx):
     """Force delete all pets from the database."""
-    async with aiosqlite.connect('pets.db') as db:
-        await db.execute("DELETE FROM pets")
-        await db.commit()
+    async with db.writer() as conn:
+        await conn.execute("DELETE FROM pets")
+    pet_cache.clear()
+    coin_board.reset()
     await ctx.send("All pets have been deleted from the database!")
     
 @delete_all_pets.error
 async def delete_all_pets_error(ctx, error):
     if isinstance(error, commands.MissingPermissions):
         await ctx.send("You do not have permission to use this command.")
+
+@bot.command()
+@commands.has_permissions(administrator=True)
+async def backup(ctx):
+    """Back up the database now, while the bot keeps running."""
+    try:
+        stats = await backup_database()
+    except (OSError, sqlite3.Error) as e:
+        await ctx.send(f"Backup failed: {e}")
+        return
+    how = f"{stats['steps']} step(s)" if stats["stepped"] else "one step after writes kept restarting it"
+    await ctx.send(
+        f"Backed up to `{stats['path']}` in {stats['seconds']:.2f}s ({stats['bytes'] / 2**20:.1f} MB, {how}).\n"
+        f"quick_check: ok. {stats['removed']} old backup(s) removed, keeping the newest {BACKUP_KEEP}."
+    )
+
+DISCORD_UPLOAD_LIMIT = 25 * 2**20  # Largest attachment outside a guild
+
+@bot.command()
+@commands.has_permissions(administrator=True)
+async def export(ctx, format: str = "ndjson"):
+    """Upload every pet as a gzipped NDJSON or CSV file."""
+    if format not in EXPORT_FORMATS:
+        await ctx.send(f"Unknown format `{format}`. Use one of: {', '.join(EXPORT_FORMATS)}.")
+        return
+    filename = f"pets-{time.strftime('%Y%m%d-%H%M%S')}.{format}.gz"
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, filename)
+        start = time.perf_counter()
+        rows = await export_pets(path, format)
+        size = os.path.getsize(path)
+        limit = ctx.guild.filesize_limit if ctx.guild else DISCORD_UPLOAD_LIMIT
+        summary = f"Exported {rows} pets in {time.perf_counter() - start:.1f}s ({size / 2**20:.1f} MB)."
+        if size > limit:
+            await ctx.send(f"{summary} That is over the {limit / 2**20:.0f} MB upload limit; "
+                           f"run `python Sophia.py --export {filename}` on the server instead.")
+            return
+        await ctx.send(summary, file=discord.File(path, filename=filename))
+
+@bot.command(name="import")
+@commands.has_permissions(administrator=True)
+async def import_(ctx):
+    """Upsert every pet from an attached export (.ndjson, .csv, optionally .gz)."""
+    if not ctx.message.attachments:
+        await ctx.send("Attach a file made by `~export` to import it.")
+        return
+    attachment = ctx.message.attachments[0]
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, os.path.basename(attachment.filename))
+        await attachment.save(path)
+        start = time.perf_counter()
+        try:
+            rows = await import_pets(path)
+        except (ValueError, UnicodeDecodeError, OSError, csv.Error) as e:
+            await ctx.send(f"Import stopped: {e}. Chunks before the error were kept.")
+            return
+    await ctx.send(f"Imported {rows} pets in {time.perf_counter() - start:.1f}s.")
         
 ADVENTURE_RESULTS = [
     "Your pet explored a mystical forest and found a shiny rock! 🌲",
@@ -782,7 +3273,7 @@ ADVENTURE_RESULTS = [
 @bot.command()
 async def adventure(ctx):
     owner_id = ctx.author.id
-    pet = await fetch_pet_from_db(owner_id)
+    pet = await pet_cache.get(owner_id)
     if not pet:
         await ctx.send("You don't have a pet yet! Use `~adopt [pet_name]` to adopt one.")
         return
@@ -793,14 +3284,14 @@ async def adventure(ctx):
 
     result = random.choice(ADVENTURE_RESULTS)
     pet.energy -= 10  # Deduct energy for the adventure
-    await update_pet_in_db(pet)
+    pet_cache.mark_dirty(pet)
     
     await ctx.send(f"{pet.name} went on an adventure! {result} 🌟 Energy is now {pet.energy}/100.")
 
 @bot.command()
 async def feedfriend(ctx, friend: discord.Member):
     owner_id = friend.id
-    pet = await fetch_pet_from_db(owner_id)
+    pet = await pet_cache.get(owner_id)
 
     if not pet:
         await ctx.send(f"{friend.display_name} doesn't have a pet yet!")
@@ -811,15 +3302,15 @@ async def feedfriend(ctx, friend: discord.Member):
         return
 
     pet.hunger = max(0, pet.hunger - 20)  # Reduce hunger, but not below 0
-    await update_pet_in_db(pet)
+    pet_cache.mark_dirty(pet)
     
     await ctx.send(f"{ctx.author.mention} fed {friend.display_name}'s pet! Hunger is now {pet.hunger}/100.")
 
 @bot.command()
 async def steal(ctx, target: discord.Member):
     owner_id = ctx.author.id
-    pet = await fetch_pet_from_db(owner_id)
-    target_pet = await fetch_pet_from_db(target.id)
+    pet = await pet_cache.get(owner_id)
+    target_pet = await pet_cache.get(target.id)
 
     if not pet or not target_pet:
         await ctx.send("Both pets need to exist for the heist to happen!")
@@ -828,11 +3319,7 @@ async def steal(ctx, target: discord.Member):
     success = random.choice([True, False])
     if success:
         stolen_amount = random.randint(1, 5)
-        if target_pet.coins >= stolen_amount:
-            pet.coins += stolen_amount
-            target_pet.coins -= stolen_amount
-            await update_pet_in_db(pet)
-            await update_pet_in_db(target_pet)
+        if await transfer_coins(target.id, owner_id, stolen_amount) is not None:
             await ctx.send(f"{pet.name} successfully stole {stolen_amount} coins from {target_pet.name}! 💰")
         else:
             await ctx.send(f"{target_pet.name} doesn't have enough coins to steal!")
@@ -842,7 +3329,7 @@ async def steal(ctx, target: discord.Member):
 @bot.command()
 async def babysit(ctx, friend: discord.Member):
     owner_id = friend.id
-    pet = await fetch_pet_from_db(owner_id)
+    pet = await pet_cache.get(owner_id)
 
     if not pet:
         await ctx.send(f"{friend.display_name} doesn't have a pet yet!")
@@ -865,17 +3352,19 @@ async def give_coins(ctx, user: discord.User, amount: int):
         return
 
     # Fetch the pet for the user (by their ID)
-    pet = await fetch_pet_from_db(user.id)
+    pet = await pet_cache.get(user.id)
     
     if not pet:
         await ctx.send(f"{user.name} does not have a pet!")
         return
 
     # Add the coins to the user's pet
-    pet.coins += amount
-    await pet.save()  # Save the updated pet back to the database
+    coins = await adjust_coins(user.id, amount)
+    if coins is None:
+        await ctx.send(f"{user.name} does not have a pet!")
+        return
 
-    await ctx.send(f"Gave {amount} coins to {user.name}'s pet! They now have {pet.coins} coins.")
+    await ctx.send(f"Gave {amount} coins to {user.name}'s pet! They now have {coins} coins.")
 
 # Handle the error if the command is used by a non-admin
 @give_coins.error
@@ -900,7 +3389,7 @@ async def shop(ctx):
 @bot.command()
 async def buy(ctx, item_name: str):
     owner_id = ctx.author.id
-    pet = await fetch_pet_from_db(owner_id)
+    pet = await pet_cache.get(owner_id)
     
     if not pet:
         await ctx.send("You don't have a pet yet! Use `~adopt [pet_name]` to adopt one.")
@@ -916,18 +3405,18 @@ async def buy(ctx, item_name: str):
         await ctx.send(f"You don't have enough coins to buy `{item_name}`. You need {item['cost']} coins.")
         return
 
-    # Deduct the cost of the item
-    pet.coins -= item["cost"]
-
-    # Apply the item's effect (setting stats to 0 for hunger, 100 for happiness and energy)
+    # The item's effect (setting stats to 0 for hunger, 100 for happiness and energy)
     if item["effect"] == "max_hunger":
-        pet.hunger = 0  # Set hunger to its minimum value
+        effect = {"hunger": 0}  # Set hunger to its minimum value
     elif item["effect"] == "max_happiness":
-        pet.happiness = 100  # Set happiness to its maximum value
+        effect = {"happiness": 100}  # Set happiness to its maximum value
     elif item["effect"] == "max_energy":
-        pet.energy = 100  # Set energy to its maximum value
+        effect = {"energy": 100}  # Set energy to its maximum value
 
-    await pet.save()  # Save the pet's updated stats to the database
+    # Deduct the cost of the item and apply its effect in one statement
+    if await spend_coins(owner_id, item["cost"], pet=pet, **effect) is None:
+        await ctx.send(f"You don't have enough coins to buy `{item_name}`. You need {item['cost']} coins.")
+        return
 
     await ctx.send(f"You bought `{item_name}` for {item['cost']} coins! Your pet's stats have been updated.")
 
@@ -936,7 +3425,7 @@ import random
 @bot.command()
 async def gamble(ctx, amount: int):
     owner_id = ctx.author.id
-    pet = await fetch_pet_from_db(owner_id)
+    pet = await pet_cache.get(owner_id)
     
     if not pet:
         await ctx.send("You don't have a pet yet! Use `~adopt [pet_name]` to adopt one.")
@@ -952,54 +3441,53 @@ async def gamble(ctx, amount: int):
         await ctx.send(f"You don't have enough coins to gamble {amount}. You only have {pet.coins} coins.")
         return
 
-    # 50% chance of winning or losing
-    if random.choice([True, False]):  # 50% win, 50% lose
-        pet.coins += amount  # Double the user's bet
-        await ctx.send(f"Congratulations! You won {amount} coins! You now have {pet.coins} coins.")
+    # 50% chance of winning or losing; the bet must still be covered when it is settled
+    won = random.choice([True, False])  # 50% win, 50% lose
+    coins = await adjust_coins(owner_id, amount if won else -amount, minimum=amount)
+    if coins is None:
+        await ctx.send(f"You don't have enough coins to gamble {amount}. You only have {pet.coins} coins.")
+    elif won:
+        await ctx.send(f"Congratulations! You won {amount} coins! You now have {coins} coins.")
     else:
-        pet.coins -= amount  # User loses their bet
-        await ctx.send(f"Oops! You lost {amount} coins. You now have {pet.coins} coins.")
-
-    # Save the pet's updated coins
-    await pet.save()
+        await ctx.send(f"Oops! You lost {amount} coins. You now have {coins} coins.")
 
 @bot.command()
 async def mostcoins(ctx):
-    async with aiosqlite.connect('pets.db') as db:
-        async with db.execute("SELECT owner_id, name, coins FROM pets ORDER BY coins DESC") as cursor:
-            rows = await cursor.fetchall()
+    if COIN_BOARD_CACHE:
+        rows = await coin_board.top(COIN_BOARD_TOP)
+    else:
+        async with db.reader() as conn:
+            async with conn.execute("SELECT owner_id, name, coins FROM pets ORDER BY coins DESC LIMIT ?", (COIN_BOARD_TOP,)) as cursor:
+                rows = await cursor.fetchall()
 
-            if not rows:
-                await ctx.send("No pets found in the database.")
-                return
-            
-            leaderboard_text = "🏆 **Coins Leaderboard** 🏆\n\n"
-            for idx, (owner_id, name, coins) in enumerate(rows[:10]):  # Limit to top 10
-                leaderboard_text += f"{idx + 1}. {name} (ID: {owner_id}) - {coins} coins\n"
+    if not rows:
+        await ctx.send("No pets found in the database.")
+        return
+
+    leaderboard_text = "🏆 **Coins Leaderboard** 🏆\n\n"
+    for idx, (owner_id, name, coins) in enumerate(rows):
+        leaderboard_text += f"{idx + 1}. {name} (ID: {owner_id}) - {coins} coins\n"
 
-            await ctx.send(leaderboard_text)
+    await ctx.send(leaderboard_text)
 
 
 @bot.command()
 async def balance(ctx):
     user_id = ctx.author.id
 
-    # Fetch the pet from the database based on the user ID
-    async with aiosqlite.connect('pets.db') as db:
-        async with db.execute("SELECT name, coins FROM pets WHERE owner_id = ?", (user_id,)) as cursor:
-            row = await cursor.fetchone()
+    # Fetch the pet (from memory if it was used recently)
+    pet = await pet_cache.get(user_id)
+
+    if pet is None:
+        await ctx.send("You don't have a pet yet! Use `~adopt [pet_name]` to adopt one.")
+        return
+
+    await ctx.send(f"{pet.name} has {pet.coins} coins.")
 
-            if row is None:
-                await ctx.send("You don't have a pet yet! Use `~adopt [pet_name]` to adopt one.")
-                return
-            
-            name, coins = row
-            await ctx.send(f"{name} has {coins} coins.")
-            
 @bot.command()
 async def surprise(ctx, target: discord.User):
     owner_id = target.id
-    pet = await fetch_pet_from_db(owner_id)
+    pet = await pet_cache.get(owner_id)
 
     if not pet:
         await ctx.send(f"{target.display_name} doesn't have a pet yet!")
@@ -1009,9 +3497,30 @@ async def surprise(ctx, target: discord.User):
     pet.happiness = max(0, min(100, pet.happiness + event["happiness_change"]))
     pet.hunger = max(0, min(100, pet.hunger + event["hunger_change"]))
     pet.energy = max(0, min(100, pet.energy + event["energy_change"]))
-    await pet.save()
+    pet_cache.mark_dirty(pet)
 
     await ctx.send(f"Surprise for {target.display_name}'s pet: {event['description']}")
 
 
-bot.run('TOKEN')
+metrics.mark_startup("imported")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Sophia virtual pets bot")
+    mode = parser.add_mutually_exclusive_group()
+    mode.add_argument("--db-service", action="store_true", help="run only the write service the bots connect to")
+    mode.add_argument("--export", metavar="FILE", help="write every pet to FILE (.ndjson or .csv, .gz to compress)")
+    mode.add_argument("--import", dest="import_", metavar="FILE", help="upsert every pet from an export")
+    parser.add_argument("--format", choices=EXPORT_FORMATS, help="export format, if not given by the file name")
+    args = parser.parse_args(argv)
+    if args.db_service:
+        # Run only the write service that the bot processes connect to
+        asyncio.run(WriteService(socket_path=DB_SERVICE_SOCKET or DB_PATH + ".sock").serve())
+    elif args.export:
+        print(f"Exported {asyncio.run(run_offline(export_pets, args.export, args.format))} pets to {args.export}")
+    elif args.import_:
+        print(f"Imported {asyncio.run(run_offline(import_pets, args.import_, args.format))} pets from {args.import_}")
+    else:
+        bot.run(os.environ.get("SOPHIA_TOKEN", 'TOKEN'))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,1360 @@
+"""Offline benchmarks for Sophia.py.
+
+Runs against a scratch database in a temporary directory, never pets.db.
+
+    python bench.py tick --sizes 1000 10000 100000
+    python bench.py lazy --sizes 10000
+    python bench.py economy --ops 5000
+    python bench.py writes --ops 5000
+    python bench.py leaderboard --sizes 1000 10000 100000
+    python bench.py mostcoins --sizes 1000 10000 100000
+    python bench.py reactions --ops 500
+    python bench.py coins --sizes 10000 100000
+    python bench.py decode --sizes 100000
+    python bench.py table --sizes 10000 100000
+    python bench.py weather --sizes 10000 100000
+    python bench.py shards --sizes 10000 100000
+    python bench.py service --ops 4000 --workers 4
+    python bench.py queue --ops 5000
+    python bench.py perf --ops 5000
+    python bench.py cooldowns --sizes 100000 1000000
+    python bench.py startup --sizes 10000 100000
+    python bench.py dump --sizes 10000 100000
+    python bench.py backup --sizes 10000 100000
+    python bench.py load --ops 5000 --pets 10000 --json load.json --baseline previous.json
+
+The load benchmark replays the real command and event handlers against fake Discord
+objects (see FakeContext) and reports throughput, tail latency, commits and memory.
+"""
+import argparse
+import asyncio
+import contextlib
+import gzip
+import itertools
+import json
+import math
+import multiprocessing
+import os
+import platform
+import random
+import resource
+import sqlite3
+import sys
+import tempfile
+import time
+import tracemalloc
+from types import SimpleNamespace
+
+import Sophia
+
+BASE_OWNER_ID = 300000000000000000  # Snowflake-sized ids so int64 handling is exercised
+GUILDS = 1000  # Pets are spread over this many guilds
+
+
+async def use_database(path):
+    # Point every Sophia data-access path at a fresh pool on `path`
+    if Sophia.db.is_open:
+        await Sophia.db.close()
+    Sophia.db = Sophia.DatabasePool(path)
+    await Sophia.db.open()
+    await Sophia.initialize_database()
+
+
+async def populate(n, seed=0, now=None):
+    rng = random.Random(seed)
+    now = now or time.time()
+    last_tick = Sophia.tick_index(now) * Sophia.TICK_INTERVAL
+    guild_rng = random.Random(seed + 1)  # Separate stream so stats don't depend on GUILDS
+    guild_ids = [guild_rng.getrandbits(63) for _ in range(GUILDS)]
+    rows = [
+        (f"pet{i}", BASE_OWNER_ID + i, rng.randint(0, 60), rng.randint(40, 100), rng.randint(0, 100),
+         now - rng.randint(0, 90) * 86400, rng.randint(0, 500), None,
+         now + rng.randint(1, 48) * 3600 if rng.random() < 0.05 else None, last_tick)
+        for i in range(n)
+    ]
+    rows = [row + (guild, Sophia.shard_key_for(guild)) for row, guild in
+            zip(rows, (guild_rng.choice(guild_ids) for _ in range(n)))]
+    async with Sophia.db.writer() as conn:
+        await conn.execute("DELETE FROM pets")
+        await conn.executemany(f'''
+            INSERT INTO pets ({", ".join(Sophia.PET_COLUMNS)})
+            VALUES ({", ".join("?" * len(Sophia.PET_COLUMNS))})
+        ''', rows)
+
+
+async def timed(coro):
+    start = time.perf_counter()
+    result = await coro
+    return time.perf_counter() - start, result
+
+
+async def legacy_tick(now):
+    # The original update_pets_status body: one save (and one commit) per pet
+    for pet in await Sophia.VirtualPet.load_all():
+        pet.update_status(now)
+        alive, _ = pet.is_alive()
+        if not alive:
+            await Sophia.VirtualPet.delete(pet.owner_id)
+            continue
+        await pet.save()
+
+
+async def bench_tick(args, workdir):
+    print(f"{'pets':>8} {'per-pet loop':>14} {'batched':>10} {'speedup':>8}")
+    for n in args.sizes:
+        await use_database(os.path.join(workdir, f"tick_{n}.db"))
+        next_hour = time.time() + Sophia.TICK_INTERVAL
+        await populate(n)
+        legacy, _ = await timed(legacy_tick(next_hour))
+        await populate(n)
+        batched, _ = await timed(Sophia.run_status_tick(next_hour))
+        print(f"{n:>8} {legacy:>13.3f}s {batched:>9.3f}s {legacy / batched:>7.1f}x")
+
+
+async def legacy_grant(coins):
+    # The original grant_daily_coins body: load everything, one full-row save per pet
+    for pet in await Sophia.VirtualPet.load_all():
+        pet.coins += coins
+        await pet.save()
+
+
+async def total_coins():
+    async with Sophia.db.reader() as conn:
+        async with conn.execute("SELECT SUM(coins) FROM pets") as cursor:
+            return (await cursor.fetchone())[0]
+
+
+async def bench_coins(args, workdir):
+    # One daily grant per approach; the set-based one is then repeated for the same day
+    # to show the ledger turning it into a no-op
+    print(f"{'pets':>8} {'per-pet save':>13} {'set-based':>10} {'speedup':>8} {'repeat':>9}  granted")
+    for n in args.sizes:
+        await use_database(os.path.join(workdir, f"coins_{n}.db"))
+        await populate(n)
+        before = await total_coins()
+        legacy, _ = await timed(legacy_grant(Sophia.DAILY_COINS))
+        assert await total_coins() - before == n * Sophia.DAILY_COINS
+        await populate(n)
+        before = await total_coins()
+        day = int(time.time() // 86400)
+        batched, _ = await timed(Sophia.grant_coins([day]))
+        repeat, _ = await timed(Sophia.grant_coins([day]))
+        granted = await total_coins() - before
+        print(f"{n:>8} {legacy:>12.3f}s {batched:>9.3f}s {legacy / batched:>7.0f}x {repeat * 1000:>7.2f}ms  "
+              f"{granted == n * Sophia.DAILY_COINS}")
+
+
+class DictPet:
+    """The pet as it was before __slots__: a __dict__ per pet plus a set of changed columns."""
+
+    def __init__(self, name, owner_id, hunger, happiness, energy, birth_time, coins, last_claimed, freeze_end,
+                 last_tick, guild_id, shard_key):
+        self._changed = set()
+        self._in_db = True
+        self.name = name
+        self.owner_id = owner_id
+        self.hunger = hunger
+        self.happiness = happiness
+        self.energy = energy
+        self.birth_time = birth_time
+        self.coins = coins
+        self.last_claimed = last_claimed
+        self.freeze_end = freeze_end
+        self.last_tick = last_tick
+        self.guild_id = guild_id
+        self.shard_key = shard_key
+
+    @classmethod
+    def from_db_row(cls, row):
+        if len(row) != 12:
+            raise ValueError(f"Row does not have the expected number of columns: {len(row)}")
+        return cls(owner_id=int(row[1]), name=row[0], hunger=row[2], happiness=row[3], energy=row[4],
+                   birth_time=row[5], coins=row[6], last_claimed=row[7], freeze_end=row[8], last_tick=row[9],
+                   guild_id=row[10], shard_key=row[11])
+
+
+async def decode_dicts(conn):
+    async with conn.execute(Sophia.PET_SELECT) as cursor:
+        return [DictPet.from_db_row(row) for row in await cursor.fetchall()]
+
+
+async def bench_decode(args, workdir):
+    # Reading the whole table into pet objects: time per row and memory per pet
+    print(f"{'pets':>8} {'decoder':>12} {'rows/s':>10} {'bytes/pet':>10}")
+    for n in args.sizes:
+        await use_database(os.path.join(workdir, f"decode_{n}.db"))
+        await populate(n)
+        for name, decode in (("dict+tuple", decode_dicts), ("row_factory", Sophia.fetch_pets)):
+            async with Sophia.db.reader() as conn:
+                elapsed = await best_of(lambda: decode(conn), 3)
+                tracemalloc.start()
+                pets = await decode(conn)
+                held, _ = tracemalloc.get_traced_memory()
+                tracemalloc.stop()
+            assert len(pets) == n
+            del pets
+            print(f"{n:>8} {name:>12} {n / elapsed:>10.0f} {held / n:>10.0f}")
+
+
+async def bench_table(args, workdir):
+    # The whole world as PetTable columns vs a list of VirtualPets: load time, memory per
+    # pet, one in-memory tick over every pet, and writing all of them back; then a row
+    # view, its size against a VirtualPet, and a feed and rename made through it
+    print(f"{'pets':>8} {'load':>9} {'bytes/pet':>10} {'objects':>9} {'tick':>9} {'write back':>11} "
+          f"{'view':>5} {'pet':>5} {'via view':>9}")
+    for n in args.sizes:
+        await use_database(os.path.join(workdir, f"table_{n}.db"))
+        await populate(n)
+        async with Sophia.db.reader() as conn:
+            load = await best_of(lambda: Sophia.PetTable.load(conn), 3)
+            tracemalloc.start()
+            table = await Sophia.PetTable.load(conn)
+            table_bytes, _ = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            tracemalloc.start()
+            pets = await Sophia.fetch_pets(conn)
+            object_bytes, _ = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            del pets
+
+        tick = Sophia.tick_index(time.time()) + 1
+        start = time.perf_counter()
+        alive = table.alive()
+        Sophia.simulate_tick(table["owner_id"], tick, table["hunger"], table["happiness"], table["energy"], alive)
+        table.mark_dirty(alive, "hunger", "happiness", "energy")
+        tick_time = time.perf_counter() - start
+        async with Sophia.db.writer() as conn:
+            write_time, _ = await timed(table.write_back(conn))
+
+        owner_id = BASE_OWNER_ID + n // 2
+        async with Sophia.db.writer() as conn:
+            table = await Sophia.PetTable.load(conn, names=True)
+            view = table.view(owner_id)
+            view.feed()
+            view.name = "Renamed"
+            expected = (view.name, view.hunger, view.happiness)
+            await table.write_back(conn)
+        pet = await Sophia.fetch_pet_from_db(owner_id)
+        check = "OK" if (pet.name, pet.hunger, pet.happiness) == expected else "MISMATCH"
+        print(f"{n:>8} {load * 1000:>7.1f}ms {table_bytes / n:>10.0f} {object_bytes / n:>9.0f} "
+              f"{tick_time * 1000:>7.2f}ms {write_time * 1000:>9.1f}ms "
+              f"{sys.getsizeof(view):>4}B {sys.getsizeof(pet):>4}B {check:>9}")
+        if check != "OK":
+            raise SystemExit(1)
+
+
+async def legacy_weather():
+    # What calling apply_weather_effects on every pet would take: load, apply, one save each
+    for pet in await Sophia.VirtualPet.load_all():
+        Sophia.apply_weather_effects(pet)
+        await pet.save()
+
+
+async def bench_weather(args, workdir):
+    # The batched weather pass must leave every pet exactly as apply_weather_effects would
+    print(f"{'pets':>8} {'per-pet':>9} {'batched':>9} {'speedup':>8}  match")
+    weather = Sophia.WEATHER_TYPES[2]  # Moves all three stats
+    Sophia.current_weather = weather
+    for n in args.sizes:
+        await use_database(os.path.join(workdir, f"weather_{n}.db"))
+        Sophia.pet_cache = Sophia.PetCache()
+        await populate(n)
+        async with Sophia.db.reader() as conn:
+            pets = await Sophia.fetch_pets(conn)
+        for pet in pets:
+            Sophia.apply_weather_effects(pet)
+        expected = {pet.owner_id: (pet.hunger, pet.happiness, pet.energy) for pet in pets}
+        batched, _ = await timed(Sophia.set_weather(weather, now=time.time()))
+        match = "OK" if await fetch_stats() == expected else "MISMATCH"
+
+        await populate(n)
+        legacy, _ = await timed(legacy_weather())
+        print(f"{n:>8} {legacy:>8.3f}s {batched:>8.3f}s {legacy / batched:>7.0f}x  {match}")
+        if match != "OK":
+            raise SystemExit(1)
+
+
+async def bench_shards(args, workdir):
+    # One eager hour as a single pass over every pet vs one partition per slot, the way
+    # the staggered status_tick job runs it; the slowest slot is what the bot feels
+    print(f"{'pets':>8} {'whole hour':>11} {'slots':>6} {'pets/slot':>10} {'mean slot':>10} {'max slot':>9}")
+    for n in args.sizes:
+        await use_database(os.path.join(workdir, f"shards_{n}.db"))
+        next_hour = time.time() + Sophia.TICK_INTERVAL
+        await populate(n)
+        whole, _ = await timed(Sophia.run_status_tick(next_hour))
+        await populate(n)
+        slots = []
+        for key in range(Sophia.PET_PARTITIONS):
+            elapsed, _ = await timed(Sophia.run_status_tick(next_hour, shard_keys=[key]))
+            slots.append(elapsed)
+        print(f"{n:>8} {whole * 1000:>9.1f}ms {len(slots):>6} {n / len(slots):>10.0f} "
+              f"{sum(slots) / len(slots) * 1000:>8.2f}ms {max(slots) * 1000:>7.2f}ms")
+
+
+async def direct_save(pet):
+    # A save as its own transaction and commit, the way every write path used to end
+    changed = pet.take_changes()
+    columns = sorted(changed)
+    async with Sophia.db.writer() as conn:
+        await conn.execute(f"UPDATE pets SET {', '.join(f'{c} = ?' for c in columns)} WHERE owner_id = ?",
+                           [getattr(pet, c) for c in columns] + [pet.owner_id])
+
+
+async def bench_queue(args, workdir, n_pets=1000, concurrency=64):
+    # Concurrent single-pet saves, each waiting until its write is committed, with the
+    # usual synchronous=NORMAL and with an fsync on every commit (FULL)
+    print(f"{'sync':>7} {'mode':>11} {'saves/s':>8} {'p50':>8} {'p99':>8} {'commits':>8}")
+    pragmas = Sophia.DB_PRAGMAS
+    for sync in ("NORMAL", "FULL"):
+        Sophia.DB_PRAGMAS = tuple(p for p in pragmas if "synchronous" not in p) + (f"PRAGMA synchronous={sync}",)
+        for mode, window in (("direct", None), ("queue", 0.0), ("queue 2ms", 0.002)):
+            await use_database(os.path.join(workdir, f"queue_{sync}_{window}.db"))
+            Sophia.write_queue = Sophia.WriteQueue(window=window or 0.0)
+            await populate(n_pets)
+            async with Sophia.db.reader() as conn:
+                pets = await Sophia.fetch_pets(conn)
+            rng = random.Random(6)
+            latencies = []
+
+            async def worker(count):
+                for _ in range(count):
+                    pet = rng.choice(pets)
+                    pet.hunger = rng.randint(0, 99)
+                    start = time.perf_counter()
+                    if window is None:
+                        await direct_save(pet)
+                    else:
+                        await Sophia.update_pet_in_db(pet)
+                    latencies.append(time.perf_counter() - start)
+
+            elapsed, _ = await timed(asyncio.gather(*(worker(args.ops // concurrency) for _ in range(concurrency))))
+            commits = len(latencies) if window is None else Sophia.write_queue.batches
+            print(f"{sync:>7} {mode:>11} {len(latencies) / elapsed:>8.0f} {percentile(latencies, 0.5) * 1000:>6.2f}ms "
+                  f"{percentile(latencies, 0.99) * 1000:>6.2f}ms {commits:>8}")
+    Sophia.DB_PRAGMAS = pragmas
+
+
+async def run_load_worker(path, socket_path, ops, seed, n_pets, concurrency=16):
+    # One bot process worth of coin transfers, through the write service if socket_path is set
+    Sophia.db = Sophia.DatabasePool(path, size=2, service=socket_path)
+    await Sophia.db.open()
+    rng = random.Random(seed)
+    work = [(BASE_OWNER_ID + rng.randrange(n_pets), BASE_OWNER_ID + rng.randrange(n_pets), rng.randint(1, 20))
+            for _ in range(ops)]
+    latencies = []
+    errors = 0
+
+    async def worker(jobs):
+        nonlocal errors
+        for sender, recipient, amount in jobs:
+            start = time.perf_counter()
+            try:
+                await Sophia.transfer_coins(sender, recipient, amount)
+            except sqlite3.OperationalError:  # "database is locked"
+                errors += 1
+            latencies.append(time.perf_counter() - start)
+
+    start = time.time()
+    await asyncio.gather(*(worker(work[i::concurrency]) for i in range(concurrency)))
+    end = time.time()
+    await Sophia.db.close()
+    return latencies, errors, start, end
+
+
+def load_worker(path, socket_path, ops, seed, n_pets, results):
+    results.put(asyncio.run(run_load_worker(path, socket_path, ops, seed, n_pets)))
+
+
+async def bench_service(args, workdir, n_pets=1000):
+    # Several worker processes transferring coins in one pets.db: each with its own writer
+    # connection, or all through one write service doing group commits
+    print(f"{'mode':>8} {'workers':>8} {'txn/s':>8} {'p50':>8} {'p99':>8} {'commits':>8} {'errors':>7}  conserved")
+    spawn = multiprocessing.get_context("spawn")
+    loop = asyncio.get_running_loop()
+    for mode in ("direct", "service"):
+        path = os.path.join(workdir, f"service_{mode}.db")
+        await use_database(path)
+        await populate(n_pets)
+        before = await total_coins()
+        await Sophia.db.close()
+
+        service = socket_path = None
+        if mode == "service":
+            socket_path = os.path.join(workdir, "writes.sock")
+            service = Sophia.WriteService(path, socket_path)
+            ready = asyncio.Event()
+            serving = asyncio.create_task(service.serve(ready))
+            await ready.wait()
+
+        results = spawn.Queue()
+        workers = [spawn.Process(target=load_worker, args=(path, socket_path, args.ops // args.workers, seed,
+                                                            n_pets, results))
+                   for seed in range(args.workers)]
+        for process in workers:
+            process.start()
+        outputs = [await loop.run_in_executor(None, results.get) for _ in workers]
+        for process in workers:
+            await loop.run_in_executor(None, process.join)
+        if service is not None:
+            serving.cancel()
+            await asyncio.gather(serving, return_exceptions=True)
+
+        latencies = [latency for output in outputs for latency in output[0]]
+        errors = sum(output[1] for output in outputs)
+        elapsed = max(output[3] for output in outputs) - min(output[2] for output in outputs)
+        commits = service.commits if service is not None else len(latencies) - errors
+        await use_database(path)
+        conserved = await total_coins() == before
+        print(f"{mode:>8} {args.workers:>8} {len(latencies) / elapsed:>8.0f} "
+              f"{percentile(latencies, 0.5) * 1000:>6.1f}ms {percentile(latencies, 0.99) * 1000:>6.1f}ms "
+              f"{commits:>8} {errors:>7}  {conserved}")
+
+
+async def fetch_stats():
+    async with Sophia.db.reader() as conn:
+        async with conn.execute("SELECT owner_id, hunger, happiness, energy FROM pets") as cursor:
+            return {row[0]: row[1:] for row in await cursor.fetchall()}
+
+
+async def bench_lazy(args, workdir, hours=72):
+    # Eager hourly passes and one lazy catch-up per pet must land on identical stats
+    print(f"{'pets':>8} {'eager x' + str(hours):>10} {'lazy reads':>11} {'per read':>10}  match")
+    for n in args.sizes:
+        await use_database(os.path.join(workdir, f"lazy_{n}.db"))
+        start = time.time()
+        await populate(n, now=start)
+        async with Sophia.db.reader() as conn:
+            lazy_pets = await Sophia.fetch_pets(conn)
+
+        eager_time = 0.0
+        for hour in range(1, hours + 1):
+            elapsed, _ = await timed(Sophia.run_status_tick(start + hour * Sophia.TICK_INTERVAL))
+            eager_time += elapsed
+        eager = await fetch_stats()
+
+        lazy_start = time.perf_counter()
+        for pet in lazy_pets:
+            pet.update_status(start + hours * Sophia.TICK_INTERVAL)
+        lazy_time = time.perf_counter() - lazy_start
+
+        # Eager deletes dead pets; lazily they are still there, but dead
+        lazy = {p.owner_id: (p.hunger, p.happiness, p.energy) for p in lazy_pets if p.is_alive()[0]}
+        match = "OK" if lazy == eager else f"MISMATCH ({len(set(lazy.items()) ^ set(eager.items()))} pets)"
+        print(f"{n:>8} {eager_time:>9.3f}s {lazy_time:>10.3f}s {lazy_time / n * 1e6:>8.1f}us  {match}")
+        if lazy != eager:
+            raise SystemExit(1)
+
+
+async def legacy_transfer(sender_id, recipient_id, amount):
+    # The original gift/steal: load both pets, change them in Python, write each back
+    sender = await Sophia.fetch_pet_from_db(sender_id)
+    recipient = await Sophia.fetch_pet_from_db(recipient_id)
+    if sender.coins < amount:
+        return None
+    sender.coins -= amount
+    recipient.coins += amount
+    await Sophia.update_pet_in_db(sender)
+    await Sophia.update_pet_in_db(recipient)
+    return sender.coins, recipient.coins
+
+
+async def legacy_reaction(owner_id):
+    pet = await Sophia.fetch_pet_from_db(owner_id)
+    pet.feed()
+    await Sophia.update_pet_in_db(pet)
+
+
+async def cached_reaction(owner_id):
+    pet = await Sophia.pet_cache.get(owner_id)
+    pet.feed()
+    Sophia.pet_cache.mark_dirty(pet)
+
+
+async def flush_continuously(interval=0.005):
+    # Write-backs racing the transfers, as save_pets_periodically would
+    while True:
+        await asyncio.sleep(interval)
+        await Sophia.pet_cache.flush()
+
+
+async def coin_totals():
+    async with Sophia.db.reader() as conn:
+        async with conn.execute("SELECT SUM(coins), MIN(coins) FROM pets") as cursor:
+            return await cursor.fetchone()
+
+
+async def economy_storm(n_pets, ops, transfer, reaction, concurrency=64, seed=1):
+    # Concurrent transfers between a small set of pets, interleaved with reaction saves
+    rng = random.Random(seed)
+    work = [
+        (rng.random() < 0.7, BASE_OWNER_ID + rng.randrange(n_pets), BASE_OWNER_ID + rng.randrange(n_pets),
+         rng.randint(1, 20))
+        for _ in range(ops)
+    ]
+
+    async def worker(jobs):
+        for is_transfer, a, b, amount in jobs:
+            if is_transfer:
+                await transfer(a, b, amount)
+            else:
+                await reaction(a)
+
+    await asyncio.gather(*(worker(work[i::concurrency]) for i in range(concurrency)))
+
+
+async def bench_economy(args, workdir, n_pets=100):
+    # Coins must be conserved no matter how transfers and saves interleave
+    print(f"{'mode':>9} {'ops/s':>9} {'coin drift':>11} {'min balance':>12}")
+    for mode in ("legacy", "atomic"):
+        await use_database(os.path.join(workdir, f"economy_{mode}.db"))
+        Sophia.pet_cache = Sophia.PetCache()
+        await populate(n_pets)
+        before, _ = await coin_totals()
+        if mode == "legacy":
+            storm = economy_storm(n_pets, args.ops, legacy_transfer, legacy_reaction)
+        else:
+            storm = economy_storm(n_pets, args.ops, Sophia.transfer_coins, cached_reaction)
+        flusher = asyncio.create_task(flush_continuously())
+        elapsed, _ = await timed(storm)
+        flusher.cancel()
+        await Sophia.pet_cache.flush()
+        after, lowest = await coin_totals()
+        print(f"{mode:>9} {args.ops / elapsed:>9.0f} {after - before:>+11d} {lowest:>12d}")
+        if mode == "atomic" and (after != before or lowest < 0):
+            raise SystemExit(1)
+
+
+async def legacy_full_row_save(pet):
+    # The original VirtualPet.save(): every column, as a delete plus an insert
+    async with Sophia.db.writer() as conn:
+        await conn.execute('''
+            INSERT OR REPLACE INTO pets
+            (owner_id, name, hunger, happiness, energy, birth_time, coins, last_claimed, freeze_end, last_tick)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        ''', (pet.owner_id, pet.name, pet.hunger, pet.happiness, pet.energy,
+              pet.birth_time, pet.coins, pet.last_claimed, pet.freeze_end, pet.last_tick))
+
+
+def wal_size(path):
+    try:
+        return os.path.getsize(path + "-wal")
+    except OSError:
+        return 0
+
+
+async def bench_writes(args, workdir, n_pets=20000):
+    # WAL bytes appended per single-field save, with automatic checkpoints disabled
+    print(f"{'mode':>10} {'saves/s':>9} {'WAL bytes/save':>15} {'pages/save':>11}")
+    for mode in ("full-row", "partial"):
+        path = os.path.join(workdir, f"writes_{mode}.db")
+        await use_database(path)
+        await populate(n_pets)
+        async with Sophia.db.writer() as conn:
+            await conn.execute("PRAGMA wal_autocheckpoint=0")
+        with sqlite3.connect(path) as checkpoint:
+            checkpoint.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+            page_size = checkpoint.execute("PRAGMA page_size").fetchone()[0]
+
+        rng = random.Random(2)
+        pets = [await Sophia.fetch_pet_from_db(BASE_OWNER_ID + rng.randrange(n_pets)) for _ in range(args.ops)]
+        for pet in pets:
+            pet.take_changes()  # Only the change below should count, not lazy catch-up
+        save = legacy_full_row_save if mode == "full-row" else Sophia.update_pet_in_db
+        start = time.perf_counter()
+        for pet in pets:
+            pet.energy = max(0, pet.energy - 1)
+            await save(pet)
+        elapsed = time.perf_counter() - start
+        written = wal_size(path) / args.ops
+        print(f"{mode:>10} {args.ops / elapsed:>9.0f} {written:>15.0f} {written / (page_size + 24):>11.2f}")
+
+
+async def legacy_leaderboard_rows():
+    # The original ~leaderboard query: every pet, aged and sorted in Python
+    async with Sophia.db.reader() as conn:
+        async with conn.execute("SELECT name, owner_id, birth_time FROM pets") as cursor:
+            rows = await cursor.fetchall()
+    now = time.time()
+    board = [(name, owner, (now - birth) // 86400) for name, owner, birth in rows]
+    board.sort(key=lambda x: x[2], reverse=True)
+    return board
+
+
+async def page_rows(page):
+    async with Sophia.db.reader() as conn:
+        async with conn.execute(
+            "SELECT name, owner_id, birth_time FROM pets ORDER BY birth_time ASC LIMIT ? OFFSET ?",
+            (Sophia.LEADERBOARD_PAGE_SIZE, (page - 1) * Sophia.LEADERBOARD_PAGE_SIZE),
+        ) as cursor:
+            return await cursor.fetchall()
+
+
+async def best_of(make_coro, repeat=5):
+    best = float("inf")
+    for _ in range(repeat):
+        elapsed, _ = await timed(make_coro())
+        best = min(best, elapsed)
+    return best
+
+
+async def bench_leaderboard(args, workdir):
+    # Query time only; owner name lookups need a Discord client
+    print(f"{'pets':>8} {'full sort':>10} {'page 1':>9} {'page 50':>9}")
+    for n in args.sizes:
+        await use_database(os.path.join(workdir, f"leaderboard_{n}.db"))
+        await populate(n)
+        legacy = await best_of(legacy_leaderboard_rows)
+        first = await best_of(lambda: page_rows(1))
+        deep = await best_of(lambda: page_rows(50))
+        print(f"{n:>8} {legacy * 1000:>8.2f}ms {first * 1000:>7.2f}ms {deep * 1000:>7.2f}ms")
+
+
+async def sql_top_coins(limit=None):
+    query = "SELECT owner_id, name, coins FROM pets ORDER BY coins DESC"
+    async with Sophia.db.reader() as conn:
+        async with conn.execute(query + (" LIMIT ?" if limit else ""), (limit,) if limit else ()) as cursor:
+            rows = await cursor.fetchall()
+    return rows[:Sophia.COIN_BOARD_TOP]
+
+
+async def grant_during_rebuild(day, read_delay=0.05, grant_after=0.01):
+    # ~mostcoins with a reader slowed by read_delay, and grant_coins committing
+    # grant_after into the read; returns what ~mostcoins would list
+    reader = Sophia.db.reader
+
+    @contextlib.asynccontextmanager
+    async def slow_reader():
+        async with reader() as conn:
+            await asyncio.sleep(read_delay)
+            yield conn
+
+    Sophia.db.reader = slow_reader
+    try:
+        top = asyncio.create_task(Sophia.coin_board.top())
+        await asyncio.sleep(grant_after)
+        await Sophia.grant_coins([day])
+        return await top
+    finally:
+        del Sophia.db.reader
+
+
+async def bench_mostcoins(args, workdir):
+    # After a burst of coin changes the in-memory board must rank like the database
+    print(f"{'pets':>8} {'no LIMIT':>10} {'LIMIT':>9} {'in-memory':>10} {'rebuilds':>9}  match")
+    for n in args.sizes:
+        await use_database(os.path.join(workdir, f"mostcoins_{n}.db"))
+        Sophia.pet_cache = Sophia.PetCache()
+        Sophia.coin_board = Sophia.CoinLeaderboard()
+        await populate(n)
+        await Sophia.coin_board.top()
+
+        rng = random.Random(3)
+        richest = [row[0] for row in await sql_top_coins(Sophia.COIN_BOARD_TOP)]
+        for _ in range(args.ops // 10):
+            # Drain the richest pets so the board has to keep promoting new entries
+            owner = rng.choice(richest) if rng.random() < 0.5 else BASE_OWNER_ID + rng.randrange(n)
+            await Sophia.adjust_coins(owner, rng.randint(-300, 300), minimum=300)
+
+        unlimited = await best_of(sql_top_coins)
+        limited = await best_of(lambda: sql_top_coins(Sophia.COIN_BOARD_TOP))
+        in_memory = await best_of(Sophia.coin_board.top)
+        expected = [coins for _, _, coins in await sql_top_coins(Sophia.COIN_BOARD_TOP)]
+        actual = [coins for _, _, coins in await Sophia.coin_board.top()]
+        # A daily grant committing while the board is being read from a slow disk
+        Sophia.coin_board.reset()
+        granted = await grant_during_rebuild(day=n)
+        after = [coins for _, _, coins in await sql_top_coins(Sophia.COIN_BOARD_TOP)]
+        match = "OK" if expected == actual and after == [coins for _, _, coins in granted] else "MISMATCH"
+        print(f"{n:>8} {unlimited * 1000:>8.2f}ms {limited * 1000:>7.3f}ms {in_memory * 1000:>8.3f}ms "
+              f"{Sophia.coin_board.rebuilds:>9}  {match}")
+        if match != "OK":
+            raise SystemExit(1)
+
+
+class FakeDiscord:
+    """Just enough of channels, messages and reactions for the handlers, with API latency."""
+
+    def __init__(self, latency=0.03):
+        self.latency = latency
+        self.calls = 0
+        self.edits = 0
+        self._ids = itertools.count(1)
+
+    async def call(self):
+        self.calls += 1
+        await asyncio.sleep(self.latency)
+
+
+class FakeUser:
+    def __init__(self, user_id):
+        self.id = user_id
+        self.bot = False
+        self.mention = f"<@{user_id}>"
+
+
+class FakeMember(FakeUser):
+    def __init__(self, user_id, administrator=False):
+        super().__init__(user_id)
+        self.name = self.display_name = f"user{user_id - BASE_OWNER_ID}"
+        self.guild_permissions = SimpleNamespace(administrator=administrator)
+
+
+class FakeGuild:
+    def __init__(self, guild_id):
+        self.id = guild_id
+        self.me = FakeUser(0)  # The bot
+
+    def get_member(self, user_id):
+        return FakeMember(user_id)  # Everyone is a member, so no name is fetched from the API
+
+
+class FakeContext:
+    """A command invocation: who sent it, from which guild, and the channel to answer in."""
+
+    def __init__(self, author, guild, channel):
+        self.author = author
+        self.guild = guild
+        self.channel = channel
+
+    async def send(self, content=None, embed=None):
+        return await self.channel.send(content, embed=embed)
+
+
+class FakeChannel:
+    def __init__(self, api, channel_id, manage_messages=True):
+        self.api = api
+        self.id = channel_id
+        self.guild = FakeGuild(0)
+        self.manage_messages = manage_messages
+
+    def permissions_for(self, member):
+        return SimpleNamespace(manage_messages=self.manage_messages)
+
+    async def send(self, content=None, embed=None):
+        await self.api.call()
+        return FakeMessage(self.api, self, content, embed)
+
+    async def delete_messages(self, messages):
+        await self.api.call()
+
+
+class FakeMessage:
+    def __init__(self, api, channel, content=None, embed=None):
+        self.api = api
+        self.channel = channel
+        self.id = next(api._ids)
+        self.content = content
+        self.embed = embed
+
+    async def edit(self, embed=None):
+        await self.api.call()
+        self.api.edits += 1
+        self.embed = embed
+
+    async def delete(self):
+        await self.api.call()
+
+    async def add_reaction(self, emoji):
+        await self.api.call()
+
+
+class FakeReaction:
+    def __init__(self, emoji, message):
+        self.emoji = emoji
+        self.message = message
+
+    async def remove(self, user):
+        await self.message.api.call()
+
+
+async def legacy_on_reaction_add(reaction, user, delete_delay):
+    # The original handler body after the pet is loaded: every step awaited in turn,
+    # ending with a sleep until the response message is deleted
+    pet = await Sophia.pet_cache.get(user.id)
+    old_mood = pet.get_mood()
+    result = {"🍗": pet.feed, "🎾": pet.play, "💤": pet.sleep}[reaction.emoji]()
+    new_mood = pet.get_mood()
+    if new_mood != old_mood:
+        await reaction.message.channel.send(f"{user.mention}, your pet's mood changed to {new_mood}!")
+    response_message = await reaction.message.channel.send(result)
+    Sophia.pet_cache.mark_dirty(pet)
+    await reaction.message.edit(embed=pet.generate_embed())
+    await reaction.remove(user)
+    await asyncio.sleep(delete_delay)
+    await response_message.delete()
+
+
+def percentile(samples, q):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+async def bench_reactions(args, workdir, delete_delay=1.0, channels=5):
+    # A burst of reactions from distinct users (so no cooldowns) spread over a few pet
+    # embeds, 30 ms per fake Discord call and a shortened 1 s deletion delay. Handler
+    # latency for the legacy body; for the batched path, how long until each embed shows
+    # the reaction, since the handler itself only queues it
+    print(f"{'handler':>9} {'p50':>9} {'p99':>9} {'API calls':>10} {'edits':>7} {'coalesced':>10}")
+    for mode in ("legacy", "batched"):
+        await use_database(os.path.join(workdir, f"reactions_{mode}.db"))
+        Sophia.pet_cache = Sophia.PetCache()
+        Sophia.message_deleter = Sophia.MessageDeleter()
+        Sophia.reaction_batcher = Sophia.ReactionBatcher()
+        Sophia.MESSAGE_DELETE_DELAY = delete_delay
+        Sophia.cooldowns.clear()
+        await populate(args.ops)
+        api = FakeDiscord()
+        embeds = [FakeMessage(api, FakeChannel(api, c)) for c in range(channels)]
+        rng = random.Random(4)
+        latencies = []
+
+        async def react(i):
+            await asyncio.sleep(i * 0.002)  # Staggered arrivals
+            user = FakeUser(BASE_OWNER_ID + i)
+            reaction = FakeReaction(rng.choice(["🍗", "🎾", "💤"]), embeds[i % channels])
+            start = time.perf_counter()
+            if mode == "legacy":
+                await legacy_on_reaction_add(reaction, user, delete_delay)
+            else:
+                await Sophia.on_reaction_add(reaction, user)
+                # Shown once its window has been applied and the embed edit has landed
+                batcher = Sophia.reaction_batcher
+                while reaction.message.id in batcher._pending or reaction.message.id in batcher._edits:
+                    await asyncio.sleep(0.005)
+            latencies.append(time.perf_counter() - start)
+
+        await asyncio.gather(*(react(i) for i in range(args.ops)))
+        await Sophia.reaction_batcher.drain()
+        # Wait for the scheduler to finish so its deletions are counted
+        while len(Sophia.message_deleter):
+            await asyncio.sleep(0.05)
+        await asyncio.sleep(api.latency * 2)
+        coalesced = Sophia.reaction_batcher.coalesced if mode == "batched" else 0
+        print(f"{mode:>9} {percentile(latencies, 0.5) * 1000:>7.0f}ms {percentile(latencies, 0.99) * 1000:>7.0f}ms "
+              f"{api.calls:>10} {api.edits:>7} {coalesced:>10}")
+
+
+def measure_cooldowns(n, hit, rate):
+    # n distinct users, `rate` per second on a simulated clock; returns the allocated
+    # bytes left at the end, the peak, and the cost per check
+    tracemalloc.start()
+    start = time.perf_counter()
+    for i in range(n):
+        hit(BASE_OWNER_ID + i, i / rate)
+    elapsed = time.perf_counter() - start
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return current, peak, elapsed / n
+
+
+async def bench_cooldowns(args, workdir, rate=1000):
+    # Memory held by reaction cooldowns once n distinct users have reacted, 1000 per second
+    print(f"{'users':>8} {'store':>7} {'entries':>8} {'held':>10} {'peak':>10} {'per check':>10}")
+    for n in args.sizes:
+        legacy = {}
+
+        def legacy_hit(user_id, now):
+            if now - legacy.get(user_id, -math.inf) < Sophia.REACTION_COOLDOWN:
+                return True
+            legacy[user_id] = now
+
+        store = Sophia.CooldownStore(Sophia.REACTION_COOLDOWN)
+        for name, hit, entries in (("dict", legacy_hit, legacy.__len__), ("wheel", store.hit, store.__len__)):
+            held, peak, per_check = measure_cooldowns(n, hit, rate)
+            print(f"{n:>8} {name:>7} {entries():>8} {held / 2**20:>8.1f}MB {peak / 2**20:>8.1f}MB "
+                  f"{per_check * 1e9:>8.0f}ns")
+        del legacy
+
+
+async def bench_perf(args, workdir, n_pets=1000):
+    # Cost of instrumentation: the same handlers with metrics on and off
+    await use_database(os.path.join(workdir, "perf.db"))
+    await populate(n_pets)
+    owner_ids = [BASE_OWNER_ID + i for i in range(n_pets)]
+    for owner_id in owner_ids:
+        await Sophia.pet_cache.get(owner_id)
+
+    async def api_request():
+        await asyncio.sleep(0)  # Stands in for an HTTP round trip
+    api = Sophia.metrics.wrap_api(api_request)
+
+    async def reaction(owner_id):
+        pet = await Sophia.pet_cache.get(owner_id)
+        pet.feed()
+        Sophia.pet_cache.mark_dirty(pet)
+        await api()
+
+    async def status(owner_id):
+        async with Sophia.db.reader() as conn:
+            await Sophia.fetch_pets(conn, "WHERE owner_id = ?", (owner_id,))
+        await api()
+
+    async def gift(owner_id):
+        await Sophia.adjust_coins(owner_id, 1)
+        await api()
+
+    def run(handler):
+        async def loop():
+            for i in range(args.ops):
+                with Sophia.metrics.span(handler.__name__):
+                    await handler(owner_ids[i % n_pets])
+        return loop
+
+    # The handlers only do local work; real ones also wait on Discord, so the cost is also
+    # shown against a run that includes even a fast 1ms API round trip
+    print(f"{'handler':>9} {'off':>9} {'on':>9} {'per run':>9} {'overhead':>9} {'w/ 1ms API':>10}")
+    for handler in (reaction, status, gift):
+        best = {True: math.inf, False: math.inf}
+        for _ in range(5):  # Alternate so drift hits both sides alike
+            for enabled in (False, True):
+                Sophia.metrics.set_enabled(enabled)
+                best[enabled] = min(best[enabled], await best_of(run(handler), 1))
+        off, on = best[False] / args.ops, best[True] / args.ops
+        print(f"{handler.__name__:>9} {off * 1e6:>7.1f}us {on * 1e6:>7.1f}us {(on - off) * 1e6:>+7.1f}us "
+              f"{(on - off) / off:>+9.1%} {(on - off) / (off + 0.001):>+10.2%}")
+    Sophia.metrics.set_enabled(True)
+
+
+def rss_mb():
+    # Resident set size now; /proc is Linux-only, elsewhere fall back to the peak
+    try:
+        with open("/proc/self/statm") as statm:
+            return int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2**20
+    except OSError:
+        return peak_rss_mb()
+
+
+def peak_rss_mb():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / 2**20 if sys.platform == "darwin" else peak / 1024
+
+
+def latency_ms(samples):
+    if not samples:
+        return {}
+    return {
+        "p50": percentile(samples, 0.5) * 1000,
+        "p95": percentile(samples, 0.95) * 1000,
+        "p99": percentile(samples, 0.99) * 1000,
+        "max": max(samples) * 1000,
+    }
+
+
+async def invoke(api, name, author_id, *args):
+    # Runs the command body the way MyBot.invoke does, minus argument parsing and checks
+    command = Sophia.bot.get_command(name)
+    ctx = FakeContext(FakeMember(author_id), FakeGuild(0), FakeChannel(api, 0))
+    with Sophia.metrics.span(command.qualified_name):
+        await command.callback(ctx, *args)
+
+
+async def replay(calls, concurrency):
+    # Runs (name, coroutine factory) pairs `concurrency` at a time; latencies per name
+    latencies = {}
+    pending = iter(calls)
+
+    async def worker():
+        for name, call in pending:
+            start = time.perf_counter()
+            await call()
+            latencies.setdefault(name, []).append(time.perf_counter() - start)
+
+    elapsed, _ = await timed(asyncio.gather(*(worker() for _ in range(concurrency))))
+    return elapsed, latencies
+
+
+async def flush_pets():
+    # What the save_pets job would do, so its writes are counted with the workload
+    with Sophia.metrics.span("save_pets", "job"):
+        await Sophia.pet_cache.flush()
+
+
+async def load_storm(args, api, rng, channels=20, rate=2000):
+    # Reactions arriving at `rate` per second over a few pet embeds. Latency is until the
+    # embed shows the reaction, since the handler itself only queues it
+    embeds = [FakeMessage(api, FakeChannel(api, c)) for c in range(channels)]
+    batcher = Sophia.reaction_batcher
+
+    async def react(i):
+        await asyncio.sleep(i / rate)
+        reaction = FakeReaction(rng.choice(["🍗", "🎾", "💤"]), embeds[i % channels])
+        start = time.perf_counter()
+        await Sophia.on_reaction_add(reaction, FakeUser(BASE_OWNER_ID + i % args.pets))
+        while reaction.message.id in batcher._pending or reaction.message.id in batcher._edits:
+            await asyncio.sleep(0.005)
+        return time.perf_counter() - start
+
+    elapsed, latencies = await timed(asyncio.gather(*(react(i) for i in range(args.ops))))
+    await batcher.drain()
+    await flush_pets()
+    while len(Sophia.message_deleter):
+        await asyncio.sleep(0.05)
+    return elapsed, {"reaction_add": latencies}
+
+
+ECONOMY_MIX = (  # Command, relative frequency
+    ("balance", 30),
+    ("gift", 20),
+    ("gamble", 20),
+    ("steal", 10),
+    ("buy", 10),
+    ("adventure", 10),
+)
+
+
+async def load_economy(args, api, rng, concurrency=64):
+    def call(name):
+        author = BASE_OWNER_ID + rng.randrange(args.pets)
+        other = FakeMember(BASE_OWNER_ID + rng.randrange(args.pets))
+        extra = {
+            "gift": (other, rng.randint(1, 50)),
+            "gamble": (rng.randint(1, 50),),
+            "steal": (other,),
+            "buy": (rng.choice(list(Sophia.SHOP_ITEMS)),),
+        }.get(name, ())
+        return name, lambda: invoke(api, name, author, *extra)
+
+    names, weights = zip(*ECONOMY_MIX)
+    result = await replay([call(name) for name in rng.choices(names, weights, k=args.ops)], concurrency)
+    await flush_pets()
+    return result
+
+
+async def load_leaderboard(args, api, rng, concurrency=64):
+    # ~mostcoins and ~leaderboard pages, mostly the first few
+    pages = max(1, args.pets // Sophia.LEADERBOARD_PAGE_SIZE)
+
+    def call():
+        if rng.random() < 0.3:
+            return "mostcoins", lambda: invoke(api, "mostcoins", BASE_OWNER_ID)
+        page = min(pages, int(rng.paretovariate(1.2)))
+        return "leaderboard", lambda: invoke(api, "leaderboard", BASE_OWNER_ID, page)
+
+    return await replay([call() for _ in range(args.ops)], concurrency)
+
+
+async def load_ticks(args, api, rng, hours=3):
+    # Eager hourly ticks over the whole world, one after another
+    now = time.time()
+    latencies = []
+    for hour in range(1, hours + 1):
+        with Sophia.metrics.span("status_tick", "job"):
+            elapsed, _ = await timed(Sophia.run_status_tick(now + hour * Sophia.TICK_INTERVAL))
+        latencies.append(elapsed)
+    return sum(latencies), {"status_tick": latencies}
+
+
+LOAD_WORKLOADS = {  # Workload, argument holding the number of pets it runs against
+    "storm": (load_storm, "pets"),
+    "economy": (load_economy, "pets"),
+    "leaderboard": (load_leaderboard, "pets"),
+    "ticks": (load_ticks, "tick_pets"),
+}
+
+
+def load_result(n, elapsed, latencies, api, rss_before):
+    samples = [sample for runs in latencies.values() for sample in runs]
+    timings = {name: timing for kind in Sophia.metrics.timings.values() for name, timing in kind.items()}
+    handlers = {}
+    for handler, runs in latencies.items():
+        handlers[handler] = {"ops": len(runs), "latency_ms": latency_ms(runs)}
+        timing = timings.get(handler)
+        if timing is not None:
+            handlers[handler].update({
+                "db_commits": timing.commits,
+                "db_queries": timing.queries,
+                "time_seconds": {"db": timing.db, "api": timing.api, "python": timing.python},
+            })
+    return {
+        "pets": n,
+        "ops": len(samples),
+        "seconds": elapsed,
+        "ops_per_second": len(samples) / elapsed,
+        "latency_ms": latency_ms(samples),
+        "db_commits": sum(timing.commits for timing in timings.values()),
+        "db_queries": sum(timing.queries for timing in timings.values()),
+        "api_calls": api.calls,
+        "rss_mb": rss_mb(),
+        "rss_growth_mb": rss_mb() - rss_before,
+        "peak_rss_mb": peak_rss_mb(),
+        "handlers": handlers,
+    }
+
+
+async def bench_load(args, workdir):
+    # The real handlers under synthetic load, with commits counted by Sophia.metrics
+    results = {}
+    print(f"{'workload':>12} {'pets':>7} {'ops/s':>9} {'p50':>9} {'p99':>9} {'commits':>8} {'API':>6} {'RSS':>8}")
+    for name in args.workloads:
+        workload, pets = LOAD_WORKLOADS[name]
+        n = getattr(args, pets)
+        await use_database(os.path.join(workdir, f"load_{name}.db"))
+        Sophia.pet_cache = Sophia.PetCache()
+        Sophia.message_deleter = Sophia.MessageDeleter()
+        Sophia.reaction_batcher = Sophia.ReactionBatcher()
+        Sophia.write_queue = Sophia.WriteQueue()
+        Sophia.coin_board = Sophia.CoinLeaderboard()
+        Sophia.MESSAGE_DELETE_DELAY = 0.5
+        Sophia.cooldowns.clear()
+        await populate(n)
+        api = FakeDiscord(args.api_latency)
+        api.call = Sophia.metrics.wrap_api(api.call)  # Counted as API time, like bot.http.request
+        Sophia.metrics.set_enabled(True)
+        Sophia.metrics.reset()
+        rss_before = rss_mb()
+        elapsed, latencies = await workload(SimpleNamespace(ops=args.ops, pets=n), api, random.Random(22))
+        result = results[name] = load_result(n, elapsed, latencies, api, rss_before)
+        print(f"{name:>12} {n:>7} {result['ops_per_second']:>9.1f} {result['latency_ms']['p50']:>7.1f}ms "
+              f"{result['latency_ms']['p99']:>7.1f}ms {result['db_commits']:>8} {api.calls:>6} "
+              f"{result['rss_mb']:>6.0f}MB")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)["workloads"]
+        print(f"{'vs baseline':>12} {'ops/s':>9} {'p99':>9} {'commits':>9}")
+        for name, result in results.items():
+            if name in baseline:
+                before = baseline[name]
+                print(f"{name:>12} {result['ops_per_second'] / before['ops_per_second'] - 1:>+9.1%} "
+                      f"{result['latency_ms']['p99'] / before['latency_ms']['p99'] - 1:>+9.1%} "
+                      f"{result['db_commits'] - before['db_commits']:>+9}")
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({
+                "created": time.time(),
+                "python": platform.python_version(),
+                "sqlite": sqlite3.sqlite_version,
+                "api_latency": args.api_latency,
+                "ops": args.ops,
+                "workloads": results,
+            }, f, indent=2)
+        print(f"results written to {args.json}")
+
+
+async def first_gets(owner_ids):
+    # What the first commands after a restart do: look up their pet
+    start = time.perf_counter()
+    for owner_id in owner_ids:
+        await Sophia.pet_cache.get(owner_id)
+    return (time.perf_counter() - start) / len(owner_ids)
+
+
+async def bench_startup(args, workdir, active_every=10, first=200):
+    # Schema check on every boot, unversioned (every step re-checked in a write
+    # transaction) vs versioned, then the first lookups after boot, cold vs preloaded
+    print(f"{'pets':>8} {'unversioned':>12} {'versioned':>10} {'preload':>9} {'cold get':>9} {'warm get':>9}")
+    for n in args.sizes:
+        await use_database(os.path.join(workdir, f"startup_{n}.db"))
+        await populate(n)
+        async with Sophia.db.writer() as conn:
+            await conn.execute(f"UPDATE pets SET last_active = birth_time WHERE owner_id % {active_every} = 0")
+        async with Sophia.db.reader() as conn:
+            async with conn.execute("SELECT owner_id FROM pets WHERE last_active IS NOT NULL "
+                                    "ORDER BY last_active DESC LIMIT ?", (first,)) as cursor:
+                active = [row[0] for row in await cursor.fetchall()]
+
+        async def unversioned():
+            async with Sophia.db.writer() as conn:
+                await conn.execute("PRAGMA user_version = 0")
+            await Sophia.initialize_database()
+        legacy = await best_of(unversioned, 3)
+        versioned = await best_of(Sophia.initialize_database, 3)
+
+        Sophia.pet_cache = Sophia.PetCache()
+        cold = await first_gets(active)
+        Sophia.pet_cache = Sophia.PetCache()
+        preload, _ = await timed(Sophia.preload_active_pets())
+        warm = await first_gets(active)
+        print(f"{n:>8} {legacy * 1000:>10.2f}ms {versioned * 1000:>8.2f}ms {preload * 1000:>7.1f}ms "
+              f"{cold * 1e6:>7.0f}us {warm * 1e6:>7.0f}us")
+
+
+async def legacy_export(path):
+    # The whole table as a list of dicts, then written out in one go
+    async with Sophia.db.reader() as conn:
+        async with conn.execute(f"SELECT {', '.join(Sophia.EXPORT_COLUMNS)} FROM pets") as cursor:
+            pets = [dict(zip(Sophia.EXPORT_COLUMNS, row)) for row in await cursor.fetchall()]
+    with gzip.open(path, "wt") as f:
+        f.writelines(json.dumps(pet) + "\n" for pet in pets)
+    return len(pets)
+
+
+async def table_digest():
+    async with Sophia.db.reader() as conn:
+        async with conn.execute(f"SELECT {', '.join(Sophia.EXPORT_COLUMNS)} FROM pets ORDER BY owner_id") as cursor:
+            return hash(tuple(await cursor.fetchall()))
+
+
+async def traced_peak(coro):
+    # Peak Python allocations while `coro` runs
+    tracemalloc.start()
+    try:
+        await coro
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+async def bench_dump(args, workdir):
+    # Export time and peak memory, legacy fetchall vs streaming, then a round trip
+    # through each format into an empty database
+    print(f"{'pets':>8} {'mode':>12} {'seconds':>8} {'peak mem':>9} {'file':>8} {'import':>8} {'round trip':>11}")
+    for n in args.sizes:
+        await use_database(os.path.join(workdir, f"dump_{n}.db"))
+        Sophia.pet_cache = Sophia.PetCache()  # Nothing left over from earlier benchmarks to flush in
+        await populate(n)
+        digest = await table_digest()
+        for mode in ("legacy", "ndjson", "csv"):
+            path = os.path.join(workdir, f"pets_{n}.{'ndjson' if mode == 'legacy' else mode}.gz")
+            export = (lambda: legacy_export(path)) if mode == "legacy" else (lambda: Sophia.export_pets(path))
+            elapsed, _ = await timed(export())
+            peak = await traced_peak(export())
+            size = os.path.getsize(path)
+            imported, check = "", ""
+            if mode != "legacy":
+                await use_database(os.path.join(workdir, f"dump_{n}_{mode}.db"))
+                seconds, _ = await timed(Sophia.import_pets(path))
+                imported = f"{seconds:.2f}s"
+                check = "OK" if await table_digest() == digest else "MISMATCH"
+                await use_database(os.path.join(workdir, f"dump_{n}.db"))
+            print(f"{n:>8} {mode:>12} {elapsed:>7.2f}s {peak / 2**20:>7.1f}MB {size / 2**20:>6.1f}MB "
+                  f"{imported:>8} {check:>11}")
+            if check == "MISMATCH":
+                raise SystemExit(1)
+
+
+async def loop_lag(stop, interval=0.001):
+    # How late the event loop wakes a 1ms sleeper, sampled until `stop` is set
+    lags = []
+    while not stop.is_set():
+        start = time.perf_counter()
+        await asyncio.sleep(interval)
+        lags.append(time.perf_counter() - start - interval)
+    return lags
+
+
+async def keep_writing(stop, n, rng):
+    # Live traffic while the backup runs: small coin updates, each its own commit
+    writes = 0
+    while not stop.is_set():
+        async with Sophia.db.writer() as conn:
+            await conn.execute("UPDATE pets SET coins = coins + 1 WHERE owner_id = ?",
+                               (BASE_OWNER_ID + rng.randrange(n),))
+        writes += 1
+        await asyncio.sleep(0.002)
+    return writes
+
+
+def blocking_backup(source_path, path):
+    # The naive version: the whole copy and check on the event loop thread
+    source, target = sqlite3.connect(source_path), sqlite3.connect(path)
+    try:
+        source.backup(target)
+        return target.execute("PRAGMA quick_check").fetchone()[0]
+    finally:
+        source.close()
+        target.close()
+
+
+def file_digest(path):
+    with contextlib.closing(sqlite3.connect(path)) as conn:
+        return hash(tuple(conn.execute(f"SELECT {', '.join(Sophia.EXPORT_COLUMNS)} FROM pets ORDER BY owner_id")))
+
+
+async def bench_backup(args, workdir, keep=3):
+    # Event loop lag (what every command waits on) while backing up under live writes:
+    # no backup, the copy run on the loop, and backup_database; then a quiet backup
+    # compared row for row, and rotation
+    print(f"{'pets':>8} {'mode':>9} {'seconds':>8} {'size':>8} {'lag p99':>8} {'lag max':>8} {'writes':>7} {'copy':>22}")
+    for n in args.sizes:
+        await use_database(os.path.join(workdir, f"backup_{n}.db"))
+        await populate(n)
+        directory = os.path.join(workdir, f"backups_{n}")
+        for mode in ("idle", "blocking", "online"):
+            stop = asyncio.Event()
+            lag = asyncio.create_task(loop_lag(stop))
+            writes = asyncio.create_task(keep_writing(stop, n, random.Random(n)))
+            await asyncio.sleep(0.05)
+            start = time.perf_counter()
+            size, copy = 0, ""
+            if mode == "idle":
+                await asyncio.sleep(0.2)
+            elif mode == "blocking":
+                path = os.path.join(workdir, f"blocking_{n}.db")
+                copy = f"quick_check {blocking_backup(Sophia.db.path, path)}"
+                size = os.path.getsize(path)
+            else:
+                stats = await Sophia.backup_database(directory, keep)
+                size = stats["bytes"]
+                copy = f"{stats['steps']} steps, {stats['restarts']} restarts{'' if stats['stepped'] else ', then 1'}"
+            elapsed = time.perf_counter() - start
+            await asyncio.sleep(0.05)
+            stop.set()
+            lags, writes = await lag, await writes
+            print(f"{n:>8} {mode:>9} {elapsed:>7.2f}s {size / 2**20:>6.1f}MB {percentile(lags, 0.99) * 1000:>6.1f}ms "
+                  f"{max(lags) * 1000:>6.1f}ms {writes:>7} {copy:>22}")
+
+        stats = await Sophia.backup_database(directory, keep)
+        check = "OK" if file_digest(stats["path"]) == await table_digest() else "MISMATCH"
+        for _ in range(keep):
+            await Sophia.backup_database(directory, keep)
+        backups = [name for name in os.listdir(directory) if name.endswith(".db")]
+        rotated = "OK" if len(backups) == keep and os.path.basename(stats["path"]) not in backups else "FAILED"
+        print(f"{n:>8} quiet copy {check}, rotation keeps {len(backups)} of {keep + 2}: {rotated}")
+        if (check, rotated) != ("OK", "OK"):
+            raise SystemExit(1)
+
+
+BENCHMARKS = {
+    "tick": bench_tick,
+    "lazy": bench_lazy,
+    "economy": bench_economy,
+    "writes": bench_writes,
+    "leaderboard": bench_leaderboard,
+    "mostcoins": bench_mostcoins,
+    "reactions": bench_reactions,
+    "cooldowns": bench_cooldowns,
+    "coins": bench_coins,
+    "decode": bench_decode,
+    "table": bench_table,
+    "weather": bench_weather,
+    "shards": bench_shards,
+    "service": bench_service,
+    "queue": bench_queue,
+    "perf": bench_perf,
+    "load": bench_load,
+    "startup": bench_startup,
+    "dump": bench_dump,
+    "backup": bench_backup,
+}
+
+
+async def main(args):
+    unknown = set(args.benchmarks) - set(BENCHMARKS)
+    if unknown:
+        raise SystemExit(f"unknown benchmark(s): {', '.join(sorted(unknown))}")
+    with tempfile.TemporaryDirectory() as workdir:
+        try:
+            for name in args.benchmarks or BENCHMARKS:
+                print(f"== {name}")
+                await BENCHMARKS[name](args, workdir)
+        finally:
+            await Sophia.db.close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("benchmarks", nargs="*", metavar="benchmark",
+                        help=f"any of: {', '.join(BENCHMARKS)} (default: all)")
+    parser.add_argument("--sizes", nargs="+", type=int, default=[1000, 10000, 100000])
+    parser.add_argument("--ops", type=int, default=5000, help="operations per run for workload benchmarks")
+    parser.add_argument("--workers", type=int, default=4, help="worker processes for the service benchmark")
+    parser.add_argument("--workloads", nargs="+", choices=list(LOAD_WORKLOADS), default=list(LOAD_WORKLOADS),
+                        help="load workloads to replay (default: all)")
+    parser.add_argument("--pets", type=int, default=10000, help="pets for the storm, economy and leaderboard loads")
+    parser.add_argument("--tick-pets", type=int, default=100000, help="pets for the ticks load")
+    parser.add_argument("--api-latency", type=float, default=0.03, help="seconds per fake Discord API call")
+    parser.add_argument("--json", help="write the load results to this file")
+    parser.add_argument("--baseline", help="earlier --json output to compare the load results with")
+    asyncio.run(main(parser.parse_args()))